@@ -1,7 +1,9 @@
-from flask import Flask
+from flask import Flask, Response
 from threading import Thread
 import os
 
+from metrics import CONTENT_TYPE, REGISTRY
+
 app = Flask('')
 
 @app.route('/')
@@ -9,6 +11,11 @@ def home():
     # دي الرسالة اللي بيشوفها UptimeRobot لما بيزور الرابط
     return "Hello!is alive!"
 
+@app.route('/metrics')
+def metrics():
+    # نفس المقاييس التي يعرضها خادم البوت (Prometheus text format)
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 def _run():
     # تشغيل السيرفر على الـ Host والـ Port اللي بيستخدمهم Replit
     host = os.environ.get("HOST", "0.0.0.0")
@@ -0,0 +1,102 @@
+import random
+from typing import Dict, Optional, Tuple
+
+from engine import CELL_BITS, FULL_BOARD, WIN_TABLE
+
+# 🤖 مستويات البوت
+DIFFICULTIES = ("random", "greedy", "perfect")
+
+# (بتات X، بتات O) -> أفضل خانة للاعب صاحب الدور
+_solved: Optional[Dict[Tuple[int, int], int]] = None
+
+
+def _side_to_move(x_bits: int, o_bits: int) -> str:
+    # X يبدأ دائماً، فعدد حركات متساوٍ يعني دور X
+    return "X" if bin(x_bits).count("1") == bin(o_bits).count("1") else "O"
+
+
+def solve() -> Dict[Tuple[int, int], int]:
+    """
+    Solve every reachable position by negamax with a transposition table.
+
+    Returns:
+        dict: (x_bits, o_bits) -> best cell (0-8) for the side to move,
+        for every reachable non-terminal position. Faster wins and slower
+        losses are preferred.
+    """
+    scores: Dict[Tuple[int, int], int] = {}
+    best: Dict[Tuple[int, int], int] = {}
+
+    def negamax(me: int, other: int, x_to_move: bool) -> int:
+        key = (me, other) if x_to_move else (other, me)
+        cached = scores.get(key)
+        if cached is not None:
+            return cached
+        occupied = me | other
+        best_score = -100
+        best_cell = -1
+        for cell in range(9):
+            bit = CELL_BITS[cell]
+            if occupied & bit:
+                continue
+            placed = me | bit
+            if WIN_TABLE[placed]:
+                # فوز فوري: كلما كان أبكر كان أفضل
+                score = 10 - bin(occupied).count("1")
+            elif placed | other == FULL_BOARD:
+                score = 0
+            else:
+                score = -negamax(other, placed, not x_to_move)
+            if score > best_score:
+                best_score, best_cell = score, cell
+        scores[key] = best_score
+        best[key] = best_cell
+        return best_score
+
+    negamax(0, 0, True)
+    return best
+
+
+def solved_table() -> Dict[Tuple[int, int], int]:
+    """جدول اللعب المثالي (يُحسب مرة واحدة عند أول استخدام)"""
+    global _solved
+    if _solved is None:
+        _solved = solve()
+    return _solved
+
+
+def _empty_cells(x_bits: int, o_bits: int):
+    occupied = x_bits | o_bits
+    return [i for i in range(9) if not occupied & CELL_BITS[i]]
+
+
+def _greedy_move(x_bits: int, o_bits: int, rng: random.Random) -> int:
+    me, other = (x_bits, o_bits) if _side_to_move(x_bits, o_bits) == "X" else (o_bits, x_bits)
+    empty = _empty_cells(x_bits, o_bits)
+    # فوز إن أمكن، ثم منع الخصم، ثم المركز، ثم أي خانة
+    for bits in (me, other):
+        for cell in empty:
+            if WIN_TABLE[bits | CELL_BITS[cell]]:
+                return cell
+    if 4 in empty:
+        return 4
+    return rng.choice(empty)
+
+
+def choose_move(x_bits: int, o_bits: int, difficulty: str = "perfect",
+                rng: Optional[random.Random] = None) -> int:
+    """
+    Pick the bot's cell for the side to move.
+
+    Returns:
+        int: cell index 0-8 (row * 3 + col)
+    """
+    rng = rng or random
+    if difficulty == "perfect":
+        cell = solved_table().get((x_bits, o_bits))
+        if cell is not None:
+            return cell
+    elif difficulty == "greedy":
+        return _greedy_move(x_bits, o_bits, rng)
+    return rng.choice(_empty_cells(x_bits, o_bits))
+
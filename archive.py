@@ -0,0 +1,365 @@
+import csv
+import json
+import logging
+import os
+import struct
+import time
+from collections import defaultdict
+from typing import IO, Any, DefaultDict, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from ai import DIFFICULTIES
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 🗄️ صيغة الأرشيف
+#
+# كل مقطع: رأس (XOMA + الإصدار) ثم سجلات متتالية، كل سجل: الطول (B) + الحمولة.
+# الحمولة: _MATCH ثم خانات الحركات بالترتيب، 4 بتات للخانة إن كانت اللوحة
+# 16 خانة أو أقل و5 بتات للأكبر (9 حركات على 3×3 = 5 بايت).
+# سجل ناقص في نهاية مقطع (انقطاع أثناء الكتابة) يُتجاهل، وكل تشغيل يبدأ مقطعاً جديداً.
+# ----------------------------------------------------------------------
+
+_HEADER = struct.Struct("<4sB")
+_MAGIC = b"XOMA"
+_VERSION = 1
+
+# وقت النهاية (epoch)، user_id، الخصم (0 بدونه)، المدة بالثواني، الوضع<<4|المستوى، الثيم،
+# الفائز<<4|طريقة النهاية، الحجم<<4|K، عدد الحركات، عدد الحركات المعروفة ترتيبها
+_MATCH = struct.Struct("<IqqHBBBBBB")
+_MAX_DURATION = 0xFFFF
+
+# الرموز تُضاف في النهاية فقط: الأرشيف القديم يُقرأ بنفس الأرقام
+MODES = ("normal", "timed", "bot", "pvp")
+ENDINGS = ("line", "draw", "timeout", "resign")
+WINNERS = (None, "X", "O")
+
+FIELDS = ("ended_at", "user_id", "opponent_id", "mode", "level", "theme", "winner", "ending",
+          "size", "k", "duration", "move_count", "moves")
+
+
+class Match(NamedTuple):
+    """One finished game as read back from the archive."""
+
+    ended_at: int
+    user_id: int
+    opponent_id: Optional[int]
+    mode: str
+    level: Optional[str]
+    theme: str
+    winner: Optional[str]
+    ending: str
+    size: int
+    k: int
+    duration: int
+    move_count: int
+    # الخانات بالترتيب؛ أقصر من move_count إن استُعيدت اللعبة من لقطة
+    moves: Tuple[int, ...]
+
+    @property
+    def complete(self) -> bool:
+        return len(self.moves) == self.move_count
+
+
+def _cell_bits(size: int) -> int:
+    return 4 if size * size <= 16 else 5
+
+
+def pack_moves(moves: bytes, bits: int) -> bytes:
+    """الخانات بالترتيب في bits بت لكل خانة (الأولى في البتات الدنيا)"""
+    packed = 0
+    for i, cell in enumerate(moves):
+        packed |= cell << (i * bits)
+    return packed.to_bytes((len(moves) * bits + 7) // 8, "little")
+
+
+def unpack_moves(data: bytes, count: int, bits: int) -> Tuple[int, ...]:
+    packed = int.from_bytes(data, "little")
+    mask = (1 << bits) - 1
+    return tuple((packed >> (i * bits)) & mask for i in range(count))
+
+
+def _code(names: Sequence, name: Any) -> int:
+    try:
+        return names.index(name)
+    except ValueError:
+        return 0
+
+
+def _name(names: Sequence, code: int) -> Any:
+    return names[code] if code < len(names) else str(code)
+
+
+class MatchArchive:
+    """
+    Append-only binary archive of finished games, in rotated segments.
+
+    append() packs one game into a single record of about 35 bytes (the
+    move order included) and writes it with one os.write, so it is cheap
+    enough for the handler that ends the game. Segments live in
+    ``directory`` as ``<number>.xoa``; the archive rolls over to a new one
+    at every start and whenever the current one reaches ``segment_bytes``,
+    and deletes the oldest beyond ``max_segments``.
+
+    read() yields Match tuples one segment at a time, so exports and
+    aggregates (see FirstMoveWinRates, LengthByMode and aggregate()) are
+    single passes whose memory is bounded by one segment, whatever the
+    archive's size. Reading is safe from a worker thread while the event
+    loop appends.
+
+    ``themes`` lists theme names in a fixed order (new ones appended at the
+    end); records store the index. With ``directory=None`` every method is
+    a no-op and read() yields nothing.
+    """
+
+    def __init__(self, directory: Optional[str], themes: Sequence[str] = ("classic",),
+                 segment_bytes: int = 4 << 20, max_segments: int = 256):
+        self.directory = directory
+        self.themes = tuple(themes)
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._fd: Optional[int] = None
+        self._segment = 0
+        self._size = 0
+
+        # 📈 عدادات
+        self.appended = 0
+        self.appended_bytes = 0
+        self.rotations = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    # ------------------------------------------------------------------
+    # الملفات
+    # ------------------------------------------------------------------
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:08d}.xoa")
+
+    def segments(self) -> List[int]:
+        """أرقام المقاطع الموجودة بالترتيب"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            stem, dot, ext = name.partition(".")
+            if dot and ext == "xoa" and stem.isdigit():
+                found.append(int(stem))
+        return sorted(found)
+
+    def _open_segment(self, segment: int):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._segment = segment
+        self._fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        header = _HEADER.pack(_MAGIC, _VERSION)
+        os.write(self._fd, header)
+        self._size = len(header)
+        # الأقدم يُحذف حتى يبقى max_segments مقطعاً
+        existing = self.segments()
+        for old in existing[:max(0, len(existing) - self.max_segments)]:
+            try:
+                os.unlink(self._segment_path(old))
+            except OSError:
+                pass
+
+    def start(self):
+        """فتح مقطع جديد للكتابة (بعد آخر مقطع موجود)"""
+        if not self.enabled or self._fd is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        existing = self.segments()
+        self._open_segment(existing[-1] + 1 if existing else 0)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    # ------------------------------------------------------------------
+    # الكتابة (من الـ handlers على الـ event loop)
+    # ------------------------------------------------------------------
+
+    def append(self, game, mode: str, ending: str, winner: Optional[str], ended_at: Optional[float] = None):
+        """
+        Archive a finished game: ``mode`` and ``ending`` name entries of
+        MODES and ENDINGS, ``winner`` is "X", "O" or None.
+        """
+        if self._fd is None:
+            return
+        now = time.time() if ended_at is None else ended_at
+        shape = game.shape
+        moves = game.moves
+        level = DIFFICULTIES.index(game.vs_bot) + 1 if game.vs_bot else 0
+        duration = min(_MAX_DURATION, max(0, int(now - game.started_at)))
+        payload = _MATCH.pack(
+            int(now), game.user_id, game.opponent_id or 0, duration,
+            _code(MODES, mode) << 4 | level, _code(self.themes, game.theme),
+            _code(WINNERS, winner) << 4 | _code(ENDINGS, ending),
+            shape.size << 4 | shape.k, game.move_count, len(moves),
+        ) + pack_moves(moves, _cell_bits(shape.size))
+        record = bytes((len(payload),)) + payload
+        try:
+            os.write(self._fd, record)
+        except OSError as e:
+            # الأرشيف للتحليل فقط: خطأ في القرص لا يُفشل الحركة
+            self.errors += 1
+            logger.error(f"🗄️ Could not archive a match: {e}")
+            return
+        self.appended += 1
+        self.appended_bytes += len(record)
+        self._size += len(record)
+        if self._size >= self.segment_bytes:
+            self.rotations += 1
+            self._open_segment(self._segment + 1)
+
+    # ------------------------------------------------------------------
+    # القراءة (مولّدات؛ آمنة من خيط آخر)
+    # ------------------------------------------------------------------
+
+    def _decode(self, payload: bytes) -> Optional[Match]:
+        if len(payload) < _MATCH.size:
+            return None
+        (ended_at, user_id, opponent_id, duration, mode_level, theme, outcome,
+         board, move_count, known) = _MATCH.unpack_from(payload)
+        size, k = board >> 4, board & 0xF
+        level = mode_level & 0xF
+        return Match(
+            ended_at, user_id, opponent_id or None, _name(MODES, mode_level >> 4),
+            DIFFICULTIES[level - 1] if 0 < level <= len(DIFFICULTIES) else None,
+            _name(self.themes, theme), _name(WINNERS, outcome >> 4), _name(ENDINGS, outcome & 0xF),
+            size, k, duration, move_count,
+            unpack_moves(payload[_MATCH.size:], known, _cell_bits(size)),
+        )
+
+    def read_segment(self, segment: int) -> Iterator[Match]:
+        path = self._segment_path(segment)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            # حُذف أثناء القراءة (تدوير)
+            return
+        if len(data) < _HEADER.size or _HEADER.unpack_from(data) != (_MAGIC, _VERSION):
+            logger.error(f"🗄️ Skipping unreadable archive segment {path}")
+            return
+        offset = _HEADER.size
+        while offset < len(data):
+            length = data[offset]
+            end = offset + 1 + length
+            if end > len(data):
+                break
+            match = self._decode(data[offset + 1:end])
+            if match is not None:
+                yield match
+            offset = end
+
+    def read(self, since: int = 0) -> Iterator[Match]:
+        """All archived games, oldest first (``since``: only games that ended at or after this epoch)."""
+        for segment in self.segments():
+            for match in self.read_segment(segment):
+                if match.ended_at >= since:
+                    yield match
+
+    # ------------------------------------------------------------------
+    # التصدير والتجميع
+    # ------------------------------------------------------------------
+
+    def export(self, out: IO[str], fmt: str = "csv", since: int = 0) -> int:
+        """
+        Stream the archive to the text file ``out`` as CSV (moves joined
+        with "-") or JSON lines.
+
+        Returns:
+            the number of games written
+        """
+        written = 0
+        if fmt == "jsonl":
+            for match in self.read(since):
+                out.write(json.dumps(match._asdict(), separators=(",", ":")))
+                out.write("\n")
+                written += 1
+            return written
+        writer = csv.writer(out)
+        writer.writerow(FIELDS)
+        for match in self.read(since):
+            row = list(match)
+            row[2] = "" if match.opponent_id is None else match.opponent_id
+            row[4] = match.level or ""
+            row[6] = match.winner or ""
+            row[-1] = "-".join(map(str, match.moves))
+            writer.writerow(row)
+            written += 1
+        return written
+
+    def aggregate(self, *accumulators, since: int = 0) -> List[Any]:
+        """Feed every game to all ``accumulators`` in one pass; their results in order."""
+        for match in self.read(since):
+            for accumulator in accumulators:
+                accumulator.add(match)
+        return [accumulator.result() for accumulator in accumulators]
+
+    def metrics(self) -> Dict:
+        return {
+            "segment": self._segment,
+            "segment_bytes": self._size,
+            "appended": self.appended,
+            "appended_bytes": self.appended_bytes,
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
+
+
+class FirstMoveWinRates:
+    """
+    Outcome by opening cell: for each board (``"3x3"``, ...) and first
+    cell, how many games X (who always moves first) won, lost and drew.
+    Games whose move order is unknown are skipped.
+    """
+
+    def __init__(self):
+        # (اللوحة، الخانة) -> [فوز X، فوز O، تعادل]
+        self._counts: DefaultDict[Tuple[str, int], List[int]] = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, match: Match):
+        if not match.moves or not match.complete:
+            return
+        counts = self._counts[f"{match.size}x{match.size}", match.moves[0]]
+        counts[0 if match.winner == "X" else 1 if match.winner == "O" else 2] += 1
+
+    def result(self) -> Dict[str, Dict[int, Dict]]:
+        boards: Dict[str, Dict[int, Dict]] = {}
+        for (board, cell), (x_wins, o_wins, draws) in sorted(self._counts.items()):
+            games = x_wins + o_wins + draws
+            boards.setdefault(board, {})[cell] = {
+                "games": games,
+                "x_win_rate": round(x_wins / games, 4),
+                "o_win_rate": round(o_wins / games, 4),
+                "draw_rate": round(draws / games, 4),
+            }
+        return boards
+
+
+class LengthByMode:
+    """Games, average moves and average duration (seconds) per mode."""
+
+    def __init__(self):
+        # الوضع -> [عدد الألعاب، مجموع الحركات، مجموع الثواني]
+        self._totals: DefaultDict[str, List[int]] = defaultdict(lambda: [0, 0, 0])
+
+    def add(self, match: Match):
+        totals = self._totals[match.mode]
+        totals[0] += 1
+        totals[1] += match.move_count
+        totals[2] += match.duration
+
+    def result(self) -> Dict[str, Dict]:
+        return {
+            mode: {"games": games, "avg_moves": round(moves / games, 2), "avg_seconds": round(seconds / games, 1)}
+            for mode, (games, moves, seconds) in sorted(self._totals.items())
+        }
+
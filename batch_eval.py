@@ -0,0 +1,137 @@
+"""
+Vectorized evaluation of many boards at once (simulations, archive replay,
+checking AI tables): winner, draw and legal moves for arrays of bitboards,
+with the same rules as XOEngine.
+
+Needs numpy, which the bot itself does not (pip install numpy).
+"""
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+try:
+    import numpy as np
+except ImportError as e:
+    raise ImportError("batch_eval needs numpy (pip install numpy); the bot itself does not") from e
+
+from engine import CLASSIC, BoardShape
+
+# رموز الفائز في المصفوفات
+NONE = 0
+X = 1
+O = 2
+BOTH = 3  # الاثنان لهما خط: وضع لا يمكن الوصول إليه
+
+# حتى 16 خانة تُحسب الخطوط بجداول (65536 مدخلاً على الأكثر)، وفوقها بالمرور على كل خط
+_TABLE_CELLS = 16
+
+
+class BatchResult(NamedTuple):
+    """Per-board results; every field is an array with one entry per board."""
+
+    # NONE أو X أو O أو BOTH
+    winner: "np.ndarray"
+    # مثل XOEngine.is_draw: لا فائز واللوحة ممتلئة (3×3) أو لا خط يستطيع أي لاعب إكماله
+    draw: "np.ndarray"
+    # بتات الخانات الفارغة، صفر إن انتهت اللعبة
+    legal: "np.ndarray"
+    # X أو O صاحب الدور (X يبدأ دائماً)
+    to_move: "np.ndarray"
+    # لا خانة مشتركة وعدد علامات X يساوي O أو يزيد بواحدة
+    valid: "np.ndarray"
+
+
+@lru_cache(maxsize=None)
+def _line_tables(shape: BoardShape) -> Tuple["np.ndarray", "np.ndarray"]:
+    """
+    For every subset of cells: does it contain a full line, and which lines
+    (one bit per line number) does it touch.
+    """
+    boards = np.arange(1 << shape.cells, dtype=np.uint32)
+    wins = np.zeros(boards.shape, dtype=bool)
+    touched = np.zeros(boards.shape, dtype=np.uint32)
+    for number, mask in enumerate(shape.line_masks):
+        on_line = boards & np.uint32(mask)
+        wins |= on_line == mask
+        touched |= (on_line != 0).astype(np.uint32) << np.uint32(number)
+    return wins, touched
+
+
+def popcount(bits: "np.ndarray") -> "np.ndarray":
+    """عدد البتات في كل عنصر (uint32)"""
+    bits = bits.astype(np.uint32, copy=False)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).astype(np.int8)
+    count = np.zeros(bits.shape, dtype=np.int8)
+    for shift in range(32):
+        count += ((bits >> np.uint32(shift)) & np.uint32(1)).astype(np.int8)
+    return count
+
+
+def evaluate(x_bits: "np.ndarray", o_bits: "np.ndarray", shape: BoardShape = CLASSIC) -> BatchResult:
+    """
+    Evaluate boards given as two arrays of bitboards (bit i = cell i, as
+    in XOEngine.x_bits / o_bits).
+    """
+    x = np.asarray(x_bits).astype(np.uint32, copy=False)
+    o = np.asarray(o_bits).astype(np.uint32, copy=False)
+    full = np.uint32(shape.full)
+
+    if shape.cells <= _TABLE_CELLS:
+        wins, touched = _line_tables(shape)
+        x_wins, o_wins = wins[x], wins[o]
+        dead = (touched[x] & touched[o]) == shape.all_lines
+    else:
+        x_wins = np.zeros(x.shape, dtype=bool)
+        o_wins = np.zeros(x.shape, dtype=bool)
+        dead = np.ones(x.shape, dtype=bool)
+        for mask in shape.line_masks:
+            mask = np.uint32(mask)
+            x_on, o_on = x & mask, o & mask
+            x_wins |= x_on == mask
+            o_wins |= o_on == mask
+            dead &= (x_on != 0) & (o_on != 0)
+
+    if shape is CLASSIC:
+        # 3×3: التعادل عند امتلاء اللوحة فقط (مثل XOEngine)
+        dead = (x | o) == full
+    winner = x_wins.astype(np.int8) * X + o_wins.astype(np.int8) * O
+    draw = dead & (winner == NONE)
+    over = (winner != NONE) | draw
+    legal = np.where(over, np.uint32(0), ~(x | o) & full).astype(np.uint32)
+    x_count, o_count = popcount(x), popcount(o)
+    to_move = np.where(x_count == o_count, np.int8(X), np.int8(O))
+    valid = ((x & o) == 0) & ((x_count == o_count) | (x_count == o_count + 1))
+    return BatchResult(winner, draw, legal, to_move, valid)
+
+
+def from_cells(cells: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+    """Boards as an N×cells array (0 empty, 1 X, 2 O) -> (x_bits, o_bits)."""
+    cells = np.asarray(cells)
+    weights = np.uint32(1) << np.arange(cells.shape[1], dtype=np.uint32)
+    x = ((cells == X) * weights).sum(axis=1, dtype=np.uint32)
+    o = ((cells == O) * weights).sum(axis=1, dtype=np.uint32)
+    return x, o
+
+
+def cell_matrix(bits: "np.ndarray", shape: BoardShape = CLASSIC) -> "np.ndarray":
+    """Bitboards -> N×cells bool array (for example the legal moves of each board)."""
+    bits = np.asarray(bits).astype(np.uint32, copy=False)
+    return ((bits[:, None] >> np.arange(shape.cells, dtype=np.uint32)) & np.uint32(1)).astype(bool)
+
+
+def from_moves(moves: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    Replay move sequences: an N×L array of cells in order (X first), padded
+    with -1, as read back from the match archive.
+
+    Returns:
+        (x_bits, o_bits, repeated): ``repeated`` marks sequences that play
+        an occupied cell, which no real game can
+    """
+    moves = np.asarray(moves, dtype=np.int16)
+    played = moves >= 0
+    bits = np.where(played, np.uint32(1) << np.maximum(moves, 0).astype(np.uint32), np.uint32(0))
+    x = np.bitwise_or.reduce(bits[:, 0::2], axis=1).astype(np.uint32)
+    o = np.bitwise_or.reduce(bits[:, 1::2], axis=1).astype(np.uint32) if moves.shape[1] > 1 else np.zeros_like(x)
+    repeated = popcount(x | o) != played.sum(axis=1)
+    return x, o, repeated
@@ -0,0 +1,85 @@
+"""
+Match archive: append cost, bytes per game and single-pass scan speed.
+
+Plays random games on all three boards, archives them with
+MatchArchive.append() (as the handlers do when a game ends), then times
+a full read(), the standard aggregates and a CSV export, and compares
+the archive size with the same games as JSON lines.
+
+    python benchmarks/bench_archive.py [games]
+"""
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from archive import MODES, FirstMoveWinRates, LengthByMode, MatchArchive  # noqa: E402
+from engine import XOEngine, board_shape  # noqa: E402
+
+SHAPES = (board_shape(3, 3), board_shape(4, 4), board_shape(5, 4))
+
+
+class FinishedGame(XOEngine):
+    """The fields append() reads from a bot game."""
+
+    __slots__ = ("user_id", "opponent_id", "vs_bot", "theme", "started_at")
+
+
+def play(rng: random.Random, user_id: int) -> FinishedGame:
+    game = FinishedGame(rng.choice(SHAPES))
+    game.user_id, game.opponent_id, game.vs_bot = user_id, None, None
+    game.theme, game.started_at = "classic", time.time() - rng.randint(5, 120)
+    size = game.shape.size
+    while game.winner is None and not game.is_draw():
+        game.make_move(*divmod(rng.choice(game.empty_cells()), size))
+        if game.winner is None:
+            game.switch_player()
+    return game
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rng = random.Random(1)
+    games = [play(rng, 1_000_000 + i) for i in range(count)]
+
+    directory = tempfile.mkdtemp(prefix="xo_archive_")
+    archive = MatchArchive(directory, segment_bytes=1 << 20)
+    archive.start()
+    started = time.perf_counter()
+    for game in games:
+        archive.append(game, rng.choice(MODES[:3]), "line" if game.winner else "draw", game.winner)
+    append_seconds = time.perf_counter() - started
+    archive.close()
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    print(f"append      {append_seconds * 1e6 / count:8.2f} us/game   {size / count:6.1f} bytes/game  "
+          f"({len(archive.segments())} segments)")
+
+    started = time.perf_counter()
+    read = sum(1 for _ in archive.read())
+    seconds = time.perf_counter() - started
+    print(f"read        {read / seconds:10.0f} games/s")
+
+    started = time.perf_counter()
+    archive.aggregate(FirstMoveWinRates(), LengthByMode())
+    seconds = time.perf_counter() - started
+    print(f"aggregate   {read / seconds:10.0f} games/s (first-move rates + length by mode, one pass)")
+
+    out = io.StringIO()
+    started = time.perf_counter()
+    archive.export(out, "csv")
+    seconds = time.perf_counter() - started
+    print(f"csv export  {read / seconds:10.0f} games/s")
+
+    out = io.StringIO()
+    archive.export(out, "jsonl")
+    print(f"jsonl       {len(out.getvalue().encode()) / count:6.1f} bytes/game for the same games")
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Batch board evaluation (numpy) vs one XOEngine per board.
+
+First checks batch_eval.evaluate() against XOEngine on every position
+reachable on the 3×3 board, and on positions from random playouts on
+4×4 and 5×5 (four in a row): winner, draw, legal moves and side to
+move must all agree. from_moves() is checked by replaying the same
+playouts. Then times both on a large sample of positions.
+
+    python benchmarks/bench_batch_eval.py [positions]
+"""
+import os
+import random
+import sys
+import time
+from typing import List, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import batch_eval  # noqa: E402
+from engine import CLASSIC, BoardShape, XOEngine, board_shape  # noqa: E402
+
+_WINNERS = {None: batch_eval.NONE, "X": batch_eval.X, "O": batch_eval.O}
+
+
+def reachable(shape: BoardShape) -> List[Tuple[int, int]]:
+    """Every position reachable by legal play (games stop at a win or draw)."""
+    seen: Set[Tuple[int, int]] = set()
+    stack = [XOEngine(shape)]
+    while stack:
+        game = stack.pop()
+        key = (game.x_bits, game.o_bits)
+        if key in seen:
+            continue
+        seen.add(key)
+        if game.winner is not None or game.is_draw():
+            continue
+        for cell in game.empty_cells():
+            child = XOEngine(shape)
+            child.set_position(game.x_bits, game.o_bits, game.current_player)
+            child.make_move(*divmod(cell, shape.size))
+            child.switch_player()
+            stack.append(child)
+    return sorted(seen)
+
+
+def playouts(shape: BoardShape, games: int, rng: random.Random) -> Tuple[List[Tuple[int, int]], List[bytes]]:
+    """Random games: every position on the way, and each game's move order."""
+    positions, sequences = [], []
+    for _ in range(games):
+        game = XOEngine(shape)
+        positions.append((0, 0))
+        while game.winner is None and not game.is_draw():
+            game.make_move(*divmod(rng.choice(game.empty_cells()), shape.size))
+            game.switch_player()
+            positions.append((game.x_bits, game.o_bits))
+        sequences.append(bytes(game.moves))
+    return positions, sequences
+
+
+def expected(shape: BoardShape, x_bits: int, o_bits: int) -> Tuple[int, bool, int, int]:
+    """What XOEngine says about one position (the per-instance path)."""
+    to_move = "X" if bin(x_bits).count("1") == bin(o_bits).count("1") else "O"
+    game = XOEngine(shape)
+    game.set_position(x_bits, o_bits, to_move)
+    winner, draw = game.check_winner(), game.is_draw()
+    legal = 0 if winner is not None or draw else sum(1 << cell for cell in game.empty_cells())
+    return _WINNERS[winner], draw, legal, _WINNERS[to_move]
+
+
+def cross_check(shape: BoardShape, positions: List[Tuple[int, int]]):
+    x = np.array([p[0] for p in positions], dtype=np.uint32)
+    o = np.array([p[1] for p in positions], dtype=np.uint32)
+    result = batch_eval.evaluate(x, o, shape)
+    assert result.valid.all()
+    for i, (x_bits, o_bits) in enumerate(positions):
+        got = (int(result.winner[i]), bool(result.draw[i]), int(result.legal[i]), int(result.to_move[i]))
+        assert got == expected(shape, x_bits, o_bits), (shape, x_bits, o_bits, got)
+
+
+def check_replay(shape: BoardShape, sequences: List[bytes]):
+    width = max(map(len, sequences))
+    moves = np.full((len(sequences), width), -1, dtype=np.int16)
+    for i, sequence in enumerate(sequences):
+        moves[i, :len(sequence)] = list(sequence)
+    x, o, repeated = batch_eval.from_moves(moves)
+    assert not repeated.any()
+    for i, sequence in enumerate(sequences):
+        game = XOEngine(shape)
+        for cell in sequence:
+            game.make_move(*divmod(cell, shape.size))
+            game.switch_player()
+        assert (int(x[i]), int(o[i])) == (game.x_bits, game.o_bits)
+    # خانة مكررة في التسلسل
+    moves[0, 1] = moves[0, 0]
+    assert batch_eval.from_moves(moves)[2][0]
+
+
+def bench(shape: BoardShape, positions: List[Tuple[int, int]], count: int, rng: random.Random):
+    sample = [positions[rng.randrange(len(positions))] for _ in range(count)]
+    x = np.array([p[0] for p in sample], dtype=np.uint32)
+    o = np.array([p[1] for p in sample], dtype=np.uint32)
+
+    batch_eval.evaluate(x[:10], o[:10], shape)  # الجداول تُبنى مرة واحدة
+    started = time.perf_counter()
+    batch_eval.evaluate(x, o, shape)
+    batch = time.perf_counter() - started
+
+    per_board = min(count, 100_000)
+    started = time.perf_counter()
+    for x_bits, o_bits in sample[:per_board]:
+        expected(shape, x_bits, o_bits)
+    loop = (time.perf_counter() - started) * count / per_board
+
+    print(f"{shape.size}x{shape.size} k={shape.k}: {count} positions")
+    print(f"  XOEngine   {count / loop:12.0f} positions/s")
+    print(f"  batch      {count / batch:12.0f} positions/s   speedup {loop / batch:.0f}x")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    rng = random.Random(1)
+
+    classic = reachable(CLASSIC)
+    cross_check(CLASSIC, classic)
+    print(f"3x3: all {len(classic)} reachable positions agree with XOEngine")
+    samples = {CLASSIC: classic}
+    for shape in (board_shape(4, 4), board_shape(5, 4)):
+        positions, sequences = playouts(shape, 3000, rng)
+        cross_check(shape, positions)
+        check_replay(shape, sequences)
+        samples[shape] = positions
+        print(f"{shape.size}x{shape.size}: {len(positions)} playout positions and replays agree with XOEngine")
+    print()
+
+    for shape, positions in samples.items():
+        bench(shape, positions, count, rng)
+
+
+if __name__ == "__main__":
+    main()
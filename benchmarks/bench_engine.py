@@ -0,0 +1,152 @@
+"""
+Micro-benchmark: bitboard XOEngine vs the original list-of-lists board.
+
+Plays the same random move sequences through both implementations,
+calling make_move / check_winner / is_draw / switch_player after every
+move exactly like button() does. The larger boards (4×4 and 5×5, four in
+a row) compare the incremental checks against scanning every line after
+each move and waiting for a full board to call a draw.
+
+    python benchmarks/bench_engine.py [games]
+"""
+import os
+import random
+import sys
+import time
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import BoardShape, XOEngine, board_shape  # noqa: E402
+
+
+class LegacyBoard:
+    """The pre-bitboard XOGame logic, kept here only for comparison."""
+
+    def __init__(self):
+        self.board: List[List[str]] = [[" " for _ in range(3)] for _ in range(3)]
+        self.current_player = "X"
+        self.move_count = 0
+
+    def make_move(self, row: int, col: int) -> bool:
+        if self.board[row][col] == " ":
+            self.board[row][col] = self.current_player
+            self.move_count += 1
+            return True
+        return False
+
+    def check_winner(self) -> Optional[str]:
+        for i in range(3):
+            if self.board[i][0] == self.board[i][1] == self.board[i][2] != " ":
+                return self.board[i][0]
+        for i in range(3):
+            if self.board[0][i] == self.board[1][i] == self.board[2][i] != " ":
+                return self.board[0][i]
+        if self.board[0][0] == self.board[1][1] == self.board[2][2] != " ":
+            return self.board[1][1]
+        if self.board[0][2] == self.board[1][1] == self.board[2][0] != " ":
+            return self.board[1][1]
+        return None
+
+    def is_draw(self) -> bool:
+        return self.move_count == 9 and self.check_winner() is None
+
+    def switch_player(self):
+        self.current_player = "O" if self.current_player == "X" else "X"
+
+
+class FullScanBoard:
+    """N×N bitboards that check every line after each move."""
+
+    def __init__(self, shape: BoardShape):
+        self.shape = shape
+        self.x_bits = self.o_bits = 0
+        self.current_player = "X"
+
+    def make_move(self, row: int, col: int) -> bool:
+        bit = 1 << (row * self.shape.size + col)
+        if (self.x_bits | self.o_bits) & bit:
+            return False
+        if self.current_player == "X":
+            self.x_bits |= bit
+        else:
+            self.o_bits |= bit
+        return True
+
+    def check_winner(self) -> Optional[str]:
+        for mask in self.shape.line_masks:
+            if self.x_bits & mask == mask:
+                return "X"
+            if self.o_bits & mask == mask:
+                return "O"
+        return None
+
+    def is_draw(self) -> bool:
+        return (self.x_bits | self.o_bits) == self.shape.full and self.check_winner() is None
+
+    def switch_player(self):
+        self.current_player = "O" if self.current_player == "X" else "X"
+
+
+def play(factory, sequences, size=3):
+    results = []
+    for seq in sequences:
+        game = factory()
+        outcome = None
+        for cell in seq:
+            game.make_move(cell // size, cell % size)
+            outcome = game.check_winner()
+            if outcome:
+                break
+            if game.is_draw():
+                outcome = "draw"
+                break
+            game.switch_player()
+        results.append(outcome)
+    return results
+
+
+def bench(name, factory, sequences, repeat=5, size=3):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        play(factory, sequences, size)
+        best = min(best, time.perf_counter() - started)
+    moves = sum(len(s) for s in sequences)
+    print(f"{name:<10} {best * 1000:8.1f} ms  {best / moves * 1e9:7.0f} ns/move")
+    return best
+
+
+def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rng = random.Random(42)
+    sequences = []
+    for _ in range(games):
+        cells = list(range(9))
+        rng.shuffle(cells)
+        sequences.append(cells)
+
+    # نفس النتائج في الحالتين قبل القياس
+    assert play(LegacyBoard, sequences) == play(XOEngine, sequences)
+
+    legacy = bench("legacy", LegacyBoard, sequences)
+    bitboard = bench("bitboard", XOEngine, sequences)
+    print(f"speedup    {legacy / bitboard:.2f}x")
+
+    for size, k in ((4, 4), (5, 4)):
+        shape = board_shape(size, k)
+        sequences = []
+        for _ in range(games // 4):
+            cells = list(range(shape.cells))
+            rng.shuffle(cells)
+            sequences.append(cells)
+        # نفس الفائز، والتعادل يُكتشف مبكراً بدل انتظار امتلاء اللوحة
+        assert play(lambda: FullScanBoard(shape), sequences, size) == play(lambda: XOEngine(shape), sequences, size)
+        print(f"\n{size}x{size}, {k} in a row ({len(shape.line_masks)} lines)")
+        scan = bench("full scan", lambda: FullScanBoard(shape), sequences, size=size)
+        incremental = bench("incremental", lambda: XOEngine(shape), sequences, size=size)
+        print(f"speedup    {scan / incremental:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
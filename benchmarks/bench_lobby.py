@@ -0,0 +1,66 @@
+"""
+Matchmaking lobby at scale: join, pair and expire cost with many players waiting.
+
+Players tap a mode in random group chats (each either waits or is paired
+with the longest-waiting player of that queue); whoever is still waiting
+then times out through the timer heap (fake clock, no event-loop sleeps).
+The per-tap cost should stay flat as the number of waiting players grows.
+
+    python benchmarks/bench_lobby.py [players ...]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lobby import Lobby  # noqa: E402
+from timers import TimerService  # noqa: E402
+
+MODES = ("n", "t", "n4", "t4", "n5", "t5")
+
+
+async def run(players: int):
+    now = [0.0]
+    timers = TimerService(clock=lambda: now[0])
+    lobby = Lobby(timers, timeout=120.0)
+    expired = []
+
+    async def on_expire(ticket):
+        expired.append(ticket)
+
+    rng = random.Random(players)
+    groups = max(1, players // 8)
+    taps = [(-1000 - rng.randrange(groups), rng.choice(MODES), 10_000_000 + i) for i in range(players)]
+
+    # كل لاعب يضغط زر وضع في مجموعته: ينتظر أو يُقرن فوراً بأقدم منتظر
+    started = time.perf_counter()
+    paired = 0
+    for message_id, (chat, mode, user) in enumerate(taps):
+        if lobby.join(chat, mode, user, "P", message_id, on_expire) is not None:
+            paired += 1
+    joined = time.perf_counter() - started
+
+    # الباقون ينتهي انتظارهم من كومة المؤقتات دفعة واحدة
+    waiting = len(lobby)
+    now[0] += lobby.timeout + 1
+    started = time.perf_counter()
+    timers.run_due()
+    await asyncio.sleep(0)
+    expire = time.perf_counter() - started
+    return joined, paired, waiting, expire, len(expired), lobby.metrics()
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000]
+    for players in sizes:
+        joined, paired, waiting, expire, expired, metrics = asyncio.run(run(players))
+        print(f"{players} players: {joined / players * 1e6:.2f} us per join/pair, {paired} matches, "
+              f"{waiting} still waiting -> {expired} expired in {expire * 1000:.1f} ms")
+        print(f"  {metrics}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Priority scheduling under a menu burst: how long do game moves wait?
+
+A steady stream of moves from many chats runs at half the workers'
+capacity while a burst of stats/history/theme taps arrives all at once,
+so the backlog grows well past what the workers can clear in a second.
+Handlers just sleep a fixed service time (shed taps only a fast answer).
+The same arrivals run through ChatSerializedUpdateProcessor in arrival
+order (aging so fast that the oldest update always wins), with priorities
+and the default aging, and with load shedding of the delayed menu taps.
+
+    python benchmarks/bench_priority.py [--workers 8] [--service-ms 20] [--burst 2000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update  # noqa: E402
+
+import callbacks as cb  # noqa: E402
+from concurrency import ChatSerializedUpdateProcessor  # noqa: E402
+
+MENU_TAPS = (cb.encode(cb.STATS), cb.encode(cb.HISTORY), cb.encode(cb.CHANGE_THEME))
+
+
+def make_update(update_id: int, chat_id: int, data: str) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}},
+        },
+    }, None)
+
+
+async def run(variant: str, workers: int, service: float, burst: int, seconds: float):
+    async def fast_answer(update):
+        await asyncio.sleep(service / 4)
+
+    # aging قريب من الصفر: الأقدم أولاً مهما كانت فئته (ترتيب الوصول)
+    options = {"aging": 1e-9} if variant == "fifo" else {}
+    processor = ChatSerializedUpdateProcessor(
+        workers,
+        backlog=1_000_000,
+        shed_after=2.0 if variant == "shed" else 0.0,
+        on_shed=fast_answer,
+        **options,
+    )
+    move_rate = workers / service / 2
+    tasks = []
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    update_id = 0
+    burst_at = seconds / 5
+    sent_burst = False
+
+    # حركات بمعدل ثابت من محادثات مختلفة، ودفعة قوائم واحدة بعد خُمس المدة
+    while loop.time() - started < seconds:
+        update_id += 1
+        move = make_update(update_id, 1 + update_id % 10_000, cb.encode_move(4, "a"))
+        tasks.append(loop.create_task(processor.process_update(move, asyncio.sleep(service))))
+        if not sent_burst and loop.time() - started >= burst_at:
+            sent_burst = True
+            for i in range(burst):
+                update_id += 1
+                tap = make_update(update_id, 20_000 + i, MENU_TAPS[i % len(MENU_TAPS)])
+                tasks.append(loop.create_task(processor.process_update(tap, asyncio.sleep(service))))
+        await asyncio.sleep(1 / move_rate)
+    await asyncio.gather(*tasks)
+    return processor.metrics(), loop.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--service-ms", type=float, default=20.0)
+    parser.add_argument("--burst", type=int, default=2000, help="menu taps arriving at once")
+    parser.add_argument("--seconds", type=float, default=5.0, help="how long moves keep arriving")
+    args = parser.parse_args()
+
+    for variant in ("fifo", "priority", "shed"):
+        metrics, elapsed = asyncio.run(run(variant, args.workers, args.service_ms / 1000, args.burst, args.seconds))
+        delays = metrics["queue_delay"]
+        print(f"{variant:8s} drained in {elapsed:.1f}s, shed {sum(metrics['shed'].values())}")
+        for name in cb.PRIORITY_NAMES:
+            if delays[name].get("count"):
+                print(f"  {name:7s} {delays[name]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Startup cost of each storage backend as the user base grows.
+
+Writes the same users into xo_data.json, an indexed xo_data.ndjson and a
+SQLite database, then times opening each backend (what used to happen at
+import) and the first on-demand lookup of one user, plus the memory held
+right after opening.
+
+    python benchmarks/bench_startup.py [users ...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import BACKENDS, apply_results, empty_stats  # noqa: E402
+
+PATHS = {"json": "xo_data.json", "ndjson": "xo_data.ndjson", "sqlite": "xo_data.db"}
+
+
+def populate(workdir: str, users: int):
+    rng = random.Random(users)
+    now = int(time.time())
+    stats, themes = {}, {}
+    for user_id in range(10_000_000, 10_000_000 + users):
+        games = [{"ts": now - rng.randrange(86400 * 30), "result": rng.choice(("win", "loss", "draw"))}
+                 for _ in range(10)]
+        stats[str(user_id)] = apply_results(empty_stats(), games)
+        if rng.random() < 0.3:
+            themes[str(user_id)] = rng.choice(("space", "hearts", "emoji"))
+    for kind, name in PATHS.items():
+        backend = BACKENDS[kind](os.path.join(workdir, name))
+        backend.write_batch(stats, themes)
+        backend.close()
+
+
+def measure(kind: str, path: str, user_id: str):
+    tracemalloc.start()
+    started = time.perf_counter()
+    backend = BACKENDS[kind](path)
+    opened = time.perf_counter() - started
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    record = backend.get_stats(user_id)
+    lookup = time.perf_counter() - started
+    backend.close()
+    assert record and record["total_games"] == 10
+    return opened, lookup, held
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000]
+    for users in sizes:
+        workdir = tempfile.mkdtemp(prefix="xo_startup_")
+        populate(workdir, users)
+        user_id = str(10_000_000 + users // 2)
+        print(f"{users} users")
+        for kind, name in PATHS.items():
+            path = os.path.join(workdir, name)
+            opened, lookup, held = measure(kind, path, user_id)
+            print(f"  {kind:7s} file {os.path.getsize(path) / 2**20:7.1f} MiB  "
+                  f"open {opened * 1000:9.2f} ms  held {held / 2**20:7.1f} MiB  "
+                  f"first lookup {lookup * 1000:6.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
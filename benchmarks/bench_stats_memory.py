@@ -0,0 +1,100 @@
+"""
+Memory and serialized size: dict-per-user stats vs the columnar StatsTable.
+
+Builds the same users (full 10-game histories) both ways and reports
+tracemalloc bytes per user, plus the size of the old indented
+xo_data.json (formatted date strings) and of the compact JSON now
+written, whose history entries are [epoch, result code] pairs.
+
+    python benchmarks/bench_stats_memory.py [users]
+"""
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stats_table import RESULTS, StatsTable, format_date  # noqa: E402
+from storage import DATE_FORMAT, HISTORY_LIMIT, RESULT_CODES, apply_results, empty_stats  # noqa: E402
+
+
+def make_games(rng: random.Random, users: int):
+    now = int(time.time())
+    for user_id in range(10_000_000, 10_000_000 + users):
+        yield user_id, [(now - rng.randrange(86400 * 30), rng.choice(RESULTS)) for _ in range(HISTORY_LIMIT)]
+
+
+def build_legacy(games):
+    """Like the old update_stats(): dict per user, history of date-string dicts."""
+    stats = {}
+    for user_id, played in games:
+        record = {"wins": 0, "losses": 0, "draws": 0, "total_games": 0, "history": []}
+        for epoch, result in played:
+            record["total_games"] += 1
+            record[{"win": "wins", "loss": "losses", "draw": "draws"}[result]] += 1
+            record["history"].insert(0, {"date": time.strftime(DATE_FORMAT, time.localtime(epoch)), "result": result})
+            record["history"] = record["history"][:HISTORY_LIMIT]
+        stats[str(user_id)] = record
+    return stats
+
+
+def build_columnar(games):
+    table = StatsTable()
+    for user_id, played in games:
+        slot = table.add(user_id)
+        for epoch, result in played:
+            table.record(slot, result, epoch)
+    return table
+
+
+def measure(build, games):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = build(games)
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, used, elapsed
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    games = list(make_games(random.Random(1), users))
+
+    legacy, legacy_bytes, legacy_s = measure(build_legacy, games)
+    table, table_bytes, table_s = measure(build_columnar, games)
+
+    indented = len(json.dumps({"stats": legacy, "themes": {}}, ensure_ascii=False, indent=2).encode("utf-8"))
+    # ما تكتبه الـ backends الآن: apply_results بسجل [epoch، رمز]
+    stored = {
+        str(user_id): apply_results(empty_stats(), [{"ts": epoch, "result": result} for epoch, result in played])
+        for user_id, played in games
+    }
+    compact = len(json.dumps({"stats": stored, "themes": {}}, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    # نفس البيانات في الشكلين
+    sample = random.Random(2).sample(range(users), min(users, 100))
+    for i in sample:
+        user_id = games[i][0]
+        slot = table.slot(user_id)
+        wins, losses, draws, total = table.counts(slot)
+        assert legacy[str(user_id)] == {
+            "wins": wins, "losses": losses, "draws": draws, "total_games": total,
+            "history": [{"date": format_date(epoch), "result": result} for epoch, result in table.history(slot)],
+        }
+        assert stored[str(user_id)]["history"] == [[epoch, RESULT_CODES[result]] for epoch, result in table.history(slot)]
+
+    print(f"{users} users, {HISTORY_LIMIT} games of history each")
+    print(f"  memory   dict-per-user : {legacy_bytes / 2**20:8.1f} MiB  ({legacy_bytes / users:6.0f} B/user)  built in {legacy_s:.2f}s")
+    print(f"  memory   StatsTable    : {table_bytes / 2**20:8.1f} MiB  ({table_bytes / users:6.0f} B/user)  built in {table_s:.2f}s")
+    print(f"  file     old (indent, dates)     : {indented / 2**20:8.1f} MiB  ({indented / users:6.0f} B/user)")
+    print(f"  file     new ([epoch, code])     : {compact / 2**20:8.1f} MiB  ({compact / users:6.0f} B/user)")
+    print(f"  memory ratio: {legacy_bytes / table_bytes:.1f}x smaller, file ratio: {indented / compact:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Local stand-in for the Telegram Bot API, for offline load tests.
+
+Serves the methods bot.py uses under /bot<token>/<method> with the same
+JSON envelope as Telegram, optional per-call latency and random 429
+injection. Tests push updates with push_update() and can wait for the
+bot's answer to a given callback or chat.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Tuple
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serving import HTTPServer, Request, Response  # noqa: E402
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "XO", "username": "xo_load_bot",
+            "can_join_groups": True, "can_read_all_group_messages": False,
+            "supports_inline_queries": False}
+
+METHODS = (
+    "getMe", "deleteWebhook", "setWebhook", "getUpdates", "answerCallbackQuery",
+    "editMessageText", "sendMessage", "sendSticker", "sendDocument",
+)
+
+
+class FakeBotAPI:
+    """In-process fake Bot API server."""
+
+    def __init__(self, token: str = "123:LOAD", latency: float = 0.0,
+                 jitter: float = 0.0, flood_rate: float = 0.0, retry_after: int = 1,
+                 flood_methods: Tuple[str, ...] = ("editMessageText", "sendSticker"),
+                 seed: int = 1):
+        self.token = token
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.flood_methods = flood_methods
+        self.rng = random.Random(seed)
+        self.server = HTTPServer("127.0.0.1", 0)
+        for method in METHODS:
+            self.server.route("POST", f"/bot{token}/{method}", self._handler(method))
+
+        self._updates: Deque[Dict] = deque()
+        self._updates_ready = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._waiters: Dict[Any, asyncio.Future] = {}
+        self.pushed_at: Dict[int, float] = {}
+
+        # 📈 عدادات
+        self.calls: Counter = Counter()
+        self.floods: Counter = Counter()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.port}/bot"
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    # ------------------------------------------------------------------
+    # جهة الاختبار
+    # ------------------------------------------------------------------
+
+    def push_update(self, payload: Dict) -> int:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+        payload = dict(payload, update_id=update_id)
+        self._updates.append(payload)
+        self.pushed_at[update_id] = time.perf_counter()
+        self._updates_ready.set()
+        return update_id
+
+    def expect(self, key: Any) -> asyncio.Future:
+        """Future resolved when the bot answers ``key`` (("cb", id) or ("msg", chat_id))."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[key] = future
+        return future
+
+    def _resolve(self, key: Any, value: Any):
+        future = self._waiters.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(value)
+
+    def new_message(self, chat_id: int, **fields) -> Dict:
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        message = {"message_id": message_id, "date": int(time.time()),
+                   "chat": {"id": chat_id, "type": "private"}}
+        message.update(fields)
+        return message
+
+    # ------------------------------------------------------------------
+    # جهة البوت
+    # ------------------------------------------------------------------
+
+    def _handler(self, method: str):
+        async def handle(request: Request) -> Response:
+            self.calls[method] += 1
+            params = self._params(request)
+            if method != "getUpdates":
+                delay = self.latency + (self.rng.random() * self.jitter if self.jitter else 0.0)
+                if delay:
+                    await asyncio.sleep(delay)
+                if self.flood_rate and method in self.flood_methods and self.rng.random() < self.flood_rate:
+                    self.floods[method] += 1
+                    return self._reply({
+                        "ok": False, "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after},
+                    }, status=429)
+            result = await getattr(self, f"_{method}")(params)
+            return self._reply({"ok": True, "result": result})
+        return handle
+
+    @staticmethod
+    def _params(request: Request) -> Dict[str, Any]:
+        if not request.body:
+            return {}
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return json.loads(request.body)
+        if request.headers.get("content-type", "").startswith("multipart/"):
+            return {}
+        params = {}
+        for key, values in parse_qs(request.body.decode("utf-8")).items():
+            value = values[0]
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    @staticmethod
+    def _reply(payload: Dict, status: int = 200) -> Response:
+        return Response(status, json.dumps(payload).encode("utf-8"), "application/json")
+
+    async def _getMe(self, params):
+        return BOT_USER
+
+    async def _deleteWebhook(self, params):
+        return True
+
+    async def _setWebhook(self, params):
+        return True
+
+    async def _getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(params.get("timeout") or 0) or 0.05)
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get("limit") or 100)
+        return [u for _, u in zip(range(limit), self._updates)]
+
+    async def _answerCallbackQuery(self, params):
+        self._resolve(("cb", str(params.get("callback_query_id"))), params)
+        return True
+
+    async def _editMessageText(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        message = self.new_message(chat_id, text=params.get("text", ""))
+        message["message_id"] = int(params.get("message_id", 0))
+        self._resolve(("edit", chat_id), message)
+        return message
+
+    async def _sendMessage(self, params):
+        chat_id = int(params.get("chat_id", 0))
+        message = self.new_message(chat_id, text=params.get("text", ""))
+        self._resolve(("msg", chat_id), message)
+        return message
+
+    async def _sendSticker(self, params):
+        return self.new_message(int(params.get("chat_id", 0)))
+
+    async def _sendDocument(self, params):
+        return self.new_message(int(params.get("chat_id", 0)))
+
+
+def callback_update(chat_id: int, message_id: int, data: str, callback_id: str) -> Dict:
+    return {
+        "callback_query": {
+            "id": callback_id,
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Load{chat_id}"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"}, "text": "XO"},
+        }
+    }
+
+
+def command_update(chat_id: int, text: str, message_id: int) -> Dict:
+    return {
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Load{chat_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        }
+    }
@@ -0,0 +1,227 @@
+"""
+Offline load test for bot.py against a local fake Bot API.
+
+Runs the real Application (polling, update processor, start()/button()
+handlers, outbound scheduler, persistence) against benchmarks/fake_bot_api.py
+and drives thousands of simulated chats through /start, mode selection,
+full games, stats, history and theme changes.
+
+Reports throughput, end-to-end and in-handler latency percentiles,
+event-loop lag, memory growth and persistence write volume. With
+--max-p95-ms / --max-lag-ms it exits non-zero on regression.
+
+    python benchmarks/loadtest.py --chats 2000 --concurrency 400 --latency 0.02 --flood 0.01
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# البوت يكتب بياناته في مجلد مؤقت، لا في xo_data.json الحقيقي
+_INVOKED_FROM = os.getcwd()
+os.chdir(tempfile.mkdtemp(prefix="xo_load_"))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+import bot  # noqa: E402
+import callbacks as cb  # noqa: E402
+from fake_bot_api import FakeBotAPI, callback_update, command_update  # noqa: E402
+from serving import LatencyTracker  # noqa: E402
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Driver:
+    """Closed-loop simulated users: each chat waits for its previous update to finish."""
+
+    def __init__(self, api: FakeBotAPI, games_per_chat: int, timeout: float, seed: int):
+        self.api = api
+        self.games_per_chat = games_per_chat
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.done: Dict[int, asyncio.Future] = {}
+        self.end_to_end = LatencyTracker(window=1_000_000)
+        self.updates = 0
+        self.timeouts = 0
+        self._callback_ids = 0
+
+    async def on_processed(self, update: Update, context):
+        """Last handler group: the update has been fully handled."""
+        future = self.done.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    async def _send(self, payload: Dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        update_id = self.api.push_update(payload)
+        self.done[update_id] = future
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(future, self.timeout)
+            self.end_to_end.observe(time.perf_counter() - started)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.done.pop(update_id, None)
+        self.updates += 1
+
+    async def tap(self, chat_id: int, message_id: int, data: str):
+        self._callback_ids += 1
+        await self._send(callback_update(chat_id, message_id, data, str(self._callback_ids)))
+
+    async def session(self, chat_id: int):
+        reply = self.api.expect(("msg", chat_id))
+        await self._send(command_update(chat_id, "/start", 1))
+        try:
+            message_id = (await asyncio.wait_for(reply, self.timeout))["message_id"]
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return
+
+        for _ in range(self.games_per_chat):
+            mode = self.rng.choice((cb.encode(cb.MODE_NORMAL), cb.encode(cb.MODE_TIMED), cb.encode(cb.BOT_LEVEL, "perfect")))
+            await self.tap(chat_id, message_id, mode)
+            while True:
+                game = bot.games.get(chat_id)
+                if game is None or game.finished:
+                    break
+                cell = self.rng.choice(game.empty_cells())
+                await self.tap(chat_id, message_id, cb.encode_move(cell, game.nonce))
+            await self.tap(chat_id, message_id, cb.encode(cb.RESTART))
+
+        await self.tap(chat_id, message_id, cb.encode(cb.STATS))
+        await self.tap(chat_id, message_id, cb.encode(cb.CHANGE_THEME))
+        await self.tap(chat_id, message_id, cb.encode(cb.THEME, self.rng.choice(list(bot.THEMES))))
+        await self.tap(chat_id, message_id, cb.encode(cb.HISTORY))
+        await self.tap(chat_id, message_id, cb.encode(cb.MENU))
+
+
+async def loop_lag_monitor(tracker: LatencyTracker, interval: float = 0.01):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        tracker.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+async def run(args) -> Dict:
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, flood_rate=args.flood, seed=args.seed)
+    await api.start()
+
+    driver = Driver(api, args.games, args.timeout, args.seed)
+    shed_answer = bot.shed_update
+
+    async def shed_update(update):
+        # زر أُسقط بسبب الازدحام: رده السريع هو نهاية معالجته
+        await shed_answer(update)
+        await driver.on_processed(update, None)
+
+    bot.shed_update = shed_update
+    app = bot.build_application(api.token, base_url=api.base_url)
+    app.add_handler(TypeHandler(Update, driver.on_processed), group=99)
+    bot.update_latency = LatencyTracker(window=1_000_000)
+    loop_lag = LatencyTracker(window=1_000_000)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = rss_bytes()
+
+    async with app:
+        await bot.post_init(app)
+        await app.updater.start_polling(poll_interval=0.0, timeout=1)
+        await app.start()
+        bot.store.start()
+        monitor = asyncio.create_task(loop_lag_monitor(loop_lag))
+
+        limiter = asyncio.Semaphore(args.concurrency)
+
+        async def one_chat(chat_id: int):
+            async with limiter:
+                await driver.session(chat_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_chat(10_000 + i) for i in range(args.chats)))
+        elapsed = time.perf_counter() - started
+
+        monitor.cancel()
+        await app.updater.stop()
+        await app.stop()
+        await bot.post_stop(app)
+
+    bot.store.stop()
+    await api.stop()
+
+    report = {
+        "chats": args.chats,
+        "updates": driver.updates,
+        "timeouts": driver.timeouts,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(driver.updates / elapsed, 1) if elapsed else 0.0,
+        "end_to_end": driver.end_to_end.summary(),
+        "handler": bot.update_latency.summary(),
+        "loop_lag": loop_lag.summary(),
+        "rss_growth_bytes": rss_bytes() - rss_before,
+        "persistence": bot.store.metrics(),
+        "outbound": bot.outbound.metrics(),
+        "effects": bot.effects.metrics(),
+        "archive": bot.archive.metrics(),
+        "scheduling": app.update_processor.metrics() if hasattr(app.update_processor, "metrics") else None,
+        "sessions": bot.games.metrics(),
+        "api_calls": dict(api.calls),
+        "api_429s": dict(api.floods),
+    }
+    if args.tracemalloc:
+        current, peak = tracemalloc.get_traced_memory()
+        report["tracemalloc"] = {"current_bytes": current, "peak_bytes": peak}
+        tracemalloc.stop()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="chats active at the same time")
+    parser.add_argument("--games", type=int, default=1, help="games per chat")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency per call (s)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency per call (s)")
+    parser.add_argument("--flood", type=float, default=0.0, help="probability of a 429 on edits/stickers")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-update wait before counting a timeout")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python allocations (slower)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--max-p95-ms", type=float, help="fail if end-to-end p95 exceeds this")
+    parser.add_argument("--max-lag-ms", type=float, help="fail if event-loop lag p99 exceeds this")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.json:
+        with open(os.path.join(_INVOKED_FROM, args.json), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    failed = report["timeouts"] > 0
+    if args.max_p95_ms is not None and report["end_to_end"].get("p95_ms", 0) > args.max_p95_ms:
+        failed = True
+    if args.max_lag_ms is not None and report["loop_lag"].get("p99_ms", 0) > args.max_lag_ms:
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
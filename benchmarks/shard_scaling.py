@@ -0,0 +1,127 @@
+"""
+Throughput of the sharded deployment (XO_SHARDS) against the fake Bot API.
+
+For each shard count, starts `python bot.py` as a real front process with
+its workers, pointed at benchmarks/fake_bot_api.py, pushes the same
+scripted games for many chats at once and times how long it takes until
+every callback has been answered. Users are shared between chats (and so
+between shards) and the SQLite totals are checked afterwards, so lost
+increments in the shared store show up as a failure.
+
+    python benchmarks/shard_scaling.py --shards 1 2 4 --chats 2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from fake_bot_api import FakeBotAPI, callback_update  # noqa: E402
+
+# X: 0, 1, 2 (الصف الأول) / O: 3, 4
+SCRIPT = ["mode_normal", "0,0", "1,0", "0,1", "1,1", "0,2"]
+
+
+async def wait_for(predicate, timeout: float, interval: float = 0.01) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(interval)
+    return predicate()
+
+
+async def run_once(shards: int, args) -> dict:
+    api = FakeBotAPI(latency=args.latency, seed=shards)
+    await api.start()
+    workdir = tempfile.mkdtemp(prefix=f"xo_shards{shards}_")
+    env = dict(
+        os.environ,
+        BOT_TOKEN=api.token,
+        XO_BOT_API_URL=api.base_url,
+        XO_SHARDS=str(shards),
+        XO_STORAGE="sqlite",
+        XO_STORAGE_PATH=os.path.join(workdir, "xo_data.db"),
+        XO_CHAT_EDIT_INTERVAL="0",
+        XO_GLOBAL_EDIT_RATE="1000000",
+        XO_FLUSH_INTERVAL="0.5",
+    )
+    env.pop("XO_METRICS_PORT", None)
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(REPO_DIR, "bot.py"), cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    # جاهز عندما يطلب كل عامل getMe وتبدأ الواجهة بالـ polling
+    await wait_for(lambda: api.calls["getUpdates"] > 0 and api.calls["getMe"] >= shards + (shards > 1), 60)
+
+    total = 0
+    for i in range(args.chats):
+        chat_id = 10_000 + i
+        user_id = 1 + i % args.users
+        for step, data in enumerate(SCRIPT):
+            payload = callback_update(chat_id, 1, data, f"{chat_id}-{step}")
+            payload["callback_query"]["from"]["id"] = user_id
+            api.push_update(payload)
+            total += 1
+
+    started = time.perf_counter()
+    done = await wait_for(lambda: api.calls["answerCallbackQuery"] >= total, args.timeout)
+    elapsed = time.perf_counter() - started
+
+    proc.send_signal(signal.SIGINT)
+    await proc.wait()
+    await api.stop()
+
+    conn = sqlite3.connect(env["XO_STORAGE_PATH"])
+    games, wins = conn.execute("SELECT COALESCE(SUM(total_games), 0), COALESCE(SUM(wins), 0) FROM users").fetchone()
+    conn.close()
+    return {
+        "shards": shards,
+        "updates": total,
+        "answered": api.calls["answerCallbackQuery"],
+        "completed": done,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(api.calls["answerCallbackQuery"] / elapsed, 1) if elapsed else 0.0,
+        "stored_games": games,
+        "stored_wins": wins,
+        "store_consistent": games == args.chats and wins == args.chats,
+        "exit_code": proc.returncode,
+    }
+
+
+async def main_async(args):
+    results = []
+    for shards in args.shards:
+        results.append(await run_once(shards, args))
+        print(json.dumps(results[-1], ensure_ascii=False))
+    base = results[0]["throughput_per_s"] or 1.0
+    for r in results:
+        r["speedup"] = round(r["throughput_per_s"] / base, 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=100, help="distinct users spread over the chats")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake API latency per call (s)")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    results = asyncio.run(main_async(args))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    print(f"CPU cores available: {os.cpu_count()}")
+    sys.exit(0 if all(r["completed"] and r["store_consistent"] for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Stress check for per-chat serialization in concurrent update processing.
+
+Many chats each play the same scripted game (X wins on the fifth move)
+through the real button() handler while a fake bot sleeps a random time
+on every API call, so handlers interleave as they would in production.
+With ChatSerializedUpdateProcessor every game must finish with exactly
+one recorded win and no rejected moves; --unsafe runs the same load with
+plain concurrency to show what goes wrong without it.
+
+    python benchmarks/stress_concurrency.py [--chats 500] [--workers 32] [--unsafe]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# لا نلمس بيانات البوت الحقيقية
+os.chdir(tempfile.mkdtemp(prefix="xo_stress_"))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import SimpleUpdateProcessor  # noqa: E402
+
+import bot  # noqa: E402
+from concurrency import ChatSerializedUpdateProcessor  # noqa: E402
+
+# X: 0, 1, 2 (الصف الأول) / O: 3, 4
+SCRIPT = ["mode_normal", "0,0", "1,0", "0,1", "1,1", "0,2"]
+
+
+class FakeBot:
+    """Just the Bot API methods button() calls, each with random latency."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.alerts = 0
+
+    async def _latency(self):
+        await asyncio.sleep(self.rng.random() * 0.005)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._latency()
+        if show_alert:
+            self.alerts += 1
+        return True
+
+    async def edit_message_text(self, *args, **kwargs):
+        await self._latency()
+        return True
+
+    async def send_sticker(self, *args, **kwargs):
+        await self._latency()
+        return True
+
+
+class Context:
+    def __init__(self, fake_bot):
+        self.bot = fake_bot
+
+
+def make_update(update_id: int, chat_id: int, data: str, fake_bot) -> Update:
+    payload = {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Stress"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": chat_id, "type": "private"},
+            },
+        },
+    }
+    return Update.de_json(payload, fake_bot)
+
+
+async def run(chats: int, workers: int, unsafe: bool) -> bool:
+    bot.open_storage()
+    rng = random.Random(7)
+    fake_bot = FakeBot(rng)
+    context = Context(fake_bot)
+    processor = SimpleUpdateProcessor(workers) if unsafe else ChatSerializedUpdateProcessor(workers)
+
+    # كل محادثة ترسل نقراتها بالترتيب، والمحادثات متداخلة عشوائياً كما تصل من تيليجرام
+    streams = {chat_id: list(SCRIPT) for chat_id in range(1, chats + 1)}
+    arrivals = []
+    update_id = 0
+    while streams:
+        chat_id = rng.choice(list(streams))
+        update_id += 1
+        arrivals.append(make_update(update_id, chat_id, streams[chat_id].pop(0), fake_bot))
+        if not streams[chat_id]:
+            del streams[chat_id]
+
+    started = time.perf_counter()
+    # PTB ينشئ مهمة لكل تحديث بترتيب الوصول
+    tasks = [
+        asyncio.create_task(processor.process_update(u, bot.button(u, context)))
+        for u in arrivals
+    ]
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    wins = sum(bot.stats.wins[bot.get_user_stats(chat_id)] for chat_id in range(1, chats + 1))
+    totals = sum(bot.stats.total[bot.get_user_stats(chat_id)] for chat_id in range(1, chats + 1))
+    print(f"{'unsafe' if unsafe else 'serialized'}: {len(arrivals)} updates in {elapsed:.2f}s "
+          f"({len(arrivals) / elapsed:.0f}/s), wins={wins}/{chats}, games={totals}, "
+          f"rejected moves={fake_bot.alerts}")
+    return wins == chats and totals == chats and fake_bot.alerts == 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--unsafe", action="store_true", help="use plain concurrency without per-chat locks")
+    args = parser.parse_args()
+    ok = asyncio.run(run(args.chats, args.workers, args.unsafe))
+    print("OK" if ok else "FAILED: lost or duplicated moves")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
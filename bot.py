@@ -1,10 +1,45 @@
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes
+from telegram import (
+    Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent,
+)
+from telegram.ext import (
+    ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, InlineQueryHandler, TypeHandler,
+)
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+import asyncio
 import logging
-from typing import Dict, List, Optional
-import json
+from typing import Callable, Dict, Hashable, Optional, Tuple
+import os
 import random
-from datetime import datetime
+import signal
+import sys
+import tempfile
+import time
+
+import callbacks as cb
+from ai import choose_move
+from archive import FirstMoveWinRates, LengthByMode, MatchArchive
+from callbacks import CallbackRouter, Tap
+from concurrency import ChatSerializedUpdateProcessor
+from effects import EffectDispatcher
+from engine import CLASSIC, BoardShape, XOEngine, board_shape
+from journal import GameJournal
+from leaderboard import Leaderboard
+from lobby import Lobby, Ticket
+from metrics import (
+    API_SECONDS, BUTTON_SECONDS, GAMES_FINISHED, GAMES_STARTED, KNOWN_USERS, LIVE_GAMES,
+    STICKER_FAILURES, STORAGE_SECONDS, TIMEOUTS,
+)
+from outbound import OutboundScheduler
+from persistence import WriteBehindStore
+from profiling import UpdateProfiler
+from render_cache import LRUCache, RenderCache
+from serving import HTTPServer, LatencyTracker, health, metrics_endpoint, webhook_forwarder, webhook_handler
+from sessions import SessionStore
+from sharding import ShardSupervisor, poll_updates, read_updates
+from timers import EditBudget, TimerService
+from stats_table import StatsTable, format_date
+from storage import StorageBackend, open_backend
 
 # 🔧 إعداد Logging
 logging.basicConfig(
@@ -14,10 +49,53 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # 🎮 تخزين الألعاب والإحصائيات
-games: Dict[int, Dict] = {}
-stats: Dict[str, Dict] = {}
-user_themes: Dict[int, str] = {}
-game_timers: Dict[int, Dict] = {}
+# الألعاب تنتهي بعد XO_SESSION_TTL ثانية بدون نشاط، وبحد أقصى XO_MAX_SESSIONS لعبة (الأقدم يُحذف أولاً)
+games = SessionStore(
+    ttl=float(os.getenv('XO_SESSION_TTL', '1800')),
+    max_entries=int(os.getenv('XO_MAX_SESSIONS', '10000')),
+    sizeof=lambda game: sys.getsizeof(game) + sys.getsizeof(getattr(game, "time_left", None)),
+)
+# stats و user_themes ذاكرة مؤقتة محدودة للمستخدمين النشطين فقط، والمصدر هو الـ backend
+# (XO_USER_CACHE_SIZE مستخدم؛ الأقل استخداماً يُخلى أولاً ما لم تكن له نتائج لم تُحفظ بعد)
+# stats جدول أعمدة مضغوط (خانة لكل مستخدم)، انظر stats_table.py
+USER_CACHE_SIZE = int(os.getenv('XO_USER_CACHE_SIZE', '50000'))
+stats = StatsTable(
+    max_users=USER_CACHE_SIZE,
+    pinned=lambda user_id: store is not None and store.is_dirty(str(user_id)),
+)
+user_themes = LRUCache(maxsize=USER_CACHE_SIZE)
+# عامل في وضع الأجزاء (XO_SHARDS): عمليات أخرى تسجل مباريات في نفس القاعدة، فالذاكرة المؤقتة قد تكون قديمة
+SHARED_STORE = bool(os.getenv('XO_SHARD'))
+
+# ⏱️ مؤقتات الوضع بالوقت: كومة (heap) واحدة على الـ event loop لكل المحادثات
+TIMED_MODE_SECONDS = 60
+COUNTDOWN_INTERVAL = float(os.getenv('XO_COUNTDOWN_INTERVAL', '5'))
+timers = TimerService()
+edit_budget = EditBudget(rate=float(os.getenv('XO_EDIT_BUDGET', '20')))
+
+# 📤 طابور تعديل الرسائل: آخر حالة فقط لكل رسالة، مع حدود معدل لكل محادثة وعامة
+outbound = OutboundScheduler(
+    per_chat_interval=float(os.getenv('XO_CHAT_EDIT_INTERVAL', '0.3')),
+    global_rate=float(os.getenv('XO_GLOBAL_EDIT_RATE', '30')),
+)
+
+# 🎁 آثار جانبية لا ينتظرها أحد (الستيكرز): طابور محدود يُنفذ في الخلفية مع إعادة المحاولة،
+# ويُسقط الجديد عند الامتلاء بدلاً من إبطاء الـ handlers
+effects = EffectDispatcher(
+    workers=int(os.getenv('XO_EFFECT_WORKERS', '4')),
+    max_queue=int(os.getenv('XO_EFFECT_QUEUE', '1000')),
+)
+
+# 🔬 تحليل أداء اختياري لعينة من نقرات الأزرار: XO_PROFILE=1 عند التشغيل أو الأمر /profile
+# للمشرفين (XO_ADMIN_IDS). التقارير في XO_PROFILE_DIR (مجلد لكل عامل في وضع التقسيم)
+ADMIN_IDS = {int(i) for i in os.getenv('XO_ADMIN_IDS', '').split(',') if i.strip()}
+_PROFILE_DIR = os.getenv('XO_PROFILE_DIR', 'xo_profiles')
+profiler = UpdateProfiler(
+    os.path.join(_PROFILE_DIR, f"shard{os.getenv('XO_SHARD')}") if os.getenv('XO_SHARD') else _PROFILE_DIR,
+    sample_rate=float(os.getenv('XO_PROFILE_RATE', '0.05')),
+    trace_allocations=os.getenv('XO_PROFILE_TRACEMALLOC') == '1',
+    tag=lambda action: cb.ACTION_NAMES.get(action, "unknown"),
+)
 
 # 🎨 ثيمات متعددة
 THEMES = {
@@ -29,6 +107,18 @@ THEMES = {
     "emoji": {"X": "😎", "O": "🤓", "empty": "😶"}
 }
 
+# 🗄️ أرشيف ثنائي لكل مباراة منتهية (الحركات بالترتيب، الوضع، الثيم، المدة، النتيجة) للتحليل والتصدير
+# XO_ARCHIVE_DIR فارغ لإيقافه؛ مجلد لكل عامل في وضع التقسيم. الثيمات الجديدة تُضاف في نهاية THEMES
+# لأن الأرشيف يخزن ترتيب الثيم
+_ARCHIVE_DIR = os.getenv('XO_ARCHIVE_DIR', 'xo_archive')
+archive = MatchArchive(
+    (os.path.join(_ARCHIVE_DIR, f"shard{os.getenv('XO_SHARD')}") if os.getenv('XO_SHARD') else _ARCHIVE_DIR)
+    if _ARCHIVE_DIR else None,
+    themes=tuple(THEMES),
+    segment_bytes=int(os.getenv('XO_ARCHIVE_SEGMENT_BYTES', str(4 << 20))),
+    max_segments=int(os.getenv('XO_ARCHIVE_MAX_SEGMENTS', '256')),
+)
+
 # 🎵 ستيكرز للفوز والخسارة
 STICKERS = {
     "win": [
@@ -52,208 +142,418 @@ MESSAGES = {
     "move": ["🎯 حركة ذكية!", "💡 فكر جيداً!", "⚡ وقتك يمر!", "🧠 استخدم عقلك!"]
 }
 
+# 📐 أحجام اللوحة: المفتاح يُرسل مع زر الوضع ("!n5") -> (الشكل، الاسم)
+# حدود تيليجرام: 8 أزرار في الصف و100 زر في الرسالة، و5×5 مع صف التحكم بعيدة عنها
+BOARD_VARIANTS = {
+    "3": (CLASSIC, "3×3"),
+    "4": (board_shape(4, 4), "4×4 (4 في صف)"),
+    "5": (board_shape(5, 4), "5×5 (4 في صف)"),
+}
+DEFAULT_BOARD = "3"
+_VARIANT_KEYS = {shape: key for key, (shape, _) in BOARD_VARIANTS.items()}
+
+def _variant_arg(key: str) -> str:
+    # اللوحة الافتراضية بدون وسيط: نفس أزرار "!n" و "!t" السابقة
+    return "" if key == DEFAULT_BOARD else key
+
+# 🧩 قوائم ثابتة تُبنى مرة واحدة عند التشغيل (كائنات PTB غير قابلة للتعديل فيمكن مشاركتها)
+MAIN_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🎮 لعب عادي", callback_data=cb.encode(cb.MODE_NORMAL)),
+        InlineKeyboardButton("⏱️ لعب بالوقت", callback_data=cb.encode(cb.MODE_TIMED))
+    ],
+    [
+        InlineKeyboardButton("🤖 ضد البوت", callback_data=cb.encode(cb.MODE_BOT)),
+        InlineKeyboardButton("⚔️ ضد صديق", callback_data=cb.encode(cb.PVP))
+    ],
+    [
+        InlineKeyboardButton("📊 إحصائياتي", callback_data=cb.encode(cb.STATS)),
+        InlineKeyboardButton("🎨 تغيير الثيم", callback_data=cb.encode(cb.CHANGE_THEME))
+    ],
+    [
+        InlineKeyboardButton("📜 تاريخ المباريات", callback_data=cb.encode(cb.HISTORY)),
+        InlineKeyboardButton("❓ مساعدة", callback_data=cb.encode(cb.HELP))
+    ],
+    [
+        InlineKeyboardButton("📐 لوحات أكبر", callback_data=cb.encode(cb.BOARDS)),
+        InlineKeyboardButton("🏆 المتصدرون", callback_data=cb.encode(cb.LEADERBOARD, "0"))
+    ]
+])
+
+BOARDS_MARKUP = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton(f"🎮 {label}", callback_data=cb.encode(cb.MODE_NORMAL, key)),
+            InlineKeyboardButton(f"⏱️ {label}", callback_data=cb.encode(cb.MODE_TIMED, key))
+        ]
+        for key, (_, label) in BOARD_VARIANTS.items() if key != DEFAULT_BOARD
+    ]
+    + [[InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))]]
+)
+
+def _build_restart_menu(key: str) -> InlineKeyboardMarkup:
+    arg = _variant_arg(key)
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("🎮 عادي", callback_data=cb.encode(cb.MODE_NORMAL, arg)),
+            InlineKeyboardButton("⏱️ بالوقت", callback_data=cb.encode(cb.MODE_TIMED, arg))
+        ],
+        [InlineKeyboardButton("🤖 ضد البوت", callback_data=cb.encode(cb.MODE_BOT))],
+        [InlineKeyboardButton("🔙 القائمة", callback_data=cb.encode(cb.MENU))]
+    ])
+
+# إعادة اللعب بنفس حجم اللوحة
+RESTART_MENU_MARKUPS = {key: _build_restart_menu(key) for key in BOARD_VARIANTS}
+
+# ⚔️ ضد صديق: وسيط الوضع ("n" / "t" + حجم اللوحة) -> (بالوقت؟، الشكل، الاسم)
+PVP_MODES = {
+    mode + _variant_arg(key): (mode == "t", shape, f"{'⏱️ بالوقت' if mode == 't' else '🎮 عادي'} {label}")
+    for key, (shape, label) in BOARD_VARIANTS.items() for mode in ("n", "t")
+}
+# طوابير الانتظار في المجموعات (XO_LOBBY_TIMEOUT ثانية انتظار بحد أقصى)
+lobby = Lobby(timers, timeout=float(os.getenv('XO_LOBBY_TIMEOUT', '120')))
+
+# زر يفتح اختيار محادثة ويكتب اسم البوت فيها (تحدٍّ عبر الرسائل المضمّنة)
+_INVITE_ROW = [InlineKeyboardButton("📨 تحدَّ صديقاً في محادثة", switch_inline_query="")]
+
+PVP_MENU_TEXT = "⚔️ **ضد صديق!**\n\nاختر الوضع وانتظر خصماً من المجموعة، أو أرسل تحدياً في أي محادثة:"
+PVP_MENU_MARKUP = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton(PVP_MODES["n" + _variant_arg(key)][2], callback_data=cb.encode(cb.PVP, "n" + _variant_arg(key))),
+            InlineKeyboardButton(PVP_MODES["t" + _variant_arg(key)][2], callback_data=cb.encode(cb.PVP, "t" + _variant_arg(key)))
+        ]
+        for key in BOARD_VARIANTS
+    ]
+    + [_INVITE_ROW, [InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))]]
+)
+
+# في المحادثة الخاصة لا يوجد من ينضم: التحدي عبر الرسائل المضمّنة فقط
+PVP_PRIVATE_TEXT = (
+    "⚔️ **ضد صديق!**\n\n"
+    "أرسل تحدياً لصديق في أي محادثة، أو أضف البوت إلى مجموعة واختر الوضع هناك:"
+)
+PVP_PRIVATE_MARKUP = InlineKeyboardMarkup([_INVITE_ROW, [InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))]])
+
+# رسالة الانتظار في المجموعة، ونهاية المباراة (في مجموعة أو رسالة مضمّنة) لكل وضع
+PVP_LOBBY_MARKUPS = {
+    mode: InlineKeyboardMarkup([
+        [InlineKeyboardButton("⚔️ انضم", callback_data=cb.encode(cb.PVP, mode))],
+        [InlineKeyboardButton("❌ إلغاء", callback_data=cb.encode(cb.PVP_CANCEL))]
+    ])
+    for mode in PVP_MODES
+}
+PVP_OVER_MARKUPS = {
+    mode: InlineKeyboardMarkup([
+        [InlineKeyboardButton("⚔️ مباراة أخرى", callback_data=cb.encode(cb.PVP, mode))],
+        [InlineKeyboardButton("🔙 القائمة", callback_data=cb.encode(cb.MENU))]
+    ])
+    for mode in PVP_MODES
+}
+PVP_INLINE_OVER_MARKUPS = {
+    mode: InlineKeyboardMarkup([[InlineKeyboardButton("⚔️ مباراة أخرى", callback_data=cb.encode(cb.PVP, mode + "@"))]])
+    for mode in PVP_MODES
+}
+
+# 🤖 مستويات البوت
+BOT_LEVELS = {
+    "random": "😊 سهل",
+    "greedy": "🤔 متوسط",
+    "perfect": "🧠 مستحيل",
+}
+
+BOT_LEVEL_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(label, callback_data=cb.encode(cb.BOT_LEVEL, level))] for level, label in BOT_LEVELS.items()]
+    + [[InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))]]
+)
+
+BACK_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))]])
+
+GAME_OVER_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔄 لعب مرة أخرى", callback_data=cb.encode(cb.RESTART)),
+    InlineKeyboardButton("📊 إحصائيات", callback_data=cb.encode(cb.STATS))
+]])
+
+THEME_APPLIED_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🎮 ابدأ اللعب", callback_data=cb.encode(cb.MODE_NORMAL)),
+    InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))
+]])
+
+GAME_CONTROL_ROW = (
+    InlineKeyboardButton("🔄 جديدة", callback_data=cb.encode(cb.RESTART)),
+    InlineKeyboardButton("📊 إحصائيات", callback_data=cb.encode(cb.STATS)),
+    InlineKeyboardButton("🎨 ثيم", callback_data=cb.encode(cb.CHANGE_THEME))
+)
+
+def _build_theme_picker(current: str) -> InlineKeyboardMarkup:
+    keyboard = []
+    for theme_name, theme_symbols in THEMES.items():
+        emoji = "✅" if current == theme_name else ""
+        button_text = f"{theme_symbols['X']} {theme_name.title()} {emoji}"
+        keyboard.append([InlineKeyboardButton(button_text, callback_data=cb.encode(cb.THEME, theme_name))])
+    keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))])
+    return InlineKeyboardMarkup(keyboard)
+
+# قائمة الثيمات لكل ثيم حالي (علامة ✅ على الثيم المختار)
+THEME_PICKER_MARKUPS = {name: _build_theme_picker(name) for name in THEMES}
+
+HELP_TEXT = (
+    "📖 **دليل اللعبة:**\n\n"
+    "🎮 **الأوضاع:**\n"
+    "• عادي: لعب بدون حدود زمنية\n"
+    "• بالوقت: 60 ثانية لكل لاعب\n"
+    "• ضد البوت: 3 مستويات (سهل، متوسط، مستحيل)\n"
+    "• لوحات أكبر: 4×4 و 5×5 (أربعة في صف للفوز)\n"
+    "• ضد صديق: طابور انتظار في المجموعات، أو تحدٍّ بكتابة اسم البوت في أي محادثة\n\n"
+    "🎨 **الثيمات:**\n"
+    "• 6 ثيمات مختلفة للاختيار\n"
+    "• غير الثيم من الإعدادات\n\n"
+    "🏆 **المتصدرون:**\n"
+    "• ترتيب كل اللاعبين بالانتصارات ثم نسبة الفوز\n"
+    "• الأمر /top أو زر المتصدرين\n\n"
+    "📊 **الإحصائيات:**\n"
+    "• تُحفظ كل نتائجك تلقائياً\n"
+    "• شاهد آخر 10 مباريات\n\n"
+    "🎵 **المكافآت:**\n"
+    "• ستيكرز عند الفوز/الخسارة\n"
+    "• رسائل تشجيعية مستمرة\n\n"
+    "💡 **نصيحة:** العب باستمرار لتحسين إحصائياتك!"
+)
+
+RESULT_EMOJIS = {"win": "🏆", "loss": "💔", "draw": "🤝"}
+
+# 🏆 ترتيب اللاعبين: فهرس مرتب يُحدَّث مع كل مباراة ويُبنى في الخلفية عند التشغيل،
+# ثم كل XO_LEADERBOARD_REFRESH ثانية (افتراضياً 60 في وضع الأجزاء لتظهر مباريات العمليات الأخرى، 0 = مرة واحدة)
+leaderboard = Leaderboard(page_size=int(os.getenv('XO_LEADERBOARD_PAGE_SIZE', '10')))
+LEADERBOARD_REFRESH = float(os.getenv('XO_LEADERBOARD_REFRESH', '60' if SHARED_STORE else '0'))
+# أسماء اللاعبين كما ظهرت في آخر تفاعل (للعرض في الترتيب فقط)
+player_names: Dict[int, str] = {}
+
+# 🖼️ كاش عرض اللوحات المشترك بين الألعاب: (ثيم، الشكل، بتات X، بتات O) -> (نص اللوحة، رموز الأزرار)
+# (أزرار كل لعبة تحمل الـ nonce الخاص بها فتُبنى من الرموز لكل لعبة)
+render_cache = RenderCache(maxsize=int(os.getenv('XO_RENDER_CACHE_SIZE', '8192')))
+
 # 📊 تحميل وحفظ البيانات
-def load_data():
-    """تحميل البيانات من الملف"""
-    try:
-        with open('xo_data.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {"stats": {}, "themes": {}}
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error loading xo_data.json: {e}")
-        return {"stats": {}, "themes": {}}
-    except Exception as e:
-        logger.error(f"Unexpected error loading xo_data.json: {e}")
-        return {"stats": {}, "themes": {}}
+# XO_STORAGE=json (الملف الأصلي) أو sqlite (قاعدة مفهرسة) أو ndjson (سطر لكل مستخدم + فهرس إزاحات،
+# لا يُقرأ عند التشغيل إلا الفهرس)، انظر storage.py للترحيل
+STORAGE_KIND = os.getenv('XO_STORAGE', 'json')
+STORAGE_PATH = os.getenv(
+    'XO_STORAGE_PATH',
+    {'sqlite': 'xo_data.db', 'ndjson': 'xo_data.ndjson'}.get(STORAGE_KIND, 'xo_data.json'),
+)
+_USER_LOAD_SECONDS = STORAGE_SECONDS.labels("load_user")
+
+# الـ backend يُفتح عند بناء التطبيق (open_storage) وليس عند استيراد الملف
+backend: Optional[StorageBackend] = None
+store: Optional[WriteBehindStore] = None
+
+# 📼 سجل الألعاب الجارية: تُستعاد بعد إعادة التشغيل أو النشر (XO_JOURNAL_PATH فارغ لإيقافه)
+# كل عامل في وضع التقسيم له سجله الخاص (محادثاته فقط)
+JOURNAL_PATH = os.getenv('XO_JOURNAL_PATH', 'xo_games.journal')
+journal = GameJournal(None)
+
+def open_storage() -> WriteBehindStore:
+    """فتح الـ backend والحفظ المؤجل مرة واحدة (الـ handlers تعلّم المستخدم فقط، والكتابة تتم في الخلفية)"""
+    global backend, store
+    if store is None:
+        started = time.perf_counter()
+        backend = open_backend(STORAGE_KIND, STORAGE_PATH)
+        STORAGE_SECONDS.labels("open").observe(time.perf_counter() - started)
+        store = WriteBehindStore(
+            backend,
+            interval=float(os.getenv('XO_FLUSH_INTERVAL', '5')),
+            max_dirty=int(os.getenv('XO_FLUSH_MAX_DIRTY', '100')),
+        )
+        open_journal()
+    return store
 
-def save_data():
-    """حفظ البيانات في الملف"""
-    try:
-        data = {"stats": stats, "themes": {str(k): v for k, v in user_themes.items()}}
-        with open('xo_data.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Error saving data: {e}")
+def open_journal():
+    global journal
+    path = JOURNAL_PATH or None
+    if path and os.getenv('XO_ROLE') == 'worker':
+        path = f"{path}-{os.getenv('XO_SHARD', '0')}"
+    journal = GameJournal(path, snapshot_every=int(os.getenv('XO_JOURNAL_SNAPSHOT_EVERY', '5000')))
+
+def _load_theme(user_id: int) -> str:
+    # ثيم لم يُحفظ بعد (ربما أُخلي من الكاش قبل الحفظ) أولى من المخزّن
+    return store.pending_theme(user_id) or backend.get_theme(str(user_id)) or "classic"
 
-# تحميل البيانات عند البدء
-data = load_data()
-stats = data.get("stats", {}) or {}
-# Only convert keys to int when they look like integers
-raw_themes = data.get("themes", {}) or {}
-user_themes = {int(k): v for k, v in raw_themes.items() if isinstance(k, str) and k.isdigit()}
+def get_user_theme(user_id: int) -> str:
+    """الحصول على ثيم المستخدم (يُحمَّل من الـ backend أول مرة)"""
+    return user_themes.get(user_id, lambda: _load_theme(user_id))
 
-class XOGame:
+class XOGame(XOEngine):
     """فئة للتعامل مع منطق لعبة XO"""
 
-    def __init__(self, user_id: int, timed_mode: bool = False):
-        self.board: List[List[str]] = [[" " for _ in range(3)] for _ in range(3)]
-        self.current_player: str = "X"
-        self.move_count: int = 0
+    __slots__ = (
+        "user_id", "timed_mode", "time_left", "last_move_time", "theme", "vs_bot",
+        "clock", "message_id", "finished", "nonce", "opponent_id", "started_at", "last_active",
+        "_keyboard",
+    )
+
+    def __init__(self, user_id: int, timed_mode: bool = False, vs_bot: Optional[str] = None,
+                 clock: Callable[[], float] = time.monotonic, shape: BoardShape = CLASSIC,
+                 opponent_id: Optional[int] = None):
+        super().__init__(shape)
         self.user_id = user_id
         self.timed_mode = timed_mode
-        self.time_left = {"X": 60, "O": 60} if timed_mode else None
-        self.last_move_time = datetime.now() if timed_mode else None
-        self.theme = user_themes.get(user_id, "classic")
+        self.vs_bot = vs_bot  # مستوى البوت (يلعب بـ O) أو None
+        self.opponent_id = opponent_id  # لاعب O في مباراة بين لاعبين، أو None
+        # ساعة رتيبة (monotonic) قابلة للاستبدال في الاختبارات
+        self.clock = clock
+        self.time_left = {"X": TIMED_MODE_SECONDS, "O": TIMED_MODE_SECONDS} if timed_mode else None
+        self.last_move_time = clock() if timed_mode else None
+        self.theme = get_user_theme(user_id)
+        self.message_id: Optional[int] = None  # رسالة اللعبة (لتحديثها من المؤقتات)
+        self.finished = False
+        self.nonce = cb.new_nonce()  # يُضمَّن في أزرار اللوحة لرفض أزرار الألعاب السابقة
+        self.started_at = time.time()  # بداية المباراة (epoch) لمدتها في الأرشيف
+        self.last_active = self.started_at  # آخر حركة (epoch): مهلة الخمول عند الاستعادة من السجل
+        self._keyboard = None  # (الثيم، بتات X، بتات O، لوحة المفاتيح) لآخر حالة عُرضت
 
     def get_symbols(self):
         """الحصول على رموز الثيم الحالي"""
         return THEMES.get(self.theme, THEMES["classic"])
 
+    def player_id(self, player: str) -> int:
+        """المستخدم الذي يلعب بالرمز (صاحب اللعبة يلعب الرمزين في اللعب الفردي)"""
+        if player == "O" and self.opponent_id is not None:
+            return self.opponent_id
+        return self.user_id
+
     def make_move(self, row: int, col: int) -> bool:
         """تنفيذ حركة اللاعب"""
-        if self.board[row][col] == " ":
-            # تحديث الوقت المتبقي
-            if self.timed_mode and self.last_move_time:
-                elapsed = (datetime.now() - self.last_move_time).total_seconds()
-                self.time_left[self.current_player] -= elapsed
-                if self.time_left[self.current_player] <= 0:
-                    # player's time expired, move is invalid
-                    return False
-
-            self.board[row][col] = self.current_player
-            self.move_count += 1
-            self.last_move_time = datetime.now() if self.timed_mode else None
-            return True
-        return False
-
-    def check_winner(self) -> Optional[str]:
-        """التحقق من الفائز"""
-        # فحص الصفوف
-        for i in range(3):
-            if self.board[i][0] == self.board[i][1] == self.board[i][2] != " ":
-                return self.board[i][0]
-
-        # فحص الأعمدة
-        for i in range(3):
-            if self.board[0][i] == self.board[1][i] == self.board[2][i] != " ":
-                return self.board[0][i]
-
-        # فحص الأقطار
-        if self.board[0][0] == self.board[1][1] == self.board[2][2] != " ":
-            return self.board[1][1]
-        if self.board[0][2] == self.board[1][1] == self.board[2][0] != " ":
-            return self.board[1][1]
-
-        return None
-
-    def is_draw(self) -> bool:
-        """التحقق من التعادل"""
-        return self.move_count == 9 and self.check_winner() is None
+        size = self.shape.size
+        if not (0 <= row < size and 0 <= col < size) or not self.is_empty(row, col):
+            return False
+
+        # تحديث الوقت المتبقي
+        if self.timed_mode and self.last_move_time is not None:
+            now = self.clock()
+            self.time_left[self.current_player] -= now - self.last_move_time
+            self.last_move_time = now
+            if self.time_left[self.current_player] <= 0:
+                # player's time expired, move is invalid
+                return False
+
+        if not super().make_move(row, col):
+            return False
+        self.last_active = time.time()
+        return True
+
+    def remaining(self, player: str) -> float:
+        """الوقت المتبقي للاعب بالثواني"""
+        left = self.time_left[player]
+        if player == self.current_player and self.last_move_time is not None:
+            left -= self.clock() - self.last_move_time
+        return left
+
+    def deadline(self) -> Optional[float]:
+        """لحظة انتهاء وقت اللاعب الحالي (على ساعة اللعبة)"""
+        if not self.timed_mode or self.last_move_time is None:
+            return None
+        return self.last_move_time + self.time_left[self.current_player]
 
     def check_timeout(self) -> Optional[str]:
         """التحقق من انتهاء الوقت"""
-        if not self.timed_mode or not self.last_move_time:
+        if not self.timed_mode or self.last_move_time is None:
             return None
 
-        elapsed = (datetime.now() - self.last_move_time).total_seconds()
-        if self.time_left[self.current_player] - elapsed <= 0:
+        if self.remaining(self.current_player) <= 0:
             return self.current_player
         return None
 
-    def switch_player(self):
-        """تبديل اللاعب"""
-        self.current_player = "O" if self.current_player == "X" else "X"
-
-    def get_board_text(self) -> str:
-        """الحصول على نص اللوحة"""
+    def _render(self):
+        """بناء جسم اللوحة ورموز الأزرار (مرة واحدة لكل ثيم وشكل وحالة لوحة، لكل الألعاب)"""
         symbols = self.get_symbols()
         lines = []
-        for row in self.board:
-            line = " │ ".join([symbols.get(cell, symbols["empty"]) for cell in row])
-            lines.append(line)
+        labels = []
+        size = self.shape.size
+        for i in range(size):
+            row = tuple(symbols.get(self.cell(i, j), symbols["empty"]) for j in range(size))
+            lines.append(" │ ".join(row))
+            labels.append(row)
 
         # Build board with clearer borders/newlines
-        board_body = "\n".join([f"{line}" for line in lines])
-        border = "─" * 11
+        board_body = "\n".join(lines)
+        border = "─" * (4 * size - 1)
         board_text = f"{border}\n{board_body}\n{border}"
+        return board_text, tuple(labels)
+
+    def _rendered(self):
+        return render_cache.get((self.theme, self.shape, self.x_bits, self.o_bits), self._render)
 
-        # إضافة معلومات الوقت
+    def get_board_text(self) -> str:
+        """الحصول على نص اللوحة"""
+        board_text = self._rendered()[0]
+
+        # إضافة معلومات الوقت (متغيرة، لا تُخزن في الكاش)
         if self.timed_mode:
-            elapsed = (datetime.now() - self.last_move_time).total_seconds() if self.last_move_time else 0
-            time_x = max(0, int(self.time_left["X"] - (elapsed if self.current_player == "X" else 0)))
-            time_o = max(0, int(self.time_left["O"] - (elapsed if self.current_player == "O" else 0)))
+            symbols = self.get_symbols()
+            time_x = max(0, int(self.remaining("X")))
+            time_o = max(0, int(self.remaining("O")))
             board_text += f"\n\n⏱️ الوقت: {symbols['X']} {time_x}s | {symbols['O']} {time_o}s"
 
         return board_text
 
     def get_keyboard(self) -> InlineKeyboardMarkup:
-        """إنشاء لوحة المفاتيح"""
-        symbols = self.get_symbols()
-        keyboard = []
-        for i in range(3):
-            row = []
-            for j in range(3):
-                if self.board[i][j] == " ":
-                    button_text = symbols["empty"]
-                else:
-                    button_text = symbols[self.board[i][j]]
-                row.append(InlineKeyboardButton(button_text, callback_data=f"{i},{j}"))
-            keyboard.append(row)
-
-        # أزرار التحكم
-        control_row = [
-            InlineKeyboardButton("🔄 جديدة", callback_data="restart"),
-            InlineKeyboardButton("📊 إحصائيات", callback_data="show_stats"),
-            InlineKeyboardButton("🎨 ثيم", callback_data="change_theme")
+        """لوحة المفاتيح: رموز الكاش المشترك مع أزرار تحمل nonce هذه اللعبة (تُحفظ لآخر حالة فقط)"""
+        cached = self._keyboard
+        if cached is not None and cached[:3] == (self.theme, self.x_bits, self.o_bits):
+            return cached[3]
+        size = self.shape.size
+        keyboard = [
+            [
+                InlineKeyboardButton(label, callback_data=cb.encode_move(i * size + j, self.nonce))
+                for j, label in enumerate(row)
+            ]
+            for i, row in enumerate(self._rendered()[1])
         ]
-        keyboard.append(control_row)
-
-        return InlineKeyboardMarkup(keyboard)
-
-def get_user_stats(user_id: int) -> Dict:
-    """الحصول على إحصائيات المستخدم"""
-    user_id_str = str(user_id)
-    if user_id_str not in stats:
-        stats[user_id_str] = {
-            "wins": 0,
-            "losses": 0,
-            "draws": 0,
-            "total_games": 0,
-            "history": []
-        }
-    return stats[user_id_str]
+        # أزرار التحكم (الانسحاب فقط في مباراة بين لاعبين)
+        if self.opponent_id is None:
+            keyboard.append(GAME_CONTROL_ROW)
+        else:
+            keyboard.append([InlineKeyboardButton("🏳️ انسحاب", callback_data=cb.encode(cb.RESIGN, self.nonce))])
+        markup = InlineKeyboardMarkup(keyboard)
+        self._keyboard = (self.theme, self.x_bits, self.o_bits, markup)
+        return markup
+
+def get_user_stats(user_id: int) -> int:
+    """خانة المستخدم في جدول الإحصائيات (تُحمَّل من الـ backend أول مرة)"""
+    slot = stats.slot(user_id)
+    if slot is None:
+        started = time.perf_counter()
+        slot = stats.add(user_id, backend.get_stats(str(user_id)))
+        _USER_LOAD_SECONDS.observe(time.perf_counter() - started)
+    return slot
+
+def fresh_user_stats(user_id: int) -> int:
+    """
+    خانة المستخدم بعد إعادة قراءتها من الـ backend المشترك (في وضع الأجزاء فقط)،
+    ما لم تكن له هنا نتائج لم تُحفظ بعد (تظهر مباريات الأجزاء الأخرى بعد الحفظ التالي)
+    """
+    if SHARED_STORE and user_id in stats and not store.is_dirty(str(user_id)):
+        stats.drop(user_id)
+        slot = get_user_stats(user_id)
+        leaderboard.update(user_id, stats.wins[slot], stats.total[slot])
+        return slot
+    return get_user_stats(user_id)
 
 def update_stats(user_id: int, result: str):
     """تحديث الإحصائيات"""
-    user_stats = get_user_stats(user_id)
-    user_stats["total_games"] += 1
-
-    if result == "win":
-        user_stats["wins"] += 1
-    elif result == "loss":
-        user_stats["losses"] += 1
-    elif result == "draw":
-        user_stats["draws"] += 1
-
-    # إضافة للتاريخ
-    game_record = {
-        "date": datetime.now().strftime("%Y-%m-%d %H:%M"),
-        "result": result
-    }
-    user_stats["history"].insert(0, game_record)
-    user_stats["history"] = user_stats["history"][:10]  # الاحتفاظ بآخر 10 فقط
-
-    save_data()
+    slot = fresh_user_stats(user_id)
+    now = int(time.time())
+    stats.record(slot, result, now)
+    leaderboard.update(user_id, stats.wins[slot], stats.total[slot])
+
+    # تُحفظ كزيادة على العدادات المخزنة (آمن مع عدة عمليات تتشارك قاعدة SQLite)
+    store.mark_result(str(user_id), {"ts": now, "result": result})
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """قائمة البداية"""
-    keyboard = [
-        [
-            InlineKeyboardButton("🎮 لعب عادي", callback_data="mode_normal"),
-            InlineKeyboardButton("⏱️ لعب بالوقت", callback_data="mode_timed")
-        ],
-        [
-            InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
-            InlineKeyboardButton("🎨 تغيير الثيم", callback_data="change_theme")
-        ],
-        [
-            InlineKeyboardButton("📜 تاريخ المباريات", callback_data="show_history"),
-            InlineKeyboardButton("❓ مساعدة", callback_data="show_help")
-        ]
-    ]
-
     user_name = update.effective_user.first_name if update.effective_user else "Player"
+    if update.effective_user:
+        player_names[update.effective_user.id] = user_name
     welcome_text = (
         f"👋 أهلاً **{user_name}**!\n\n"
         "🎮 **مرحباً بك في لعبة XO المطورة!**\n\n"
@@ -262,354 +562,1023 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(
         welcome_text,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=MAIN_MENU_MARKUP,
         parse_mode='Markdown'
     )
 
-async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """معالجة نقرات الأزرار"""
-    query = update.callback_query
-    if not query:
-        return
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """الأمر /top: الصفحة الأولى من المتصدرين"""
+    user = update.effective_user
+    if user:
+        player_names[user.id] = user.first_name
+    await update.message.reply_text(
+        leaderboard_text(0, user.id if user else None),
+        reply_markup=leaderboard_markup(0),
+        parse_mode='Markdown'
+    )
 
-    # answer callback once (non-alert); branches that need an alert will try to use query.answer again but handle exceptions
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    الأمر /profile للمشرفين فقط: on [نسبة العينة] ، off (مع حفظ التقارير) ، dump ، أو الحالة بدون وسيط
+    """
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        return
+    args = context.args or []
+    command = args[0] if args else "status"
+    if command == "on":
+        try:
+            rate = float(args[1]) if len(args) > 1 else None
+        except ValueError:
+            rate = None
+        if rate is not None and not 0 < rate <= 1:
+            rate = None
+        profiler.start(sample_rate=rate)
+        text = f"🔬 التحليل يعمل: عينة {profiler.sample_rate:.0%} من النقرات"
+    elif command in ("off", "dump"):
+        if command == "off":
+            profiler.stop()
+        paths = profiler.dump()
+        text = "💾 التقارير:\n" + "\n".join(paths)
+    else:
+        text = f"🔬 {profiler.metrics()}"
+    await update.message.reply_text(text)
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    الأمر /export للمشرفين فقط: csv أو jsonl [عدد الأيام] يرسل أرشيف المباريات كملف،
+    و stats [عدد الأيام] يلخص نسب الفوز حسب الخانة الأولى وطول المباريات حسب الوضع
+    """
+    user = update.effective_user
+    if user is None or user.id not in ADMIN_IDS:
+        return
+    args = context.args or []
+    fmt = args[0] if args else "csv"
     try:
-        await query.answer()
-    except Exception:
-        # ignore if already answered
-        pass
+        days = float(args[1]) if len(args) > 1 else 0.0
+    except ValueError:
+        days = 0.0
+    since = int(time.time() - days * 86400) if days > 0 else 0
+
+    # القراءة تمر على كل المقاطع: في خيط حتى لا تُوقف الـ event loop
+    if fmt == "stats":
+        first_moves, lengths = await asyncio.to_thread(archive.aggregate, FirstMoveWinRates(), LengthByMode(), since=since)
+        lines = ["🗄️ حسب الوضع:"]
+        for mode, row in lengths.items():
+            lines.append(f"{mode}: {row['games']} مباراة، {row['avg_moves']} حركة، {row['avg_seconds']}s")
+        for board, cells in first_moves.items():
+            lines.append(f"\n🎯 {board} حسب الخانة الأولى (فوز X / فوز O / تعادل):")
+            for cell, row in cells.items():
+                lines.append(
+                    f"{cell}: {row['x_win_rate']:.0%} / {row['o_win_rate']:.0%} / {row['draw_rate']:.0%} ({row['games']})"
+                )
+        await update.message.reply_text("\n".join(lines))
+        return
+    if fmt not in ("csv", "jsonl"):
+        await update.message.reply_text("❓ /export csv | jsonl | stats [الأيام]")
+        return
 
-    chat_id = query.message.chat.id if query.message and query.message.chat else None
-    user_id = query.from_user.id if query.from_user else None
-    user_name = query.from_user.first_name if query.from_user else "Player"
+    def write_export() -> Tuple[str, int]:
+        fd, path = tempfile.mkstemp(prefix="xo_matches_", suffix=f".{fmt}")
+        with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+            return path, archive.export(f, fmt, since=since)
 
-    # If we can't determine chat or user, abort safely
-    if chat_id is None or user_id is None:
+    path, count = await asyncio.to_thread(write_export)
+    try:
+        with open(path, "rb") as f:
+            await update.message.reply_document(f, filename=f"xo_matches.{fmt}", caption=f"🗄️ {count} مباراة")
+    finally:
+        os.unlink(path)
+
+def display_name(user_id: int) -> str:
+    """اسم اللاعب للعرض داخل نص Markdown"""
+    return escape_markdown(player_names.get(user_id) or f"لاعب …{str(user_id)[-4:]}")
+
+def leaderboard_text(page: int, user_id: Optional[int]) -> str:
+    """نص صفحة من المتصدرين مع ترتيب المستخدم نفسه"""
+    entries = leaderboard.page(page)
+    if not entries:
+        return "🏆 **المتصدرون**\n\nلا توجد مباريات بعد، كن أول من يفوز!"
+
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = [f"🏆 **المتصدرون** (صفحة {page + 1}/{leaderboard.pages})\n"]
+    for rank, uid, wins, total, rate in entries:
+        lines.append(f"{medals.get(rank, f'{rank}.')} {display_name(uid)}: 🏆 {wins} | 🎮 {total} | 📈 {rate * 100:.0f}%")
+
+    my_rank = leaderboard.rank(user_id) if user_id is not None else None
+    if my_rank is not None:
+        lines.append(f"\n📍 ترتيبك: {my_rank} من {len(leaderboard)}")
+    return "\n".join(lines)
+
+_LEADERBOARD_MARKUPS: Dict[tuple, InlineKeyboardMarkup] = {}
+
+def leaderboard_markup(page: int) -> InlineKeyboardMarkup:
+    """أزرار التنقل بين الصفحات (مخزنة لكل صفحة وعدد صفحات)"""
+    key = (page, leaderboard.pages)
+    markup = _LEADERBOARD_MARKUPS.get(key)
+    if markup is None:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ السابق", callback_data=cb.encode(cb.LEADERBOARD, str(page - 1))))
+        if page + 1 < leaderboard.pages:
+            nav.append(InlineKeyboardButton("التالي ➡️", callback_data=cb.encode(cb.LEADERBOARD, str(page + 1))))
+        rows = [nav] if nav else []
+        rows.append([InlineKeyboardButton("🔙 رجوع", callback_data=cb.encode(cb.MENU))])
+        markup = _LEADERBOARD_MARKUPS[key] = InlineKeyboardMarkup(rows)
+    return markup
+
+async def show(query, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    عرض الحالة المطلوبة لرسالة الزر: تُسجل في طابور الإرسال وتعود فوراً،
+    أو تُعدل مباشرة إن لم يكن الطابور يعمل
+    """
+    message = query.message
+    if outbound.running and message is not None:
+        outbound.post(message.chat.id, message.message_id, text, reply_markup, 'Markdown')
         return
+    await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
 
-    # اختيار الوضع العادي
-    if query.data == "mode_normal":
-        game = XOGame(user_id, timed_mode=False)
-        games[chat_id] = game
-
-        symbols = game.get_symbols()
-        await query.edit_message_text(
-            f"🎮 **لعبة جديدة!**\n\n"
-            f"🎯 دور: {symbols['X']}\n"
-            f"💡 {random.choice(MESSAGES['move'])}",
-            reply_markup=game.get_keyboard(),
+async def edit_game_message(bot, chat_id: int, message_id: int, text: str,
+                            reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """تعديل رسالة لعبة من خارج الـ handler (المؤقتات)"""
+    if outbound.running:
+        outbound.post(chat_id, message_id, text, reply_markup, 'Markdown')
+        return
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup,
             parse_mode='Markdown'
         )
+    except Exception as e:
+        logger.debug(f"Could not edit game message in {chat_id}: {e}")
+
+async def edit_game(bot, key: Hashable, game: XOGame, text: str,
+                    reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """تعديل رسالة اللعبة حسب مفتاحها (رسائل المحادثات عبر الطابور، والمضمّنة مباشرة)"""
+    chat_id = game_chat(key)
+    if chat_id is not None:
+        await edit_game_message(bot, chat_id, game.message_id, text, reply_markup)
         return
+    try:
+        await bot.edit_message_text(text, inline_message_id=key, reply_markup=reply_markup, parse_mode='Markdown')
+    except Exception as e:
+        logger.debug(f"Could not edit inline game message {key}: {e}")
 
-    # اختيار الوضع بالوقت
-    elif query.data == "mode_timed":
-        game = XOGame(user_id, timed_mode=True)
-        games[chat_id] = game
+# ----------------------------------------------------------------------
+# 📊 المقاييس: عدادات مربوطة مسبقاً حتى لا يُبنى أي label في المسار الساخن
+# ----------------------------------------------------------------------
 
-        symbols = game.get_symbols()
-        await query.edit_message_text(
-            f"⏱️ **وضع الوقت!**\n\n"
-            f"⏰ لديك 60 ثانية لكل لاعب\n"
-            f"🎯 دور: {symbols['X']}\n"
-            f"💡 أسرع!",
-            reply_markup=game.get_keyboard(),
-            parse_mode='Markdown'
-        )
-        return
+GAME_MODES = ("normal", "timed", "bot", "pvp")
+GAME_RESULTS = ("win", "loss", "draw", "timeout", "resign")
+_STARTED = {mode: GAMES_STARTED.labels(mode) for mode in GAME_MODES}
+_FINISHED = {(mode, result): GAMES_FINISHED.labels(mode, result) for mode in GAME_MODES for result in GAME_RESULTS}
+_TIMEOUTS = TIMEOUTS.labels()
+_STICKER_FAILURES = STICKER_FAILURES.labels()
+
+def _count_effect_failure(kind: str):
+    # الستيكرز المرسلة في الخلفية تُحسب في نفس عداد الإرسال المباشر (بعد فشل كل المحاولات)
+    if kind == "sticker":
+        _STICKER_FAILURES.inc()
+
+effects.on_failed = _count_effect_failure
+
+LIVE_GAMES.labels().set_function(lambda: len(games))
+KNOWN_USERS.labels().set_function(lambda: len(stats))
+
+# مقياس زمن كل نوع من الأزرار (حسب الإجراء بعد فك الترميز)
+_ACTION_TIMERS = {action: BUTTON_SECONDS.labels(name) for action, name in cb.ACTION_NAMES.items()}
+_UNKNOWN_TIMER = BUTTON_SECONDS.labels("unknown")
+
+def game_mode(game: XOGame) -> str:
+    if game.opponent_id is not None:
+        return "pvp"
+    if game.vs_bot:
+        return "bot"
+    return "timed" if game.timed_mode else "normal"
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest يقيس زمن كل استدعاء لـ Bot API حسب اسم الطريقة"""
+
+    __slots__ = ("_timers",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._timers: Dict[str, object] = {}
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        timer = self._timers.get(api_method)
+        if timer is None:
+            timer = self._timers[api_method] = API_SECONDS.labels(api_method)
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        finally:
+            timer.observe(time.perf_counter() - started)
 
-    # تغيير الثيم
-    elif query.data == "change_theme":
-        keyboard = []
-        for theme_name, theme_symbols in THEMES.items():
-            emoji = "✅" if user_themes.get(user_id, "classic") == theme_name else ""
-            button_text = f"{theme_symbols['X']} {theme_name.title()} {emoji}"
-            keyboard.append([InlineKeyboardButton(button_text, callback_data=f"theme_{theme_name}")])
-        keyboard.append([InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")])
+# 🧭 موجّه الأزرار: معالج لكل إجراء، والتوجيه بقاموس
+router = CallbackRouter()
 
-        await query.edit_message_text(
-            "🎨 **اختر الثيم المفضل:**",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالجة نقرات الأزرار: فك الترميز والتوجيه لمعالج الإجراء (مع قياس الزمن)"""
+    query = update.callback_query
+    if not query:
         return
+    started = time.perf_counter()
+    if profiler.active:
+        action = await profiler.run(router.dispatch(query, context))
+    else:
+        action = await router.dispatch(query, context)
+    _ACTION_TIMERS.get(action, _UNKNOWN_TIMER).observe(time.perf_counter() - started)
+
+async def alert(tap: Tap, text: str):
+    """تنبيه منبثق: يكون هو الجواب الوحيد على الـ callback (الموجّه لا يجيب بعده)"""
+    tap.answered = True
+    try:
+        await tap.query.answer(text, show_alert=True)
+    except Exception as e:
+        logger.debug(f"Could not show alert: {e}")
 
-    # تطبيق الثيم
-    elif query.data.startswith("theme_"):
-        theme_name = query.data.replace("theme_", "")
-        user_themes[user_id] = theme_name
-        save_data()
+async def send_sticker(bot, chat_id: Optional[int], kind: str):
+    """ستيكر النتيجة: يُرسل في الخلفية (الـ handler لا ينتظره)، أو مباشرة إن لم يكن الطابور يعمل"""
+    if chat_id is None:
+        # رسالة مضمّنة: لا توجد محادثة نعرفها لإرسال الستيكر
+        return
+    sticker_id = random.choice(STICKERS[kind])
+    if effects.running:
+        effects.submit("sticker", lambda: bot.send_sticker(chat_id=chat_id, sticker=sticker_id))
+        return
+    try:
+        await bot.send_sticker(chat_id=chat_id, sticker=sticker_id)
+    except Exception:
+        _STICKER_FAILURES.inc()
+
+def board_variant(arg: str):
+    """(الشكل، الاسم) من وسيط زر الوضع، أو None لحجم غير معروف"""
+    return BOARD_VARIANTS.get(arg or DEFAULT_BOARD)
+
+def board_line(shape: BoardShape) -> str:
+    """سطر حجم اللوحة في رسالة البداية (لا شيء للوحة 3×3)"""
+    if shape is CLASSIC:
+        return ""
+    return f"📐 اللوحة: {BOARD_VARIANTS[_VARIANT_KEYS[shape]][1]}\n"
+
+def game_chat(key: Hashable) -> Optional[int]:
+    """محادثة اللعبة من مفتاحها (None للعبة على رسالة مضمّنة)"""
+    if isinstance(key, tuple):
+        return key[0]
+    return None if isinstance(key, str) else key
+
+def find_game(tap: Tap):
+    """(المفتاح، اللعبة) لرسالة الزر: مباراة بين لاعبين على هذه الرسالة، أو لعبة المحادثة"""
+    message = tap.query.message
+    if message is not None:
+        key = (tap.chat_id, message.message_id)
+        game = games.get(key)
+        if game is not None:
+            return key, game
+    return tap.chat_id, games.get(tap.chat_id)
+
+def players_line(game: XOGame) -> str:
+    """سطر اللاعبين في مباراة بين لاعبين (لا شيء في اللعب الفردي)"""
+    if game.opponent_id is None:
+        return ""
+    symbols = game.get_symbols()
+    return f"⚔️ {symbols['X']} {display_name(game.user_id)} ضد {symbols['O']} {display_name(game.opponent_id)}\n"
+
+def pvp_mode(game: XOGame) -> str:
+    """وسيط وضع المباراة (لزر مباراة أخرى بنفس الوضع والحجم)"""
+    return ("t" if game.timed_mode else "n") + _variant_arg(_VARIANT_KEYS.get(game.shape, DEFAULT_BOARD))
+
+def game_over_markup(key: Hashable, game: XOGame) -> InlineKeyboardMarkup:
+    if game.opponent_id is None:
+        return GAME_OVER_MARKUP
+    if game_chat(key) is None:
+        return PVP_INLINE_OVER_MARKUPS[pvp_mode(game)]
+    return PVP_OVER_MARKUPS[pvp_mode(game)]
+
+def record_match(game: XOGame, winner: Optional[str], result: str):
+    """نتيجة مباراة بين لاعبين في إحصائيات الاثنين (winner=None للتعادل)"""
+    if winner is None:
+        update_stats(game.user_id, "draw")
+        update_stats(game.opponent_id, "draw")
+    else:
+        update_stats(game.player_id(winner), "win")
+        update_stats(game.player_id("O" if winner == "X" else "X"), "loss")
+    _FINISHED["pvp", result].inc()
+
+# اختيار الوضع العادي
+@router.register(cb.MODE_NORMAL)
+async def on_mode_normal(tap: Tap):
+    variant = board_variant(tap.arg)
+    if variant is None:
+        return
+    game = XOGame(tap.user_id, timed_mode=False, shape=variant[0])
+    games[tap.chat_id] = game
+    journal.created(tap.chat_id, game)
+    _STARTED["normal"].inc()
 
-        symbols = THEMES.get(theme_name, THEMES["classic"])
-        # Try to show an alert; may raise if callback already answered
-        try:
-            await query.answer(f"✅ تم تطبيق ثيم {theme_name}!", show_alert=True)
-        except Exception:
-            # ignore duplicate answer errors
-            pass
+    symbols = game.get_symbols()
+    await show(
+        tap.query,
+        f"🎮 **لعبة جديدة!**\n\n"
+        f"{board_line(game.shape)}"
+        f"🎯 دور: {symbols['X']}\n"
+        f"💡 {random.choice(MESSAGES['move'])}",
+        reply_markup=game.get_keyboard()
+    )
 
-        await query.edit_message_text(
-            f"✨ **تم تغيير الثيم!**\n\n"
-            f"الثيم الجديد: {symbols['X']} {theme_name.title()}\n\n"
-            f"جرب اللعب الآن!",
-            reply_markup=InlineKeyboardMarkup([[
-                InlineKeyboardButton("🎮 ابدأ اللعب", callback_data="mode_normal"),
-                InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")
-            ]]),
-            parse_mode='Markdown'
-        )
+# اختيار الوضع بالوقت
+@router.register(cb.MODE_TIMED)
+async def on_mode_timed(tap: Tap):
+    variant = board_variant(tap.arg)
+    if variant is None:
         return
+    game = XOGame(tap.user_id, timed_mode=True, shape=variant[0])
+    game.message_id = tap.query.message.message_id
+    games[tap.chat_id] = game
+    journal.created(tap.chat_id, game)
+    _STARTED["timed"].inc()
 
-    # عرض الإحصائيات
-    elif query.data == "show_stats":
-        user_stats = get_user_stats(user_id)
-        total = user_stats["total_games"]
-        win_rate = (user_stats["wins"] / total * 100) if total > 0 else 0
+    symbols = game.get_symbols()
+    await show(
+        tap.query,
+        f"⏱️ **وضع الوقت!**\n\n"
+        f"{board_line(game.shape)}"
+        f"⏰ لديك {TIMED_MODE_SECONDS} ثانية لكل لاعب\n"
+        f"🎯 دور: {symbols['X']}\n"
+        f"💡 أسرع!",
+        reply_markup=game.get_keyboard()
+    )
+    schedule_game_clock(tap.chat_id, game, tap.context.bot)
+
+# قائمة اللوحات الأكبر
+@router.register(cb.BOARDS)
+async def on_boards(tap: Tap):
+    await show(
+        tap.query,
+        "📐 **لوحات أكبر!**\n\nأربعة في صف (أفقي أو عمودي أو قطري) للفوز.\nاختر اللوحة والوضع:",
+        reply_markup=BOARDS_MARKUP
+    )
 
-        stats_text = (
-            f"📊 **إحصائيات {user_name}**\n\n"
-            f"🎮 المباريات: {total}\n"
-            f"🏆 الانتصارات: {user_stats['wins']}\n"
-            f"💔 الخسارات: {user_stats['losses']}\n"
-            f"🤝 التعادل: {user_stats['draws']}\n"
-            f"📈 نسبة الفوز: {win_rate:.1f}%\n"
-        )
+# اختيار مستوى البوت
+@router.register(cb.MODE_BOT)
+async def on_mode_bot(tap: Tap):
+    await show(
+        tap.query,
+        "🤖 **العب ضد البوت!**\n\nاختر المستوى:",
+        reply_markup=BOT_LEVEL_MARKUP
+    )
 
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")]]
-        await query.edit_message_text(
-            stats_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+# بدء لعبة ضد البوت
+@router.register(cb.BOT_LEVEL)
+async def on_bot_level(tap: Tap):
+    level = tap.arg
+    if level not in BOT_LEVELS:
         return
+    game = XOGame(tap.user_id, vs_bot=level)
+    games[tap.chat_id] = game
+    journal.created(tap.chat_id, game)
+    _STARTED["bot"].inc()
 
-    # عرض التاريخ
-    elif query.data == "show_history":
-        user_stats = get_user_stats(user_id)
-        history = user_stats.get("history", [])
+    symbols = game.get_symbols()
+    await show(
+        tap.query,
+        f"🤖 **ضد البوت!** ({BOT_LEVELS[level]})\n\n"
+        f"🎯 أنت: {symbols['X']} | البوت: {symbols['O']}\n"
+        f"💡 {random.choice(MESSAGES['move'])}",
+        reply_markup=game.get_keyboard()
+    )
 
-        if not history:
-            history_text = "📜 **لا توجد مباريات سابقة**\n\nابدأ اللعب لبناء تاريخك!"
+# ----------------------------------------------------------------------
+# ⚔️ ضد صديق: طابور انتظار في المجموعات، أو تحدٍّ على رسالة مضمّنة
+# المباراة في مجموعة مفتاحها (المحادثة، رسالة اللعبة) فتتعدد المباريات في نفس المجموعة،
+# وعلى رسالة مضمّنة مفتاحها inline_message_id
+# ----------------------------------------------------------------------
+
+def start_match(key: Hashable, mode: str, x_id: int, o_id: int, message_id: Optional[int], bot) -> XOGame:
+    """بدء مباراة بين لاعبين (صاحب الانتظار أو التحدي يلعب بـ X ويبدأ)"""
+    timed, shape, _ = PVP_MODES[mode]
+    game = XOGame(x_id, timed_mode=timed, shape=shape, opponent_id=o_id)
+    game.message_id = message_id
+    games[key] = game
+    journal.created(key, game)
+    _STARTED["pvp"].inc()
+    if timed:
+        schedule_game_clock(key, game, bot)
+    return game
+
+def match_text(game: XOGame) -> str:
+    return f"⚔️ **بدأت المباراة!**\n{board_line(game.shape)}\n{turn_text(game, 'بالتوفيق للاثنين!')}"
+
+def challenge_text(mode: str, user_id: int) -> str:
+    return f"⚔️ **{display_name(user_id)}** يتحدى في XO! ({PVP_MODES[mode][2]})\n\nأول من يقبل يلعب ضده:"
+
+def challenge_markup(mode: str, user_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("⚔️ اقبل التحدي", callback_data=cb.encode(cb.PVP, f"{mode}@{user_id}"))
+    ]])
+
+async def expire_ticket(ticket: Ticket, bot):
+    """انتهى الانتظار بدون خصم"""
+    await edit_game_message(
+        bot, ticket.scope, ticket.message_id,
+        f"⌛ **لم يُعثر على خصم** ({PVP_MODES[ticket.mode][2]})\n\nجرب مرة أخرى:",
+        PVP_MENU_MARKUP
+    )
+
+@router.register(cb.PVP)
+async def on_pvp(tap: Tap):
+    player_names[tap.user_id] = tap.user_name
+    message = tap.query.message
+    private = message is not None and message.chat.type == "private"
+    if not tap.arg:
+        if private:
+            await show(tap.query, PVP_PRIVATE_TEXT, reply_markup=PVP_PRIVATE_MARKUP)
         else:
-            history_text = f"📜 **آخر {len(history)} مباريات:**\n\n"
-            for i, game in enumerate(history, 1):
-                result_emoji = {"win": "🏆", "loss": "💔", "draw": "🤝"}.get(game["result"], "🎮")
-                history_text += f"{i}. {result_emoji} {game['result'].upper()} - {game['date']}\n"
-
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")]]
-        await query.edit_message_text(
-            history_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+            await show(tap.query, PVP_MENU_TEXT, reply_markup=PVP_MENU_MARKUP)
         return
 
-    # المساعدة
-    elif query.data == "show_help":
-        help_text = (
-            "📖 **دليل اللعبة:**\n\n"
-            "🎮 **الأوضاع:**\n"
-            "• عادي: لعب بدون حدود زمنية\n"
-            "• بالوقت: 60 ثانية لكل لاعب\n\n"
-            "🎨 **الثيمات:**\n"
-            "• 6 ثيمات مختلفة للاختيار\n"
-            "• غير الثيم من الإعدادات\n\n"
-            "📊 **الإحصائيات:**\n"
-            "• تُحفظ كل نتائجك تلقائياً\n"
-            "• شاهد آخر 10 مباريات\n\n"
-            "🎵 **المكافآت:**\n"
-            "• ستيكرز عند الفوز/الخسارة\n"
-            "• رسائل تشجيعية مستمرة\n\n"
-            "💡 **نصيحة:** العب باستمرار لتحسين إحصائياتك!"
-        )
-
-        keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="back_to_menu")]]
-        await query.edit_message_text(
-            help_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+    mode, inline, challenger = tap.arg.partition("@")
+    if mode not in PVP_MODES:
+        return
+    bot = tap.context.bot
+
+    # 📨 رسالة مضمّنة: التحدي نفسه هو الطابور (صاحبه مكتوب في الزر)
+    if message is None:
+        if not inline:
+            return
+        if not challenger:
+            # زر "مباراة أخرى": من يضغطه يصبح صاحب التحدي الجديد
+            await show(tap.query, challenge_text(mode, tap.user_id), reply_markup=challenge_markup(mode, tap.user_id))
+            return
+        if not challenger.isdigit():
+            return
+        if int(challenger) == tap.user_id:
+            await alert(tap, "⏳ بانتظار من يقبل تحديك!")
+            return
+        live = games.get(tap.chat_id)
+        if live is not None and not live.finished:
+            await alert(tap, "⚔️ المباراة بدأت بالفعل!")
+            return
+        game = start_match(tap.chat_id, mode, int(challenger), tap.user_id, None, bot)
+        await show(tap.query, match_text(game), reply_markup=game.get_keyboard())
         return
 
-    # رجوع للقائمة
-    elif query.data == "back_to_menu":
-        keyboard = [
-            [
-                InlineKeyboardButton("🎮 لعب عادي", callback_data="mode_normal"),
-                InlineKeyboardButton("⏱️ لعب بالوقت", callback_data="mode_timed")
-            ],
-            [
-                InlineKeyboardButton("📊 إحصائياتي", callback_data="show_stats"),
-                InlineKeyboardButton("🎨 تغيير الثيم", callback_data="change_theme")
-            ],
-            [
-                InlineKeyboardButton("📜 تاريخ المباريات", callback_data="show_history"),
-                InlineKeyboardButton("❓ مساعدة", callback_data="show_help")
-            ]
-        ]
+    if private:
+        await show(tap.query, PVP_PRIVATE_TEXT, reply_markup=PVP_PRIVATE_MARKUP)
+        return
 
-        await query.edit_message_text(
-            f"👋 أهلاً **{user_name}**!\n\n🎮 اختر وضع اللعب:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
+    # 👥 مجموعة: طابور لكل وضع
+    waiting = lobby.ticket(tap.user_id)
+    if waiting is not None:
+        if waiting.scope == tap.chat_id and waiting.mode == mode:
+            await alert(tap, "⏳ أنت في طابور الانتظار بالفعل!")
+            return
+        # لاعب ينتظر في طابور واحد فقط: الانتظار السابق يُلغى
+        lobby.leave(tap.user_id)
+        if (waiting.scope, waiting.message_id) != (tap.chat_id, message.message_id):
+            await edit_game_message(bot, waiting.scope, waiting.message_id, "❌ **أُلغي الانتظار**", PVP_MENU_MARKUP)
+
+    opponent = lobby.join(
+        tap.chat_id, mode, tap.user_id, tap.user_name, message.message_id,
+        lambda ticket: expire_ticket(ticket, bot),
+    )
+    if opponent is None:
+        await show(
+            tap.query,
+            f"⏳ **{display_name(tap.user_id)}** ينتظر خصماً ({PVP_MODES[mode][2]})\n\nاضغط انضم للعب ضده!",
+            reply_markup=PVP_LOBBY_MARKUPS[mode]
         )
         return
 
-    game = games.get(chat_id)
+    # المباراة على رسالة انتظار الخصم (حيث ينتظر)
+    key = (tap.chat_id, opponent.message_id)
+    game = start_match(key, mode, opponent.user_id, tap.user_id, opponent.message_id, bot)
+    if opponent.message_id == message.message_id:
+        await show(tap.query, match_text(game), reply_markup=game.get_keyboard())
+        return
+    await edit_game_message(bot, tap.chat_id, opponent.message_id, match_text(game), game.get_keyboard())
+    await show(
+        tap.query,
+        f"⚔️ **وجدنا خصماً!**\n\nمباراتك ضد {display_name(opponent.user_id)} في رسالة انتظاره 👆",
+        reply_markup=BACK_MARKUP
+    )
 
-    if not game:
-        try:
-            await query.answer("❌ اللعبة غير موجودة!", show_alert=True)
-        except Exception:
-            pass
+@router.register(cb.PVP_CANCEL)
+async def on_pvp_cancel(tap: Tap):
+    ticket = lobby.ticket(tap.user_id)
+    message = tap.query.message
+    if ticket is None or message is None or (ticket.scope, ticket.message_id) != (tap.chat_id, message.message_id):
+        await alert(tap, "❌ لست في طابور الانتظار هنا!")
+        return
+    lobby.leave(tap.user_id)
+    await show(tap.query, PVP_MENU_TEXT, reply_markup=PVP_MENU_MARKUP)
+
+@router.register(cb.RESIGN)
+async def on_resign(tap: Tap):
+    key, game = find_game(tap)
+    if game is None or game.nonce != tap.arg or game.finished:
+        await alert(tap, "🏁 انتهت هذه اللعبة!")
+        return
+    if game.opponent_id is None or tap.user_id not in (game.user_id, game.opponent_id):
+        await alert(tap, "👀 هذه مباراة بين لاعبين آخرين!")
         return
 
-    # إعادة اللعب
-    if query.data == "restart":
-        keyboard = [
-            [
-                InlineKeyboardButton("🎮 عادي", callback_data="mode_normal"),
-                InlineKeyboardButton("⏱️ بالوقت", callback_data="mode_timed")
-            ],
-            [InlineKeyboardButton("🔙 القائمة", callback_data="back_to_menu")]
-        ]
-        await query.edit_message_text(
-            "🔄 **لعبة جديدة؟**\n\nاختر الوضع:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
+    winner = "O" if tap.user_id == game.user_id else "X"
+    game.finished = True
+    journal.ended(key)
+    cancel_game_clock(key)
+    record_match(game, winner, "resign")
+    archive.append(game, game_mode(game), "resign", winner)
+
+    symbols = game.get_symbols()
+    await show(
+        tap.query,
+        f"🏳️ **{display_name(tap.user_id)}** انسحب!\n\n"
+        f"{players_line(game)}"
+        f"🏆 الفائز: {symbols[winner]} {display_name(game.player_id(winner))}\n"
+        f"{game.get_board_text()}",
+        reply_markup=game_over_markup(key, game)
+    )
+    await send_sticker(tap.context.bot, game_chat(key), "win")
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """التحدي من أي محادثة: اسم البوت ثم اختيار الوضع والحجم"""
+    query = update.inline_query
+    if not query:
+        return
+    user = query.from_user
+    player_names[user.id] = user.first_name
+    results = [
+        InlineQueryResultArticle(
+            id=mode,
+            title=f"⚔️ تحدٍّ: {label}",
+            description="أول من يقبل يلعب ضدك",
+            input_message_content=InputTextMessageContent(challenge_text(mode, user.id), parse_mode='Markdown'),
+            reply_markup=challenge_markup(mode, user.id),
         )
-        if chat_id in games:
-            del games[chat_id]
+        for mode, (_, _, label) in PVP_MODES.items()
+    ]
+    # النتائج فيها صاحب التحدي: لا تُشارك بين المستخدمين
+    await query.answer(results, cache_time=300, is_personal=True)
+
+# تغيير الثيم
+@router.register(cb.CHANGE_THEME)
+async def on_change_theme(tap: Tap):
+    current_theme = get_user_theme(tap.user_id)
+    await show(
+        tap.query,
+        "🎨 **اختر الثيم المفضل:**",
+        reply_markup=THEME_PICKER_MARKUPS.get(current_theme, THEME_PICKER_MARKUPS["classic"])
+    )
+
+# تطبيق الثيم
+@router.register(cb.THEME)
+async def on_theme(tap: Tap):
+    theme_name = tap.arg
+    if theme_name not in THEMES:
         return
+    user_themes.put(tap.user_id, theme_name)
+    store.mark_theme(tap.user_id, theme_name)
+
+    symbols = THEMES[theme_name]
+    await alert(tap, f"✅ تم تطبيق ثيم {theme_name}!")
+
+    await show(
+        tap.query,
+        f"✨ **تم تغيير الثيم!**\n\n"
+        f"الثيم الجديد: {symbols['X']} {theme_name.title()}\n\n"
+        f"جرب اللعب الآن!",
+        reply_markup=THEME_APPLIED_MARKUP
+    )
 
-    # التحقق من انتهاء الوقت
-    timeout_player = game.check_timeout()
-    if timeout_player:
-        winner = "O" if timeout_player == "X" else "X"
-        update_stats(user_id, "loss")
+# عرض الإحصائيات
+@router.register(cb.STATS)
+async def on_stats(tap: Tap):
+    wins, losses, draws, total = stats.counts(fresh_user_stats(tap.user_id))
+    win_rate = (wins / total * 100) if total > 0 else 0
+
+    stats_text = (
+        f"📊 **إحصائيات {tap.user_name}**\n\n"
+        f"🎮 المباريات: {total}\n"
+        f"🏆 الانتصارات: {wins}\n"
+        f"💔 الخسارات: {losses}\n"
+        f"🤝 التعادل: {draws}\n"
+        f"📈 نسبة الفوز: {win_rate:.1f}%\n"
+    )
 
-        symbols = game.get_symbols()
-        result_text = (
-            f"⏰ **انتهى الوقت!**\n\n"
-            f"💔 {random.choice(MESSAGES['lose'])}\n"
-            f"🏆 الفائز: {symbols[winner]}\n\n"
-            f"{game.get_board_text()}"
-        )
+    await show(
+        tap.query,
+        stats_text,
+        reply_markup=BACK_MARKUP
+    )
 
-        keyboard = [[
-            InlineKeyboardButton("🔄 لعب مرة أخرى", callback_data="restart"),
-            InlineKeyboardButton("📊 إحصائيات", callback_data="show_stats")
-        ]]
+# عرض التاريخ
+@router.register(cb.HISTORY)
+async def on_history(tap: Tap):
+    # التواريخ والرموز تُنسَّق هنا فقط، السجل مخزن كـ (epoch، نتيجة)
+    history = stats.history(fresh_user_stats(tap.user_id))
+
+    if not history:
+        history_text = "📜 **لا توجد مباريات سابقة**\n\nابدأ اللعب لبناء تاريخك!"
+    else:
+        history_text = f"📜 **آخر {len(history)} مباريات:**\n\n"
+        for i, (epoch, result) in enumerate(history, 1):
+            result_emoji = RESULT_EMOJIS.get(result, "🎮")
+            history_text += f"{i}. {result_emoji} {result.upper()} - {format_date(epoch)}\n"
+
+    await show(
+        tap.query,
+        history_text,
+        reply_markup=BACK_MARKUP
+    )
 
-        await query.edit_message_text(
-            result_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
-        )
+# المتصدرون
+@router.register(cb.LEADERBOARD)
+async def on_leaderboard(tap: Tap):
+    player_names[tap.user_id] = tap.user_name
+    page = int(tap.arg) if tap.arg.isdigit() else 0
+    page = min(page, leaderboard.pages - 1)
+    await show(
+        tap.query,
+        leaderboard_text(page, tap.user_id),
+        reply_markup=leaderboard_markup(page)
+    )
 
-        # إرسال ستيكر
-        try:
-            sticker_id = random.choice(STICKERS["lose"])
-            await context.bot.send_sticker(chat_id=chat_id, sticker=sticker_id)
-        except Exception:
-            pass
+# المساعدة
+@router.register(cb.HELP)
+async def on_help(tap: Tap):
+    await show(
+        tap.query,
+        HELP_TEXT,
+        reply_markup=BACK_MARKUP
+    )
 
+# رجوع للقائمة
+@router.register(cb.MENU)
+async def on_menu(tap: Tap):
+    await show(
+        tap.query,
+        f"👋 أهلاً **{tap.user_name}**!\n\n🎮 اختر وضع اللعب:",
+        reply_markup=MAIN_MENU_MARKUP
+    )
+
+# إعادة اللعب
+@router.register(cb.RESTART)
+async def on_restart(tap: Tap):
+    game = games.get(tap.chat_id)
+    if game is None:
+        await alert(tap, "❌ اللعبة غير موجودة!")
         return
+    await show(
+        tap.query,
+        "🔄 **لعبة جديدة؟**\n\nاختر الوضع:",
+        reply_markup=RESTART_MENU_MARKUPS[_VARIANT_KEYS.get(game.shape, DEFAULT_BOARD)]
+    )
+    games.pop(tap.chat_id, None)
+    journal.ended(tap.chat_id)
+    cancel_game_clock(tap.chat_id)
 
-    # تنفيذ الحركة
-    try:
-        row, col = map(int, query.data.split(","))
-    except ValueError:
+# تنفيذ الحركة
+@router.register(cb.MOVE)
+async def on_move(tap: Tap):
+    query = tap.query
+    key, game = find_game(tap)
+    player_names[tap.user_id] = tap.user_name
+
+    if not game:
+        await alert(tap, "❌ اللعبة غير موجودة!")
+        return
+
+    # زر من رسالة لعبة سابقة: يُرفض بمقارنة الـ nonce فقط
+    # (أزرار "صف,عمود" القديمة بدون nonce كانت للوحة 3×3 وحدها)
+    if tap.nonce != game.nonce and (tap.nonce is not None or game.shape is not CLASSIC):
+        await alert(tap, "🏁 هذه اللوحة من لعبة قديمة!")
+        return
+
+    # اللعبة انتهت بالفعل (زر قديم من لوحة منتهية)
+    if game.finished:
+        await alert(tap, "🏁 انتهت هذه اللعبة!")
+        return
+
+    # ⚔️ مباراة بين لاعبين: كل لاعب يلعب في دوره فقط
+    if game.opponent_id is not None and tap.user_id != game.player_id(game.current_player):
+        if tap.user_id in (game.user_id, game.opponent_id):
+            await alert(tap, "⏳ ليس دورك!")
+        else:
+            await alert(tap, "👀 هذه مباراة بين لاعبين آخرين!")
         return
 
+    # التحقق من انتهاء الوقت
+    if game.check_timeout():
+        result_text = finish_timed_out_game(key, game)
+        await show(
+            query,
+            result_text,
+            reply_markup=game_over_markup(key, game)
+        )
+        await send_sticker(tap.context.bot, game_chat(key), "lose")
+        return
+
+    row, col = divmod(tap.arg, game.shape.size)
+    player = game.current_player
     if not game.make_move(row, col):
-        try:
-            await query.answer("⚠️ المربع محجوز أو انتهى وقتك!", show_alert=True)
-        except Exception:
-            pass
+        await alert(tap, "⚠️ المربع محجوز أو انتهى وقتك!")
         return
+    journal.moved(key, game, tap.arg, player)
+
+    # 🤖 رد البوت في نفس الجولة: تعديل رسالة واحد للحركتين
+    if game.vs_bot and not game.check_winner() and not game.is_draw():
+        game.switch_player()
+        # ألعاب البوت 3×3 دائماً (on_bot_level)، فالحلّال يعرف بتاتها
+        bot_cell = choose_move(game.x_bits, game.o_bits, game.vs_bot)
+        game.make_move(*divmod(bot_cell, 3))
+        journal.moved(key, game, bot_cell, "O")
 
     symbols = game.get_symbols()
 
     # التحقق من الفائز
     winner = game.check_winner()
     if winner:
-        if winner == "X":
-            update_stats(user_id, "win")
+        game.finished = True
+        journal.ended(key)
+        cancel_game_clock(key)
+        archive.append(game, game_mode(game), "line", winner)
+        if game.opponent_id is not None:
+            record_match(game, winner, "win")
+            result_msg = f"🎉 **{display_name(game.player_id(winner))}** فاز بالمباراة!"
+            sticker_type = "win"
+        elif winner == "X":
+            update_stats(tap.user_id, "win")
+            _FINISHED[game_mode(game), "win"].inc()
             result_msg = f"🎉 {random.choice(MESSAGES['win'])}"
             sticker_type = "win"
         else:
-            update_stats(user_id, "loss")
+            update_stats(tap.user_id, "loss")
+            _FINISHED[game_mode(game), "loss"].inc()
             result_msg = f"😔 {random.choice(MESSAGES['lose'])}"
             sticker_type = "lose"
 
         result_text = (
             f"{result_msg}\n\n"
+            f"{players_line(game)}"
             f"🏆 الفائز: {symbols[winner]}\n"
             f"{game.get_board_text()}\n\n"
             f"📊 الحركات: {game.move_count}"
         )
 
-        keyboard = [[
-            InlineKeyboardButton("🔄 لعب مرة أخرى", callback_data="restart"),
-            InlineKeyboardButton("📊 إحصائيات", callback_data="show_stats")
-        ]]
-
-        await query.edit_message_text(
+        await show(
+            query,
             result_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
+            reply_markup=game_over_markup(key, game)
         )
-
-        # إرسال ستيكر
-        try:
-            sticker_id = random.choice(STICKERS[sticker_type])
-            await context.bot.send_sticker(chat_id=chat_id, sticker=sticker_id)
-        except Exception:
-            pass
-
+        await send_sticker(tap.context.bot, game_chat(key), sticker_type)
         return
 
     # التحقق من التعادل
     if game.is_draw():
-        update_stats(user_id, "draw")
+        game.finished = True
+        journal.ended(key)
+        cancel_game_clock(key)
+        archive.append(game, game_mode(game), "draw", None)
+        if game.opponent_id is not None:
+            record_match(game, None, "draw")
+        else:
+            update_stats(tap.user_id, "draw")
+            _FINISHED[game_mode(game), "draw"].inc()
         result_text = (
             f"🤝 {random.choice(MESSAGES['draw'])}\n\n"
+            f"{players_line(game)}"
             f"{game.get_board_text()}\n\n"
             f"📊 الحركات: {game.move_count}"
         )
 
-        keyboard = [[
-            InlineKeyboardButton("🔄 لعب مرة أخرى", callback_data="restart"),
-            InlineKeyboardButton("📊 إحصائيات", callback_data="show_stats")
-        ]]
-
-        await query.edit_message_text(
+        await show(
+            query,
             result_text,
-            reply_markup=InlineKeyboardMarkup(keyboard),
-            parse_mode='Markdown'
+            reply_markup=game_over_markup(key, game)
         )
-
-        # إرسال ستيكر
-        try:
-            sticker_id = random.choice(STICKERS["draw"])
-            await context.bot.send_sticker(chat_id=chat_id, sticker=sticker_id)
-        except Exception:
-            pass
-
+        await send_sticker(tap.context.bot, game_chat(key), "draw")
         return
 
     # تبديل اللاعب ومتابعة اللعب
     game.switch_player()
     encouragement = random.choice(MESSAGES['move'])
 
-    await query.edit_message_text(
-        f"🎯 **دور:** {symbols[game.current_player]}\n"
+    await show(
+        query,
+        turn_text(game, encouragement),
+        reply_markup=game.get_keyboard()
+    )
+    if game.timed_mode:
+        if query.message is not None:
+            game.message_id = query.message.message_id
+        schedule_game_clock(key, game, tap.context.bot)
+
+
+# ----------------------------------------------------------------------
+# ⏱️ ساعة الوضع بالوقت: انتهاء الوقت والعداد التنازلي من جهة الخادم
+# مفتاح اللعبة: المحادثة، أو (المحادثة، الرسالة) لمباراة في مجموعة، أو inline_message_id
+# ----------------------------------------------------------------------
+
+def turn_text(game: XOGame, encouragement: str) -> str:
+    """نص اللعبة أثناء اللعب"""
+    symbols = game.get_symbols()
+    turn = symbols[game.current_player]
+    if game.opponent_id is not None:
+        turn += f" {display_name(game.player_id(game.current_player))}"
+    return (
+        f"{players_line(game)}"
+        f"🎯 **دور:** {turn}\n"
         f"💡 {encouragement}\n"
-        f"{game.get_board_text()}",
-        reply_markup=game.get_keyboard(),
-        parse_mode='Markdown'
+        f"{game.get_board_text()}"
+    )
+
+def finish_timed_out_game(key: Hashable, game: XOGame) -> str:
+    """إنهاء لعبة انتهى وقتها وتسجيل الخسارة، وإرجاع نص النتيجة"""
+    timeout_player = game.current_player
+    winner = "O" if timeout_player == "X" else "X"
+    game.finished = True
+    journal.ended(key)
+    cancel_game_clock(key)
+    archive.append(game, game_mode(game), "timeout", winner)
+    if game.opponent_id is not None:
+        record_match(game, winner, "timeout")
+        result_msg = f"💔 نفد وقت **{display_name(game.player_id(timeout_player))}**"
+    else:
+        update_stats(game.user_id, "loss")
+        _FINISHED[game_mode(game), "timeout"].inc()
+        result_msg = f"💔 {random.choice(MESSAGES['lose'])}"
+    _TIMEOUTS.inc()
+
+    symbols = game.get_symbols()
+    return (
+        f"⏰ **انتهى الوقت!**\n\n"
+        f"{result_msg}\n"
+        f"{players_line(game)}"
+        f"🏆 الفائز: {symbols[winner]}\n\n"
+        f"{game.get_board_text()}"
+    )
+
+def schedule_game_clock(key: Hashable, game: XOGame, bot):
+    """جدولة انتهاء الوقت وتحديث العداد للعبة بالوقت"""
+    deadline = game.deadline()
+    if deadline is None:
+        return
+    timers.schedule(
+        ("expire", key),
+        max(0.0, deadline - game.clock()),
+        lambda: expire_game(key, game, bot),
+    )
+    timers.schedule(
+        ("tick", key),
+        COUNTDOWN_INTERVAL,
+        lambda: refresh_countdown(key, game, bot),
+    )
+
+def cancel_game_clock(key: Hashable):
+    timers.cancel(("expire", key))
+    timers.cancel(("tick", key))
+
+async def expire_game(key: Hashable, game: XOGame, bot):
+    """إنهاء اللعبة لحظة انتهاء وقت اللاعب، حتى بدون أي نقرة"""
+    if games.get(key) is not game or game.finished:
+        return
+    if not game.check_timeout():
+        # تغيّر الدور منذ الجدولة
+        schedule_game_clock(key, game, bot)
+        return
+
+    result_text = finish_timed_out_game(key, game)
+    await edit_game(bot, key, game, result_text, game_over_markup(key, game))
+    await send_sticker(bot, game_chat(key), "lose")
+
+async def refresh_countdown(key: Hashable, game: XOGame, bot):
+    """تحديث العداد التنازلي بمعدل محدود لكل محادثة وضمن ميزانية تعديل عامة"""
+    if games.get(key) is not game or game.finished or (game.message_id is None and game_chat(key) is not None):
+        return
+    timers.schedule(("tick", key), COUNTDOWN_INTERVAL, lambda: refresh_countdown(key, game, bot))
+    if not edit_budget.try_acquire():
+        return
+    await edit_game(bot, key, game, turn_text(game, "⚡ وقتك يمر!"), game.get_keyboard())
+
+metrics_server: Optional[HTTPServer] = None
+
+leaderboard_task: Optional[asyncio.Task] = None
+
+def _build_leaderboard() -> Leaderboard:
+    built = Leaderboard(page_size=leaderboard.page_size)
+    built.rebuild((int(uid), record) for uid, record in backend.iter_stats())
+    return built
+
+async def rebuild_leaderboard():
+    """بناء الترتيب من كل المستخدمين في خيط منفصل ثم استبداله (البوت يخدم التحديثات أثناء ذلك)"""
+    global leaderboard
+    started = time.perf_counter()
+    built = await asyncio.to_thread(_build_leaderboard)
+    # المباريات التي انتهت أثناء البناء أو لم تُحفظ بعد: العدادات تزيد فقط، فالأكبر هو الأحدث
+    for user_id, slot in stats.users():
+        if stats.total[slot] > built.total_games(user_id):
+            built.update(user_id, stats.wins[slot], stats.total[slot])
+    leaderboard = built
+    _LEADERBOARD_MARKUPS.clear()
+    STORAGE_SECONDS.labels("leaderboard_rebuild").observe(time.perf_counter() - started)
+    logger.info(f"🏆 Leaderboard built with {len(leaderboard)} players")
+
+async def refresh_leaderboard():
+    """البناء الأول، ثم إعادة البناء كل LEADERBOARD_REFRESH ثانية إن كانت مفعلة"""
+    while True:
+        try:
+            await rebuild_leaderboard()
+        except Exception as e:
+            logger.error(f"🏆 Leaderboard rebuild failed: {e}")
+        if LEADERBOARD_REFRESH <= 0:
+            return
+        await asyncio.sleep(LEADERBOARD_REFRESH)
+
+def restore_games(bot):
+    """إعادة الألعاب الجارية من السجل، مع إعادة تشغيل ساعات الوضع بالوقت"""
+    restored = journal.restore(
+        lambda user_id, timed_mode, vs_bot, shape: XOGame(user_id, timed_mode=timed_mode, vs_bot=vs_bot, shape=shape),
+        ttl=games.ttl,
     )
+    for key, game in restored.items():
+        games[key] = game
+        if game.timed_mode:
+            schedule_game_clock(key, game, bot)
+    journal.start(games.items)
+
+async def post_init(app):
+    """تشغيل المهام الخلفية على الـ event loop بعد تهيئة البوت"""
+    global metrics_server, leaderboard_task
+    if leaderboard_task is None:
+        leaderboard_task = asyncio.create_task(refresh_leaderboard())
+    restore_games(app.bot)
+    games.start_sweeper(interval=float(os.getenv('XO_SESSION_SWEEP_INTERVAL', '60')))
+    timers.start()
+    outbound.start(app.bot)
+    effects.start()
+    archive.start()
+    if os.getenv('XO_PROFILE') == '1':
+        profiler.start()
+    # في وضع الـ polling: XO_METRICS_PORT يفتح /metrics على نفس الـ event loop
+    port = os.getenv('XO_METRICS_PORT')
+    if port and metrics_server is None:
+        metrics_server = HTTPServer(os.environ.get("HOST", "0.0.0.0"), int(port))
+        metrics_server.route("GET", "/", health)
+        metrics_server.route("GET", "/metrics", metrics_endpoint)
+        await metrics_server.start()
+
+async def post_stop(app):
+    """إيقاف المهام الخلفية (قبل إغلاق اتصال البوت حتى تُرسل التعديلات المعلقة)"""
+    global metrics_server, leaderboard_task
+    if leaderboard_task is not None:
+        leaderboard_task.cancel()
+        leaderboard_task = None
+    games.stop_sweeper()
+    timers.stop()
+    journal.close()
+    archive.close()
+    await outbound.stop()
+    await effects.stop()
+    if profiler.active:
+        profiler.stop()
+        logger.info(f"🔬 Profiles: {profiler.dump()}")
+    if metrics_server is not None:
+        await metrics_server.stop()
+        metrics_server = None
+    logger.info(f"📤 Outbound: {outbound.metrics()}")
+    logger.info(f"🎁 Side effects: {effects.metrics()}")
+    logger.info(f"🎮 Sessions: {games.metrics()}")
+    logger.info(f"📼 Journal: {journal.metrics()}")
+    logger.info(f"🗄️ Archive: {archive.metrics()}")
+    logger.info(f"⚔️ Lobby: {lobby.metrics()}")
+    logger.info(f"👤 User cache: {len(stats)} users, {stats.evictions} evicted, themes {user_themes.metrics()}")
+    logger.info(f"📡 Update latency: {update_latency.summary()}")
+    if isinstance(app.update_processor, ChatSerializedUpdateProcessor):
+        logger.info(f"🚦 Update scheduling: {app.update_processor.metrics()}")
+
+# 📡 زمن كل تحديث من وصوله حتى انتهاء الـ handlers
+# (في الـ webhook يبدأ العد من استلام طلب HTTP، وفي الـ polling من بداية المعالجة)
+update_arrivals: Dict[int, float] = {}
+update_latency = LatencyTracker()
+
+async def mark_arrival(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    update_arrivals.setdefault(update.update_id, time.perf_counter())
+
+async def record_latency(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    arrived = update_arrivals.pop(update.update_id, None)
+    if arrived is not None:
+        update_latency.observe(time.perf_counter() - arrived)
+
+async def shed_update(update: Update):
+    """رد سريع على زر قائمة أُسقط لأن طابور التحديثات متأخر (الحركات لها الأولوية)"""
+    update_arrivals.pop(update.update_id, None)
+    await update.callback_query.answer("⏳ البوت مشغول الآن، حاول مرة أخرى بعد لحظات")
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة الأخطاء"""
@@ -621,7 +1590,6 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 def main():
     """تشغيل البوت"""
-    import os
     # الحصول على التوكن من متغيرات البيئة (وهذا هو الأفضل والأكثر أماناً)
     TOKEN = os.getenv('BOT_TOKEN')
 
@@ -632,12 +1600,15 @@ def main():
         # لكن الأفضل هو ترك الكود يفشل لتجنب نشر التوكن
         raise ValueError("BOT_TOKEN environment variable is required")
 
-    app = ApplicationBuilder().token(TOKEN).build()
-
-    # إضافة المعالجات
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CallbackQueryHandler(button))
-    app.add_error_handler(error_handler)
+    # XO_BOT_API_URL: خادم Bot API محلي (أو الوهمي في اختبارات الحمل)
+    api_url = os.getenv('XO_BOT_API_URL') or None
+    # XO_SHARDS>1: عملية أمامية توزع التحديثات على عدة عمليات عاملة حسب المحادثة
+    shards = int(os.getenv('XO_SHARDS', '1'))
+    if os.getenv('XO_ROLE') == 'worker':
+        run_shard_worker(TOKEN, api_url)
+        return
+    if shards > 1 and STORAGE_KIND != 'sqlite':
+        raise ValueError("XO_SHARDS > 1 needs a shared store: set XO_STORAGE=sqlite")
 
     logger.info("✅ Bot is running with new features!")
     print("✅ Bot is running!")
@@ -646,8 +1617,207 @@ def main():
     print("📊 Stats & History: Enabled")
     print("🎵 Stickers: Enabled")
 
-    # Run the bot using polling
-    app.run_polling()
+    # XO_MODE=polling (افتراضي) أو webhook
+    mode = os.getenv('XO_MODE', 'polling')
+    if shards > 1:
+        # العملية الأمامية لا تفتح التخزين أصلاً: العمال يفتحونه
+        asyncio.run(run_front(TOKEN, api_url, shards, mode))
+        return
+
+    app = build_application(TOKEN, base_url=api_url)
+    store.start()
+    try:
+        if mode == 'webhook':
+            asyncio.run(run_webhook(app))
+        else:
+            # Run the bot using polling
+            app.run_polling()
+    finally:
+        # حفظ أي بيانات متبقية قبل الإغلاق
+        store.stop()
+        backend.close()
+        logger.info(f"💾 Persistence: {store.metrics()}")
+
+def build_request(workers: int) -> InstrumentedRequest:
+    """
+    إعداد HTTP واحد مُجمّع لكل استدعاءات البوت: الـ handlers وطابور التعديلات والآثار الجانبية
+    تتشارك نفس الاتصالات المفتوحة (keep-alive). حجم المجمّع يكفي كل من قد يستدعي الـ API في
+    نفس اللحظة، فلا ينتظر أحد اتصالاً فارغاً ولا تبقى اتصالات زائدة خاملة
+    """
+    pool_size = int(os.getenv('XO_HTTP_POOL_SIZE', '0')) or workers + outbound.workers + effects.workers + 8
+    return InstrumentedRequest(
+        connection_pool_size=pool_size,
+        pool_timeout=float(os.getenv('XO_HTTP_POOL_TIMEOUT', '3')),
+        connect_timeout=float(os.getenv('XO_HTTP_CONNECT_TIMEOUT', '5')),
+        read_timeout=float(os.getenv('XO_HTTP_READ_TIMEOUT', '10')),
+        write_timeout=float(os.getenv('XO_HTTP_WRITE_TIMEOUT', '10')),
+    )
+
+def build_application(token: str, base_url: Optional[str] = None, updater: bool = True):
+    """بناء تطبيق البوت وتسجيل المعالجات (base_url لخادم Bot API محلي أو وهمي)"""
+    open_storage()
+    # المحادثات المختلفة تُعالج بالتوازي، وتحديثات نفس المحادثة بالترتيب (XO_CONCURRENT_UPDATES=1 للتسلسل)
+    workers = int(os.getenv('XO_CONCURRENT_UPDATES', '16'))
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .request(build_request(workers))
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    if not updater:
+        # العامل في وضع التقسيم لا يجلب التحديثات بنفسه
+        builder = builder.updater(None)
+    if workers > 1:
+        # عند الازدحام: الحركات قبل التحكم باللعبة قبل القوائم، وأزرار القوائم المتأخرة
+        # أكثر من XO_SHED_AFTER ثانية يُرد عليها فوراً بدل تنفيذها (0 لتعطيل الإسقاط)،
+        # فقط حين ينتظر أكثر من XO_SHED_DEPTH تحديث (افتراضي 4 لكل عامل)
+        shed_depth = os.getenv('XO_SHED_DEPTH')
+        builder = builder.concurrent_updates(ChatSerializedUpdateProcessor(
+            workers,
+            aging=float(os.getenv('XO_PRIORITY_AGING', '5')),
+            shed_after=float(os.getenv('XO_SHED_AFTER', '2.0')),
+            shed_depth=int(shed_depth) if shed_depth else None,
+            on_shed=shed_update,
+        ))
+    app = builder.build()
+
+    # إضافة المعالجات
+    app.add_handler(TypeHandler(Update, mark_arrival), group=-1)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("top", top))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CallbackQueryHandler(button))
+    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(TypeHandler(Update, record_latency), group=1)
+    app.add_error_handler(error_handler)
+    return app
+
+async def run_webhook(app):
+    """
+    تشغيل البوت بوضع الـ webhook: التحديثات تصل عبر HTTP على نفس الـ event loop،
+    ونقطة الصحة (/) من نفس الخادم بدلاً من خيط Flask منفصل
+    """
+    base_url = os.getenv('WEBHOOK_URL')
+    if not base_url:
+        raise ValueError("WEBHOOK_URL environment variable is required in webhook mode")
+    path = os.getenv('WEBHOOK_PATH', '/webhook')
+    secret = os.getenv('WEBHOOK_SECRET') or None
+
+    server = HTTPServer(os.environ.get("HOST", "0.0.0.0"), int(os.environ.get("PORT", 8080)))
+    server.route("GET", "/", health)
+    server.route("GET", "/metrics", metrics_endpoint)
+    server.route("POST", path, webhook_handler(app, secret, update_arrivals))
+
+    stop = asyncio.Event()
+    _install_stop_signals(stop)
+
+    async with app:
+        await post_init(app)
+        await app.start()
+        await app.bot.set_webhook(
+            base_url.rstrip('/') + path,
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await server.start()
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            await app.stop()
+            await post_stop(app)
+
+# ----------------------------------------------------------------------
+# 🧩 التوسع الأفقي: عملية أمامية + عمليات عاملة مقسمة حسب المحادثة
+# ----------------------------------------------------------------------
+
+def _install_stop_signals(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+async def run_front(token: str, api_url: Optional[str], shards: int, mode: str):
+    """
+    العملية الأمامية: تستقبل التحديثات (polling أو webhook) وترسل كل تحديث
+    للعامل المسؤول عن محادثته، ثم عند الإيقاف تنتظر كل عامل حتى ينهي ما لديه
+    """
+    supervisor = ShardSupervisor(shards)
+    stop = asyncio.Event()
+    _install_stop_signals(stop)
+
+    await supervisor.start()
+    front_bot = Bot(token, base_url=api_url) if api_url else Bot(token)
+    try:
+        async with front_bot:
+            if mode == 'webhook':
+                base_url = os.getenv('WEBHOOK_URL')
+                if not base_url:
+                    raise ValueError("WEBHOOK_URL environment variable is required in webhook mode")
+                path = os.getenv('WEBHOOK_PATH', '/webhook')
+                secret = os.getenv('WEBHOOK_SECRET') or None
+
+                server = HTTPServer(os.environ.get("HOST", "0.0.0.0"), int(os.environ.get("PORT", 8080)))
+                server.route("GET", "/", health)
+                server.route("GET", "/metrics", metrics_endpoint)
+                server.route("POST", path, webhook_forwarder(secret, supervisor.dispatch))
+                await front_bot.set_webhook(
+                    base_url.rstrip('/') + path,
+                    secret_token=secret,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                await server.start()
+                try:
+                    await stop.wait()
+                finally:
+                    await server.stop()
+            else:
+                await front_bot.delete_webhook()
+                await poll_updates(front_bot, supervisor, stop)
+    finally:
+        await supervisor.stop()
+
+def run_shard_worker(token: str, api_url: Optional[str]):
+    """تشغيل عملية عاملة: التحديثات تأتي من العملية الأمامية عبر stdin"""
+    app = build_application(token, base_url=api_url, updater=False)
+    store.start()
+    try:
+        asyncio.run(serve_shard(app))
+    finally:
+        store.stop()
+        backend.close()
+        logger.info(f"💾 Shard {os.getenv('XO_SHARD')} persistence: {store.metrics()}")
+
+async def serve_shard(app):
+    """
+    قراءة التحديثات حتى تغلق العملية الأمامية الأنبوب، ثم إنهاء المعلّق منها.
+    الإشارات تُتجاهل هنا: العملية الأمامية هي التي تقرر متى يتوقف العامل
+    """
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: None)
+        except NotImplementedError:
+            pass
+
+    async with app:
+        await post_init(app)
+        await app.start()
+        try:
+            async for payload in read_updates():
+                update = Update.de_json(payload, app.bot)
+                if update is not None:
+                    await app.update_queue.put(update)
+        finally:
+            # app.stop() يعالج كل ما بقي في الطابور قبل التوقف
+            await app.stop()
+            await post_stop(app)
 
 # ----------------------------------------------------------------------
 
@@ -0,0 +1,267 @@
+import itertools
+import logging
+import random
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 🔤 ترميز callback_data
+#
+# الصيغة v1:  "!" + حرف الإجراء + الوسيط
+#   حركة:     "!m" + الخانة (حرف base36) + nonce اللعبة    مثال: "!m4k3z"
+#   ثيم:      "!h" + اسم الثيم                              مثال: "!hspace"
+#   صفحة:     "!p" + رقم صفحة المتصدرين                     مثال: "!p2"
+#   وضع:      "!n" / "!t" + حجم اللوحة (بدونه 3×3)          مثال: "!n5"
+#   ضد لاعب:  "!v" + وضع الطابور ("n" / "t" + الحجم)         مثال: "!vt"
+#             وفي الرسائل المضمّنة (inline) + "@" + صاحب التحدي  مثال: "!vn@42"
+#   انسحاب:   "!w" + nonce اللعبة
+#   قائمة:    "!n" ، "!s" ، "!k" ...
+# النصوص القديمة ("mode_normal" و "1,2" و "theme_space") ما زالت مقبولة
+# من أزرار الرسائل المرسلة قبل التحديث.
+# ----------------------------------------------------------------------
+
+VERSION = "!"
+
+MOVE = "m"
+MODE_NORMAL = "n"
+MODE_TIMED = "t"
+MODE_BOT = "b"
+BOT_LEVEL = "l"
+CHANGE_THEME = "c"
+THEME = "h"
+STATS = "s"
+HISTORY = "y"
+HELP = "q"
+MENU = "k"
+RESTART = "r"
+LEADERBOARD = "p"
+BOARDS = "g"
+PVP = "v"
+PVP_CANCEL = "x"
+RESIGN = "w"
+
+# اسم كل إجراء (للمقاييس والسجلات)
+ACTION_NAMES = {
+    MOVE: "move",
+    MODE_NORMAL: "mode_normal",
+    MODE_TIMED: "mode_timed",
+    MODE_BOT: "mode_bot",
+    BOT_LEVEL: "mode_bot_level",
+    CHANGE_THEME: "change_theme",
+    THEME: "theme",
+    STATS: "show_stats",
+    HISTORY: "show_history",
+    HELP: "show_help",
+    MENU: "back_to_menu",
+    RESTART: "restart",
+    LEADERBOARD: "leaderboard",
+    BOARDS: "boards",
+    PVP: "pvp",
+    PVP_CANCEL: "pvp_cancel",
+    RESIGN: "resign",
+}
+
+# 🚦 أولوية كل إجراء عند ازدحام التحديثات: الحركات أولاً، ثم التحكم باللعبة، ثم القوائم والإحصائيات
+PRIORITY_MOVE = 0
+PRIORITY_CONTROL = 1
+PRIORITY_MENU = 2
+PRIORITY_NAMES = ("move", "control", "menu")
+
+ACTION_PRIORITIES = {
+    MOVE: PRIORITY_MOVE,
+    RESIGN: PRIORITY_CONTROL,
+    MODE_NORMAL: PRIORITY_CONTROL,
+    MODE_TIMED: PRIORITY_CONTROL,
+    MODE_BOT: PRIORITY_CONTROL,
+    BOT_LEVEL: PRIORITY_CONTROL,
+    BOARDS: PRIORITY_CONTROL,
+    PVP: PRIORITY_CONTROL,
+    PVP_CANCEL: PRIORITY_CONTROL,
+    RESTART: PRIORITY_CONTROL,
+}
+
+_CELL_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_NONCE_SPACE = 36 ** 4
+# بداية عشوائية حتى لا تتطابق nonces بعد إعادة تشغيل البوت
+_nonces = itertools.count(random.randrange(_NONCE_SPACE))
+
+_LEGACY = {
+    "mode_normal": MODE_NORMAL,
+    "mode_timed": MODE_TIMED,
+    "mode_bot": MODE_BOT,
+    "change_theme": CHANGE_THEME,
+    "show_stats": STATS,
+    "show_history": HISTORY,
+    "show_help": HELP,
+    "back_to_menu": MENU,
+    "restart": RESTART,
+}
+
+Decoded = Tuple[str, object, Optional[str]]  # (الإجراء، الوسيط، nonce)
+
+
+def new_nonce() -> str:
+    """معرّف قصير للعبة جديدة (حتى 4 حروف base36)"""
+    n = next(_nonces) % _NONCE_SPACE
+    digits = ""
+    while True:
+        n, r = divmod(n, 36)
+        digits = _CELL_DIGITS[r] + digits
+        if not n:
+            return digits
+
+
+def encode(action: str, arg: str = "") -> str:
+    return VERSION + action + arg
+
+
+def encode_move(cell: int, nonce: str) -> str:
+    return VERSION + MOVE + _CELL_DIGITS[cell] + nonce
+
+
+def decode(data: Optional[str]) -> Optional[Decoded]:
+    """
+    Decode callback_data into (action, argument, nonce).
+
+    Moves decode to an int cell and the game nonce (None for legacy
+    "row,col" buttons); other actions carry their string argument.
+
+    Returns:
+        the decoded tuple, or None if the data is not recognised
+    """
+    if not data:
+        return None
+    if data[0] == VERSION:
+        if len(data) < 2:
+            return None
+        action = data[1]
+        if action == MOVE:
+            if len(data) < 3:
+                return None
+            cell = _CELL_DIGITS.find(data[2])
+            if cell < 0:
+                return None
+            return MOVE, cell, data[3:]
+        return action, data[2:], None
+    return _decode_legacy(data)
+
+
+def _decode_legacy(data: str) -> Optional[Decoded]:
+    action = _LEGACY.get(data)
+    if action is not None:
+        return action, "", None
+    if data.startswith("theme_"):
+        return THEME, data[6:], None
+    if data.startswith("mode_bot_"):
+        return BOT_LEVEL, data[9:], None
+    row, sep, col = data.partition(",")
+    if sep and row.isdigit() and col.isdigit():
+        # اللوحة القديمة كانت 3×3 دائماً
+        row, col = int(row), int(col)
+        if row < 3 and col < 3:
+            return MOVE, row * 3 + col, None
+    return None
+
+
+def priority(data: Optional[str]) -> int:
+    """فئة أولوية الزر من callback_data دون فك ترميزه كاملاً (غير المعروف يُعامل كقائمة)"""
+    if data and data[0] == VERSION and len(data) > 1:
+        action = data[1]
+    else:
+        decoded = decode(data)
+        action = decoded[0] if decoded is not None else None
+    return ACTION_PRIORITIES.get(action, PRIORITY_MENU)
+
+
+# ----------------------------------------------------------------------
+# 🧭 الموجّه
+# ----------------------------------------------------------------------
+
+class Tap:
+    """
+    نقرة زر بعد فك ترميزها، مع ما تحتاجه معالجات الإجراءات
+    (chat_id هو inline_message_id لأزرار الرسائل المضمّنة التي لا محادثة لها)
+    """
+
+    __slots__ = ("query", "context", "chat_id", "user_id", "user_name", "action", "arg", "nonce", "answered")
+
+    def __init__(self, query, context, chat_id: Union[int, str], user_id: int, user_name: str,
+                 action: str, arg, nonce: Optional[str]):
+        self.query = query
+        self.context = context
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.action = action
+        self.arg = arg
+        self.nonce = nonce
+        # أجاب الـ handler على الـ callback بنفسه (تنبيه)، فلا يجيب الموجّه
+        self.answered = False
+
+
+ActionHandler = Callable[[Tap], Awaitable[None]]
+
+
+class CallbackRouter:
+    """
+    Dispatch callback queries to per-action handlers through a dict.
+
+    Every callback is answered exactly once: by the handler when it shows
+    an alert (setting ``tap.answered``), otherwise with a plain answer by
+    the router once the handler returns. Telegram rejects a second answer,
+    so answering up front would swallow every alert. Unknown or malformed
+    data is answered, logged and dropped.
+    """
+
+    def __init__(self):
+        self._handlers: Dict[str, ActionHandler] = {}
+        self.rejected = 0
+
+    def register(self, action: str):
+        """Decorator registering the handler for ``action``."""
+        def wrap(handler: ActionHandler) -> ActionHandler:
+            if action in self._handlers:
+                raise ValueError(f"Duplicate handler for callback action {action!r}")
+            self._handlers[action] = handler
+            return handler
+        return wrap
+
+    async def dispatch(self, query, context) -> Optional[str]:
+        """
+        Route one callback query.
+
+        Returns:
+            the action that was handled, or None if the query was dropped
+        """
+        decoded = decode(query.data)
+        handler = self._handlers.get(decoded[0]) if decoded is not None else None
+        if handler is None:
+            self.rejected += 1
+            logger.debug(f"Ignoring unknown callback data {query.data!r}")
+            await _answer(query)
+            return None
+
+        chat_id = query.message.chat.id if query.message and query.message.chat else query.inline_message_id
+        user = query.from_user
+        # If we can't determine chat or user, abort safely
+        if chat_id is None or user is None:
+            await _answer(query)
+            return None
+
+        action, arg, nonce = decoded
+        tap = Tap(query, context, chat_id, user.id, user.first_name or "Player", action, arg, nonce)
+        try:
+            await handler(tap)
+        finally:
+            if not tap.answered:
+                await _answer(query)
+        return action
+
+
+async def _answer(query):
+    """إيقاف مؤشر التحميل على الزر (جواب بدون نص)"""
+    try:
+        await query.answer()
+    except Exception as e:
+        logger.debug(f"Could not answer callback query: {e}")
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from callbacks import PRIORITY_CONTROL, PRIORITY_MENU, PRIORITY_NAMES, priority
+from metrics import UPDATE_QUEUE_SECONDS, UPDATES_SHED
+from serving import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: object) -> Optional[Hashable]:
+    """
+    مفتاح التسلسل: المحادثة، أو الرسالة المضمّنة (لعبتها مشتركة بين لاعبين)،
+    أو المستخدم إن لم توجد محادثة
+    """
+    if isinstance(update, Update):
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.callback_query is not None and update.callback_query.inline_message_id:
+            return ("inline", update.callback_query.inline_message_id)
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+    return None
+
+
+def update_priority(update: object) -> int:
+    """فئة أولوية التحديث: الأزرار حسب إجرائها، والأوامر والاستعلامات المضمّنة كقوائم"""
+    if isinstance(update, Update):
+        if update.callback_query is not None:
+            return priority(update.callback_query.data)
+        return PRIORITY_MENU
+    return PRIORITY_CONTROL
+
+
+class ChatSerializedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Run updates from different chats in parallel, one at a time per chat,
+    serving game moves before menus when workers are busy.
+
+    PTB starts one task per update in arrival order. Each task first takes
+    its chat's lock (asyncio locks are FIFO, so per-chat order is kept) and
+    only then a worker slot, so a busy chat queues behind itself instead of
+    holding workers that other chats could use. Locks are dropped as soon
+    as no update for that chat is running or waiting.
+
+    Updates waiting for a slot queue per priority class (``classify``:
+    move, game control, menu). A freed slot goes to the head with the best
+    ``class - waited / aging`` score, so a menu tap that has waited
+    ``2 * aging`` seconds still gets ahead of a fresh move (no starvation).
+    With ``on_shed`` set, menu callbacks are not run under real overload:
+    more than ``shed_depth`` updates (default four per worker) waiting for
+    a slot, and the oldest of them (or the callback itself) waiting longer
+    than ``shed_after`` seconds. The handler is then skipped and
+    ``on_shed(update)`` fast-answers it. Wait time alone is not enough,
+    since a few slow API calls can delay menus by seconds while the queue
+    is short and clears on its own.
+
+    ``backlog`` bounds how many updates may be in flight or waiting in total.
+    """
+
+    __slots__ = ("_workers", "_free", "_queues", "_waiting", "_chat_locks", "max_waiting",
+                 "aging", "shed_after", "shed_depth", "_on_shed", "_classify", "_delays", "_delay_metrics",
+                 "_shed_metrics", "shed", "clock")
+
+    def __init__(self, workers: int = 16, backlog: int = 4096, aging: float = 5.0, shed_after: float = 2.0,
+                 shed_depth: Optional[int] = None,
+                 on_shed: Optional[Callable[[object], Awaitable[Any]]] = None,
+                 classify: Callable[[object], int] = update_priority,
+                 clock: Callable[[], float] = time.perf_counter):
+        super().__init__(max(backlog, workers))
+        self._workers = workers
+        self._free = workers
+        # فئة الأولوية -> [(وقت الوصول، future ينتظر مكاناً)] بترتيب الوصول
+        self._queues: List[Deque[Tuple[float, asyncio.Future]]] = [deque() for _ in PRIORITY_NAMES]
+        self._waiting = 0
+        # مفتاح المحادثة -> [القفل، عدد التحديثات المنتظرة أو الجارية]
+        self._chat_locks: Dict[Hashable, List[Any]] = {}
+        self.max_waiting = 0
+        self.aging = aging
+        self.shed_after = shed_after
+        self.shed_depth = 4 * workers if shed_depth is None else shed_depth
+        self._on_shed = on_shed
+        self._classify = classify
+        self.clock = clock
+
+        # 📈 زمن الانتظار والإسقاط لكل فئة
+        self._delays = [LatencyTracker() for _ in PRIORITY_NAMES]
+        self._delay_metrics = [UPDATE_QUEUE_SECONDS.labels(name) for name in PRIORITY_NAMES]
+        self._shed_metrics = [UPDATES_SHED.labels(name) for name in PRIORITY_NAMES]
+        self.shed = [0] * len(PRIORITY_NAMES)
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        cls = self._classify(update)
+        arrived = self.clock()
+        sheddable = self._sheddable(update, cls)
+        if sheddable and self._overloaded(self.queue_delay()):
+            # الطابور متأخر أصلاً: رد سريع بدل الانتظار خلف الحركات
+            await self._shed(update, coroutine, cls)
+            return
+
+        key = chat_key(update)
+        if key is None:
+            await self._run(update, coroutine, cls, arrived, sheddable)
+            return
+
+        entry = self._chat_locks.get(key)
+        if entry is None:
+            entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.max_waiting = max(self.max_waiting, entry[1])
+        try:
+            async with entry[0]:
+                await self._run(update, coroutine, cls, arrived, sheddable)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    def _sheddable(self, update: object, cls: int) -> bool:
+        return (self._on_shed is not None and self.shed_after > 0 and cls == PRIORITY_MENU
+                and isinstance(update, Update) and update.callback_query is not None)
+
+    def _overloaded(self, waited: float) -> bool:
+        """طابور طويل ومتأخر معاً: الانتظار وحده قد يكون من استدعاءات API بطيئة قليلة"""
+        return waited > self.shed_after and self._waiting > self.shed_depth
+
+    async def _run(self, update: object, coroutine: "Awaitable[Any]", cls: int, arrived: float, sheddable: bool):
+        await self._acquire(cls, arrived)
+        waited = self.clock() - arrived
+        self._delays[cls].observe(waited)
+        self._delay_metrics[cls].observe(waited)
+        if sheddable and self._overloaded(waited):
+            self._release()
+            await self._shed(update, coroutine, cls)
+            return
+        try:
+            await coroutine
+        finally:
+            self._release()
+
+    async def _shed(self, update: object, coroutine: "Awaitable[Any]", cls: int):
+        coroutine.close()
+        self.shed[cls] += 1
+        self._shed_metrics[cls].inc()
+        try:
+            await self._on_shed(update)
+        except Exception as e:
+            logger.debug(f"Fast answer for a shed update failed: {e}")
+
+    # ------------------------------------------------------------------
+    # أماكن العمال
+    # ------------------------------------------------------------------
+
+    async def _acquire(self, cls: int, arrived: float):
+        if self._free and not self._waiting:
+            self._free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        item = (arrived, waiter)
+        self._queues[cls].append(item)
+        self._waiting += 1
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # المكان سُلّم لنا قبل الإلغاء مباشرة: نعيده
+                self._release()
+            elif item in self._queues[cls]:
+                self._queues[cls].remove(item)
+                self._waiting -= 1
+            raise
+
+    def _release(self):
+        """تسليم المكان الفارغ لأفضل منتظر مباشرة (الفئة ناقص الانتظار مقسوماً على aging)"""
+        now = self.clock()
+        best, best_score = None, None
+        for cls, queue in enumerate(self._queues):
+            # منتظرون أُلغيت مهامهم ولم يخرجوا من الطابور بعد
+            while queue and queue[0][1].done():
+                queue.popleft()
+                self._waiting -= 1
+            if queue:
+                score = cls - (now - queue[0][0]) / self.aging if self.aging > 0 else cls
+                if best is None or score < best_score:
+                    best, best_score = queue, score
+        if best is None:
+            self._free += 1
+            return
+        _, waiter = best.popleft()
+        self._waiting -= 1
+        waiter.set_result(None)
+
+    def queue_delay(self) -> float:
+        """انتظار أقدم تحديث ما زال ينتظر مكاناً (بالثواني)"""
+        now = self.clock()
+        return max((now - queue[0][0] for queue in self._queues if queue), default=0.0)
+
+    @property
+    def active_chats(self) -> int:
+        return len(self._chat_locks)
+
+    def metrics(self) -> Dict:
+        return {
+            "busy": self._workers - self._free,
+            "waiting": {name: len(queue) for name, queue in zip(PRIORITY_NAMES, self._queues)},
+            "queue_delay": {name: tracker.summary() for name, tracker in zip(PRIORITY_NAMES, self._delays)},
+            "shed": dict(zip(PRIORITY_NAMES, self.shed)),
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
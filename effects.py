@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from httpx import ConnectError, ConnectTimeout, HTTPError, PoolTimeout
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from metrics import SIDE_EFFECTS
+
+logger = logging.getLogger(__name__)
+
+Effect = Callable[[], Awaitable[object]]
+
+OUTCOMES = ("sent", "retried", "dropped", "stale", "failed", "unconfirmed")
+
+# أخطاء يعرف فيها httpx أن الطلب لم يُرسل أصلاً (لا اتصال، أو لا مكان في الـ pool)
+_NOT_SENT = (ConnectError, ConnectTimeout, PoolTimeout)
+
+
+class _Job:
+    __slots__ = ("kind", "effect", "attempts", "submitted")
+
+    def __init__(self, kind: str, effect: Effect, submitted: float):
+        self.kind = kind
+        self.effect = effect
+        self.attempts = 0
+        self.submitted = submitted
+
+
+class EffectDispatcher:
+    """
+    Bounded background pool for side effects no handler has to wait for
+    (stickers, extra messages).
+
+    Handlers submit() a coroutine factory and return at once. ``workers``
+    tasks drain one queue of at most ``max_queue`` effects; on overload new
+    effects are dropped rather than queued without bound, and effects that
+    waited longer than ``max_age`` seconds are dropped instead of arriving
+    late. Network errors are retried up to ``retries`` times with
+    exponential backoff and jitter (429s after Telegram's retry_after);
+    rejected requests are not retried. A retry waits via call_later, not
+    in its worker. ``on_failed(kind)`` is called for every effect that
+    finally failed (after its retries).
+
+    Effects are sends, so a transport error is only retried when the
+    request never left (connect error, connect or pool timeout). After a
+    read timeout or a dropped connection the send may already have been
+    delivered; it is counted as "unconfirmed" and not sent again, so a
+    sticker is never posted twice. Error responses from Telegram (such as
+    502) are retried.
+    """
+
+    def __init__(self, workers: int = 4, max_queue: int = 1000, retries: int = 3,
+                 backoff: float = 0.5, max_backoff: float = 10.0, max_age: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 on_failed: Optional[Callable[[str], None]] = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_age = max_age
+        self.clock = clock
+        self.on_failed = on_failed
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._waiting_retry = 0
+        self._inflight = 0
+        self._counters: Dict[Tuple[str, str], object] = {}
+        self.counts: Dict[str, int] = dict.fromkeys(OUTCOMES, 0)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def _count(self, kind: str, outcome: str):
+        self.counts[outcome] += 1
+        counter = self._counters.get((kind, outcome))
+        if counter is None:
+            counter = self._counters[(kind, outcome)] = SIDE_EFFECTS.labels(kind, outcome)
+        counter.inc()
+
+    # ------------------------------------------------------------------
+    # واجهة الـ handlers
+    # ------------------------------------------------------------------
+
+    def submit(self, kind: str, effect: Effect) -> bool:
+        """
+        Queue ``effect()`` to run in the background.
+
+        Returns:
+            bool: False if the pool is full and the effect was dropped
+        """
+        return self._put(_Job(kind, effect, self.clock()))
+
+    def _put(self, job: _Job) -> bool:
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            self._count(job.kind, "dropped")
+            return False
+
+    def _retry_later(self, job: _Job, delay: float):
+        self._waiting_retry += 1
+        self._count(job.kind, "retried")
+
+        def requeue():
+            self._waiting_retry -= 1
+            if self.running:
+                self._put(job)
+
+        asyncio.get_running_loop().call_later(delay, requeue)
+
+    # ------------------------------------------------------------------
+    # العمال
+    # ------------------------------------------------------------------
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if self.clock() - job.submitted > self.max_age:
+                self._count(job.kind, "stale")
+                continue
+            job.attempts += 1
+            self._inflight += 1
+            try:
+                await job.effect()
+                self._count(job.kind, "sent")
+            except RetryAfter as e:
+                seconds = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+                self._retry_or_fail(job, seconds, e)
+            except (BadRequest, Forbidden) as e:
+                # طلب مرفوض (محادثة محظورة أو ستيكر غير صالح): الإعادة لن تفيد
+                self._retry_or_fail(job, None, e)
+            except NetworkError as e:
+                cause = e.__cause__
+                if isinstance(cause, HTTPError) and not isinstance(cause, _NOT_SENT):
+                    # TimedOut أثناء انتظار الرد أو انقطاع بعد الإرسال: ربما وصل، وإعادته قد تنشره مرتين
+                    self._count(job.kind, "unconfirmed")
+                    logger.debug(f"Side effect {job.kind} may have been sent; not retried: {e}")
+                else:
+                    # لم يُرسل الطلب، أو رد تيليجرام بخطأ شبكة (502): إعادة بتأخير أُسّي مع عشوائية
+                    self._retry_or_fail(job, self._backoff(job), e)
+            except TelegramError as e:
+                self._retry_or_fail(job, None, e)
+            except Exception as e:
+                logger.error(f"Side effect {job.kind} crashed: {e}")
+                self._fail(job)
+            finally:
+                self._inflight -= 1
+
+    def _backoff(self, job: _Job) -> float:
+        delay = min(self.max_backoff, self.backoff * 2 ** (job.attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _retry_or_fail(self, job: _Job, delay: Optional[float], error: Exception):
+        if delay is not None and job.attempts <= self.retries:
+            self._retry_later(job, delay)
+            return
+        self._fail(job)
+        logger.debug(f"Side effect {job.kind} failed after {job.attempts} attempts: {error}")
+
+    def _fail(self, job: _Job):
+        self._count(job.kind, "failed")
+        if self.on_failed is not None:
+            self.on_failed(job.kind)
+
+    # ------------------------------------------------------------------
+    # التشغيل والإيقاف
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Start the workers on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(self.max_queue)
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0):
+        """Run what is still queued (up to ``timeout`` seconds), then stop; pending retries are dropped."""
+        if not self.running:
+            return
+        deadline = self.clock() + timeout
+        while (self._queue.qsize() or self._inflight) and self.clock() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def metrics(self) -> Dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "inflight": self._inflight,
+            "waiting_retry": self._waiting_retry,
+            **self.counts,
+        }
@@ -0,0 +1,203 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+# 🔢 اللوحة الكلاسيكية 3×3 كرقمين من 9 بت: بت لكل خانة (الخانة = الصف * 3 + العمود)
+# (جداول ثابتة يستخدمها XOEngine على 3×3 وحلّال البوت في ai.py؛ اللوحات الأخرى تستخدم BoardShape)
+CELL_BITS: Tuple[int, ...] = tuple(1 << i for i in range(9))
+FULL_BOARD = 0x1FF
+
+# الصفوف، الأعمدة، الأقطار
+WIN_MASKS: Tuple[int, ...] = (
+    0b000000111, 0b000111000, 0b111000000,
+    0b001001001, 0b010010010, 0b100100100,
+    0b100010001, 0b001010100,
+)
+
+# جدول 512 خانة: هل مجموعة البتات هذه تحتوي على خط كامل؟
+WIN_TABLE: Tuple[bool, ...] = tuple(
+    any(bits & mask == mask for mask in WIN_MASKS) for bits in range(512)
+)
+
+
+class BoardShape:
+    """
+    Geometry of a size×size board where ``k`` in a row wins.
+
+    Every possible winning line (rows, columns and both diagonals, any run
+    of ``k`` cells) is numbered once. For each cell, ``masks_through`` has
+    the cell masks of the lines it belongs to and ``lines_through`` the
+    same lines as one bit per line number, which is all a move looks at.
+    Shapes are immutable and shared by every game of that size.
+    """
+
+    __slots__ = ("size", "k", "cells", "cell_bits", "full", "line_masks", "all_lines",
+                 "masks_through", "lines_through")
+
+    def __init__(self, size: int, k: int):
+        if not 1 <= k <= size:
+            raise ValueError(f"Need 1 <= k <= size, got size={size} k={k}")
+        self.size = size
+        self.k = k
+        self.cells = size * size
+        self.cell_bits: Tuple[int, ...] = tuple(1 << i for i in range(self.cells))
+        self.full = (1 << self.cells) - 1
+
+        lines: List[Tuple[int, ...]] = []
+        for row in range(size):
+            for col in range(size):
+                # كل اتجاه: صف، عمود، قطر، قطر معاكس
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_row, end_col = row + dr * (k - 1), col + dc * (k - 1)
+                    if 0 <= end_row < size and 0 <= end_col < size:
+                        lines.append(tuple((row + dr * i) * size + col + dc * i for i in range(k)))
+        self.line_masks: Tuple[int, ...] = tuple(sum(1 << c for c in line) for line in lines)
+        self.all_lines = (1 << len(lines)) - 1
+        self.masks_through: Tuple[Tuple[int, ...], ...] = tuple(
+            tuple(self.line_masks[i] for i, line in enumerate(lines) if cell in line) for cell in range(self.cells)
+        )
+        self.lines_through: Tuple[int, ...] = tuple(
+            sum(1 << i for i, line in enumerate(lines) if cell in line) for cell in range(self.cells)
+        )
+
+    def __repr__(self) -> str:
+        return f"BoardShape({self.size}, {self.k})"
+
+
+@lru_cache(maxsize=None)
+def board_shape(size: int = 3, k: int = 3) -> BoardShape:
+    """الشكل المشترك للوحة size×size بـ k في صف"""
+    return BoardShape(size, k)
+
+
+CLASSIC = board_shape(3, 3)
+
+
+class XOEngine:
+    """
+    N×N, K-in-a-row state as two bitboards.
+
+    The classic 3×3 board keeps the original fast path: a win is one
+    lookup in WIN_TABLE and a draw is a full board with no winner.
+
+    Larger boards only look at the lines through the cell just played: one
+    of them being full of the mover's marks is a win. Each player also has
+    one bit per line saying "I have a mark on this line"; a line where both
+    bits are set can no longer be won by anyone, so once every line is in
+    both sets the game is a draw, usually well before the board is full.
+
+    ``moves`` keeps the cells played, in order (one byte each).
+    """
+
+    __slots__ = ("shape", "x_bits", "o_bits", "current_player", "move_count", "winner",
+                 "x_lines", "o_lines", "moves")
+
+    def __init__(self, shape: BoardShape = CLASSIC):
+        self.shape = shape
+        self.x_bits: int = 0
+        self.o_bits: int = 0
+        self.current_player: str = "X"
+        self.move_count: int = 0
+        self.winner: Optional[str] = None
+        # بت لكل خط فيه علامة واحدة على الأقل لهذا اللاعب (اللوحات الأكبر فقط)
+        self.x_lines: int = 0
+        self.o_lines: int = 0
+        self.moves = bytearray()
+
+    def cell(self, row: int, col: int) -> str:
+        """محتوى الخانة: "X" أو "O" أو " " """
+        bit = self.shape.cell_bits[row * self.shape.size + col]
+        if self.x_bits & bit:
+            return "X"
+        if self.o_bits & bit:
+            return "O"
+        return " "
+
+    @property
+    def board(self) -> List[List[str]]:
+        """اللوحة كقائمة قوائم (للتوافق مع الكود القديم)"""
+        size = self.shape.size
+        return [[self.cell(i, j) for j in range(size)] for i in range(size)]
+
+    def is_empty(self, row: int, col: int) -> bool:
+        return not (self.x_bits | self.o_bits) & self.shape.cell_bits[row * self.shape.size + col]
+
+    def empty_cells(self) -> List[int]:
+        """أرقام الخانات الفارغة (الخانة = الصف * الحجم + العمود)"""
+        occupied = self.x_bits | self.o_bits
+        return [i for i, bit in enumerate(self.shape.cell_bits) if not occupied & bit]
+
+    def make_move(self, row: int, col: int) -> bool:
+        """تنفيذ حركة اللاعب الحالي"""
+        shape = self.shape
+        if not (0 <= row < shape.size and 0 <= col < shape.size):
+            return False
+        cell = row * shape.size + col
+        bit = shape.cell_bits[cell]
+        if (self.x_bits | self.o_bits) & bit:
+            return False
+        self.move_count += 1
+        self.moves.append(cell)
+
+        if shape is CLASSIC:
+            # 3×3: بحث واحد في WIN_TABLE
+            if self.current_player == "X":
+                mine = self.x_bits = self.x_bits | bit
+            else:
+                mine = self.o_bits = self.o_bits | bit
+            if self.winner is None and WIN_TABLE[mine]:
+                self.winner = self.current_player
+            return True
+
+        if self.current_player == "X":
+            mine = self.x_bits = self.x_bits | bit
+            self.x_lines |= shape.lines_through[cell]
+        else:
+            mine = self.o_bits = self.o_bits | bit
+            self.o_lines |= shape.lines_through[cell]
+
+        # الخطوط المارة بهذه الخانة فقط بدلاً من فحص اللوحة كلها
+        if self.winner is None:
+            for mask in shape.masks_through[cell]:
+                if mine & mask == mask:
+                    self.winner = self.current_player
+                    break
+        return True
+
+    def set_position(self, x_bits: int, o_bits: int, current_player: str):
+        """وضع اللوحة مباشرة (لاستعادة لعبة محفوظة) مع إعادة حساب الخطوط والفائز"""
+        shape = self.shape
+        self.x_bits, self.o_bits, self.current_player = x_bits, o_bits, current_player
+        self.move_count = bin(x_bits | o_bits).count("1")
+        # ترتيب الحركات غير معروف بعد الاستعادة من لقطة
+        self.moves = bytearray()
+        self.x_lines = self.o_lines = 0
+        if shape is CLASSIC:
+            self.winner = "X" if WIN_TABLE[x_bits] else "O" if WIN_TABLE[o_bits] else None
+            return
+        for cell, bit in enumerate(shape.cell_bits):
+            if x_bits & bit:
+                self.x_lines |= shape.lines_through[cell]
+            elif o_bits & bit:
+                self.o_lines |= shape.lines_through[cell]
+        self.winner = None
+        for mask in shape.line_masks:
+            if x_bits & mask == mask:
+                self.winner = "X"
+            elif o_bits & mask == mask:
+                self.winner = "O"
+
+    def check_winner(self) -> Optional[str]:
+        """التحقق من الفائز"""
+        return self.winner
+
+    def is_draw(self) -> bool:
+        """تعادل: لا فائز واللوحة ممتلئة (3×3)، أو لم يبقَ خط يستطيع أي لاعب إكماله (اللوحات الأكبر)"""
+        if self.winner is not None:
+            return False
+        if self.shape is CLASSIC:
+            return self.x_bits | self.o_bits == FULL_BOARD
+        return self.x_lines & self.o_lines == self.shape.all_lines
+
+    def switch_player(self):
+        """تبديل اللاعب"""
+        self.current_player = "O" if self.current_player == "X" else "X"
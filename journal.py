@@ -0,0 +1,410 @@
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from ai import DIFFICULTIES
+from engine import XOEngine, board_shape
+from storage import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# ----------------------------------------------------------------------
+# 📼 صيغة السجل
+#
+# كل سجل: الطول (H) + crc32 للنوع والحمولة (I) + النوع (B) + الحمولة.
+# سجل ناقص أو تالف في نهاية الملف (انقطاع أثناء الكتابة) يُقص عند التشغيل.
+# ----------------------------------------------------------------------
+
+_RECORD = struct.Struct("<HIB")
+
+CREATE = 1
+MOVE = 2
+END = 3
+STATE = 4
+OPPONENT = 5
+
+# كل السجلات تبدأ بمفتاح اللعبة في السجل (انظر journal_key)
+# لعبة جديدة: المفتاح، user_id، الوقت (epoch)، أعلام، مستوى البوت، الحجم، K، nonce، وقت X، وقت O، message_id
+_CREATE = struct.Struct("<qqIBBBB4sffi")
+# حركة: المفتاح، الوقت، الخانة، اللاعب (0 = X)، الوقت المتبقي له بعد الحركة
+_MOVE = struct.Struct("<qIBBf")
+# انتهت اللعبة أو أُلغيت: المفتاح، الوقت
+_END = struct.Struct("<qI")
+# حالة كاملة في اللقطة: حقول CREATE (الوقت = آخر حركة) + بتات X وO واللاعب صاحب الدور + وقت البداية
+_STATE = struct.Struct("<qqIBBBB4sffiQQBI")
+# مباراة بين لاعبين (بعد CREATE أو STATE): المفتاح، المحادثة، رسالة اللعبة، user_id لاعب O
+_OPPONENT = struct.Struct("<qqiq")
+
+_SNAPSHOT_HEADER = struct.Struct("<4sBQ")
+_SNAPSHOT_MAGIC = b"XOGJ"
+_SNAPSHOT_VERSION = 1
+
+_TIMED = 1
+_PLAYERS = ("X", "O")
+
+
+def _level_code(level: Optional[str]) -> int:
+    return DIFFICULTIES.index(level) + 1 if level else 0
+
+
+def _nonce_bytes(nonce: str) -> bytes:
+    return nonce.encode("ascii")[:4]
+
+
+def journal_key(key: Hashable) -> Optional[int]:
+    """
+    The int64 a game key is journaled under: the chat id itself, or for a
+    (chat_id, message_id) match a hash with bit 62 set (above any chat id).
+    Inline-message games (str keys) are not journaled: None.
+    """
+    if isinstance(key, int):
+        return key
+    if isinstance(key, tuple):
+        digest = hashlib.blake2b(f"{key[0]}:{key[1]}".encode(), digest_size=8).digest()
+        return (int.from_bytes(digest, "big") >> 2) | (1 << 62)
+    return None
+
+
+class GameJournal:
+    """
+    Append-only binary journal of live games, so a restart resumes them.
+
+    Handlers append one small record per event (game created, move, game
+    over) with a single os.write; the file only ever grows at the end, so
+    a crash can at worst leave one torn record, which boot drops. Every
+    ``snapshot_every`` records the journal rolls over to a new segment and
+    writes a compacted snapshot of the games still live (in a worker
+    thread), after which older segments are deleted. Recovery therefore
+    reads one snapshot plus at most one short tail, however long the
+    process ran.
+
+    Games are identified by their key in the session store: a chat id, or
+    (chat_id, message_id) for player-vs-player matches in groups. Games on
+    inline messages (keyed by inline_message_id) live in memory only.
+
+    With ``path=None`` every method is a no-op.
+    """
+
+    def __init__(self, path: Optional[str], snapshot_every: int = 5000):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._fd: Optional[int] = None
+        self._segment = 0
+        self._live: Callable[[], Iterable[Tuple[int, Any]]] = list
+        self._snapshotting: Optional[asyncio.Future] = None
+        self._write_lock = threading.Lock()
+        self._covered_written = -1
+        self.records_since_snapshot = 0
+
+        # 📈 عدادات
+        self.appended = 0
+        self.snapshots = 0
+        self.restored = 0
+        self.replayed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    # ------------------------------------------------------------------
+    # الملفات
+    # ------------------------------------------------------------------
+
+    @property
+    def snapshot_path(self) -> str:
+        return f"{self.path}.snapshot"
+
+    def _segment_path(self, segment: int) -> str:
+        return f"{self.path}.{segment}"
+
+    def _segments(self) -> List[int]:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + "."
+        found = []
+        for name in os.listdir(directory):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit():
+                found.append(int(suffix))
+        return sorted(found)
+
+    def _open_segment(self, segment: int):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._segment = segment
+        self._fd = os.open(self._segment_path(segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    @staticmethod
+    def _read_records(data: bytes) -> Tuple[List[Tuple[int, bytes]], int]:
+        """
+        Decode framed records until the end or the first bad one.
+
+        Returns:
+            (records, number of bytes that decoded cleanly)
+        """
+        records = []
+        offset = 0
+        while offset + _RECORD.size <= len(data):
+            length, crc, kind = _RECORD.unpack_from(data, offset)
+            start = offset + _RECORD.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(bytes((kind,)) + payload) != crc:
+                break
+            records.append((kind, payload))
+            offset = start + length
+        return records, offset
+
+    # ------------------------------------------------------------------
+    # الكتابة (من الـ handlers على الـ event loop)
+    # ------------------------------------------------------------------
+
+    def _append(self, kind: int, payload: bytes):
+        if self._fd is None:
+            return
+        os.write(self._fd, _RECORD.pack(len(payload), zlib.crc32(bytes((kind,)) + payload), kind) + payload)
+        self.appended += 1
+        self.records_since_snapshot += 1
+        if self.records_since_snapshot >= self.snapshot_every:
+            self.snapshot()
+
+    def created(self, key: Hashable, game):
+        """تسجيل لعبة جديدة"""
+        jid = journal_key(key)
+        if self._fd is None or jid is None:
+            return
+        time_x, time_o = (game.time_left["X"], game.time_left["O"]) if game.timed_mode else (0.0, 0.0)
+        self._append(CREATE, _CREATE.pack(
+            jid, game.user_id, int(time.time()), _TIMED if game.timed_mode else 0,
+            _level_code(game.vs_bot), game.shape.size, game.shape.k, _nonce_bytes(game.nonce),
+            time_x, time_o, game.message_id or 0,
+        ))
+        if game.opponent_id is not None:
+            self._append(OPPONENT, _OPPONENT.pack(jid, key[0], key[1], game.opponent_id))
+
+    def moved(self, key: Hashable, game, cell: int, player: str):
+        """تسجيل حركة (بعد تنفيذها)"""
+        jid = journal_key(key)
+        if self._fd is None or jid is None:
+            return
+        left = game.time_left[player] if game.timed_mode else 0.0
+        self._append(MOVE, _MOVE.pack(jid, int(time.time()), cell, _PLAYERS.index(player), left))
+
+    def ended(self, key: Hashable):
+        """اللعبة انتهت أو أُلغيت: لا تُستعاد"""
+        jid = journal_key(key)
+        if self._fd is None or jid is None:
+            return
+        self._append(END, _END.pack(jid, int(time.time())))
+
+    # ------------------------------------------------------------------
+    # اللقطات
+    # ------------------------------------------------------------------
+
+    def _encode_state(self, key: Hashable, jid: int, game) -> bytes:
+        time_x, time_o = (game.time_left["X"], game.time_left["O"]) if game.timed_mode else (0.0, 0.0)
+        payload = _STATE.pack(
+            jid, game.user_id, int(game.last_active), _TIMED if game.timed_mode else 0,
+            _level_code(game.vs_bot), game.shape.size, game.shape.k, _nonce_bytes(game.nonce),
+            time_x, time_o, game.message_id or 0,
+            game.x_bits, game.o_bits, _PLAYERS.index(game.current_player), int(game.started_at),
+        )
+        record = _RECORD.pack(len(payload), zlib.crc32(bytes((STATE,)) + payload), STATE) + payload
+        if game.opponent_id is not None:
+            payload = _OPPONENT.pack(jid, key[0], key[1], game.opponent_id)
+            record += _RECORD.pack(len(payload), zlib.crc32(bytes((OPPONENT,)) + payload), OPPONENT) + payload
+        return record
+
+    def snapshot(self, wait: bool = False):
+        """
+        Roll over to a new segment and write a snapshot of the live games
+        (encoded here, written to disk in a worker thread unless ``wait``).
+        """
+        if self._fd is None:
+            return
+        if self._snapshotting is not None and not self._snapshotting.done():
+            # اللقطة السابقة ما زالت تُكتب؛ نحاول مع السجل التالي
+            return
+        covered = self._segment
+        self._open_segment(covered + 1)
+        parts = [_SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_VERSION, covered)]
+        for key, game in self._live():
+            jid = journal_key(key)
+            if not game.finished and jid is not None:
+                parts.append(self._encode_state(key, jid, game))
+        payload = b"".join(parts)
+        self.records_since_snapshot = 0
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if wait or loop is None:
+            self._write_snapshot(payload, covered)
+        else:
+            self._snapshotting = loop.run_in_executor(None, self._write_snapshot, payload, covered)
+
+    def _write_snapshot(self, payload: bytes, covered: int):
+        with self._write_lock:
+            # لقطة أقدم لا تكتب فوق أحدث منها
+            if covered <= self._covered_written:
+                return
+            write_atomic(self.snapshot_path, payload)
+            self._covered_written = covered
+            for segment in self._segments():
+                if segment <= covered:
+                    try:
+                        os.unlink(self._segment_path(segment))
+                    except OSError:
+                        pass
+            self.snapshots += 1
+
+    # ------------------------------------------------------------------
+    # الاستعادة عند التشغيل
+    # ------------------------------------------------------------------
+
+    def restore(self, make_game: Callable[..., Any], ttl: float) -> Dict[Hashable, Any]:
+        """
+        Rebuild the live games from the last snapshot plus the journal tail.
+
+        ``make_game(user_id, timed_mode, vs_bot, shape)`` builds an empty
+        game; games idle for longer than ``ttl`` seconds are not restored.
+        Timed games keep the time each player had left at their last move,
+        and restart their clock now (the downtime is not charged).
+        Player-vs-player matches get their second player back.
+
+        Returns:
+            dict: game key -> restored game
+        """
+        if not self.enabled:
+            return {}
+        started = time.perf_counter()
+        games: Dict[int, Any] = {}
+        last_seen: Dict[int, int] = {}
+        keys: Dict[int, Hashable] = {}
+
+        def build(fields, started_at: int) -> Any:
+            # ts: وقت الإنشاء في CREATE، ووقت آخر حركة في STATE
+            jid, user_id, ts, flags, level, size, k, nonce, time_x, time_o, message_id = fields[:11]
+            game = make_game(user_id, bool(flags & _TIMED), DIFFICULTIES[level - 1] if level else None,
+                             board_shape(size, k))
+            game.nonce = nonce.rstrip(b"\0").decode("ascii")
+            game.started_at = started_at
+            if game.timed_mode:
+                game.time_left = {"X": time_x, "O": time_o}
+                game.message_id = message_id or None
+            games[jid] = game
+            last_seen[jid] = ts
+            return game
+
+        def set_opponent(payload: bytes):
+            jid, chat_id, message_id, opponent_id = _OPPONENT.unpack(payload)
+            game = games.get(jid)
+            if game is not None:
+                game.opponent_id = opponent_id
+                game.message_id = message_id
+                keys[jid] = (chat_id, message_id)
+
+        covered = -1
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        if len(data) >= _SNAPSHOT_HEADER.size:
+            magic, version, covered = _SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_VERSION:
+                logger.error(f"📼 Ignoring unreadable snapshot {self.snapshot_path}")
+                covered = -1
+            else:
+                records, _ = self._read_records(data[_SNAPSHOT_HEADER.size:])
+                for kind, payload in records:
+                    if kind == STATE and len(payload) == _STATE.size:
+                        fields = _STATE.unpack(payload)
+                        game = build(fields, fields[14])
+                        x_bits, o_bits, player = fields[11:14]
+                        game.set_position(x_bits, o_bits, _PLAYERS[player])
+                    elif kind == OPPONENT and len(payload) == _OPPONENT.size:
+                        set_opponent(payload)
+
+        segments = [s for s in self._segments() if s > covered]
+        for segment in segments:
+            path = self._segment_path(segment)
+            with open(path, "rb") as f:
+                data = f.read()
+            records, good = self._read_records(data)
+            if good < len(data):
+                logger.warning(f"📼 Dropping {len(data) - good} torn bytes at the end of {path}")
+                os.truncate(path, good)
+            for kind, payload in records:
+                self.replayed += 1
+                if kind == CREATE and len(payload) == _CREATE.size:
+                    fields = _CREATE.unpack(payload)
+                    build(fields, fields[2])
+                elif kind == MOVE and len(payload) == _MOVE.size:
+                    jid, ts, cell, player, left = _MOVE.unpack(payload)
+                    game = games.get(jid)
+                    if game is None:
+                        continue
+                    mover = _PLAYERS[player]
+                    game.current_player = mover
+                    XOEngine.make_move(game, *divmod(cell, game.shape.size))
+                    if game.timed_mode:
+                        game.time_left[mover] = left
+                    game.current_player = "O" if mover == "X" else "X"
+                    last_seen[jid] = ts
+                elif kind == OPPONENT and len(payload) == _OPPONENT.size:
+                    set_opponent(payload)
+                elif kind == END and len(payload) == _END.size:
+                    jid, _ = _END.unpack(payload)
+                    games.pop(jid, None)
+
+        now = time.time()
+        for jid in [j for j, ts in last_seen.items() if j in games and now - ts > ttl]:
+            del games[jid]
+        for jid, game in games.items():
+            game.last_active = last_seen[jid]
+            if game.timed_mode:
+                game.last_move_time = game.clock()
+        self.restored = len(games)
+        self._segment = segments[-1] if segments else max(covered, 0)
+        logger.info(
+            f"📼 Restored {len(games)} games from {self.path} "
+            f"({self.replayed} journal records) in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        return {keys.get(jid, jid): game for jid, game in games.items()}
+
+    def start(self, live: Callable[[], Iterable[Tuple[int, Any]]]):
+        """
+        Start appending to a fresh segment. ``live()`` lists the current
+        (key, game) pairs for snapshots; one is written right away so
+        the segments replayed by restore() can be deleted.
+        """
+        if not self.enabled or self._fd is not None:
+            return
+        self._live = live
+        self._open_segment(self._segment + 1)
+        self.snapshot(wait=True)
+
+    def close(self):
+        """لقطة أخيرة ثم إغلاق المقطع الحالي"""
+        if self._fd is None:
+            return
+        self._snapshotting = None
+        self.snapshot(wait=True)
+        os.close(self._fd)
+        self._fd = None
+
+    def metrics(self) -> Dict:
+        return {
+            "segment": self._segment,
+            "appended": self.appended,
+            "since_snapshot": self.records_since_snapshot,
+            "snapshots": self.snapshots,
+            "restored": self.restored,
+            "replayed": self.replayed,
+        }
@@ -0,0 +1,220 @@
+import random
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Any, levels: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * levels
+        # width[i]: عدد المواقع التي يقفزها الرابط next[i]
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """
+    Sorted keys with O(log n) insert, remove, rank and lookup by position.
+
+    Every link stores how many positions it skips, so positions can be
+    counted on the way down instead of walking the bottom level.
+    """
+
+    def __init__(self, max_levels: int = 32, rng: Optional[random.Random] = None):
+        self._levels = max_levels
+        self._head = _Node(None, max_levels)
+        self._size = 0
+        self._rng = rng or random.Random()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _random_levels(self) -> int:
+        levels = 1
+        while levels < self._levels and self._rng.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key: Any):
+        chain: List[_Node] = [self._head] * self._levels
+        steps_at_level = [0] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        new = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: Any):
+        chain: List[_Node] = [self._head] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key: Any) -> Optional[int]:
+        """الموقع (من 0) للمفتاح، أو None إن لم يكن موجوداً"""
+        node = self._head
+        position = 0
+        for level in reversed(range(self._levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        found = node.next[0]
+        return position if found is not None and found.key == key else None
+
+    def _node_at(self, index: int) -> _Node:
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        node = self._head
+        index += 1
+        for level in reversed(range(self._levels)):
+            while node.next[level] is not None and node.width[level] <= index:
+                index -= node.width[level]
+                node = node.next[level]
+        return node
+
+    def __getitem__(self, index: int) -> Any:
+        return self._node_at(index).key
+
+    def slice(self, start: int, stop: int) -> List[Any]:
+        """المفاتيح من الموقع start حتى stop (بدون stop)"""
+        stop = min(stop, self._size)
+        if start >= stop:
+            return []
+        node = self._node_at(start)
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+    def clear(self):
+        self._head = _Node(None, self._levels)
+        self._size = 0
+
+
+# (الترتيب، user_id، الانتصارات، المباريات، نسبة الفوز)
+Entry = Tuple[int, int, int, int, float]
+
+
+class Leaderboard:
+    """
+    Player ranking by (wins, win rate, total games), best first.
+
+    update() moves one player in O(log n); top pages are cached and only
+    the pages whose positions actually shifted are dropped on update.
+    """
+
+    def __init__(self, page_size: int = 10):
+        self.page_size = page_size
+        self._index = IndexableSkipList()
+        self._keys: Dict[int, Tuple] = {}
+        self._pages: Dict[int, List[Entry]] = {}
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @staticmethod
+    def _key(user_id: int, wins: int, total: int) -> Tuple:
+        rate = wins / total if total else 0.0
+        # مفاتيح سالبة: الترتيب التصاعدي في الفهرس = الأفضل أولاً
+        return (-wins, -rate, -total, user_id)
+
+    def update(self, user_id: int, wins: int, total: int):
+        """تحديث مركز لاعب بعد مباراة"""
+        if total <= 0:
+            return
+        new = self._key(user_id, wins, total)
+        old = self._keys.get(user_id)
+        if old == new:
+            return
+        if old is not None:
+            old_rank = self._index.rank(old)
+            self._index.remove(old)
+        self._index.insert(new)
+        self._keys[user_id] = new
+        new_rank = self._index.rank(new)
+
+        # المواقع بين المركز القديم والجديد فقط هي التي تغيرت
+        if old is None:
+            first, last = new_rank, len(self._index) - 1
+        else:
+            first, last = min(old_rank, new_rank), max(old_rank, new_rank)
+        first_page, last_page = first // self.page_size, last // self.page_size
+        for page in [p for p in self._pages if first_page <= p <= last_page]:
+            del self._pages[page]
+
+    def rebuild(self, records: Iterable[Tuple[int, Dict]]):
+        """بناء الفهرس من الإحصائيات المحفوظة (مرة واحدة عند التشغيل)"""
+        self._index.clear()
+        self._keys.clear()
+        self._pages.clear()
+        keys = []
+        for user_id, record in records:
+            if record.get("total_games", 0) > 0:
+                key = self._key(user_id, record["wins"], record["total_games"])
+                self._keys[user_id] = key
+                keys.append(key)
+        for key in sorted(keys):
+            self._index.insert(key)
+
+    def total_games(self, user_id: int) -> int:
+        """عدد مباريات اللاعب كما في الترتيب (0 إن لم يكن فيه)"""
+        key = self._keys.get(user_id)
+        return -key[2] if key is not None else 0
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """ترتيب اللاعب (من 1)، أو None إن لم يلعب بعد"""
+        key = self._keys.get(user_id)
+        if key is None:
+            return None
+        return self._index.rank(key) + 1
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-len(self._index) // self.page_size))
+
+    def page(self, number: int) -> List[Entry]:
+        """صفحة من الترتيب (من 0)"""
+        entries = self._pages.get(number)
+        if entries is None:
+            start = number * self.page_size
+            entries = [
+                (start + i + 1, key[3], -key[0], -key[2], -key[1])
+                for i, key in enumerate(self._index.slice(start, start + self.page_size))
+            ]
+            self._pages[number] = entries
+        return entries
+
+    def top(self, k: int) -> List[Entry]:
+        return [
+            (i + 1, key[3], -key[0], -key[2], -key[1])
+            for i, key in enumerate(self._index.slice(0, k))
+        ]
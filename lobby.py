@@ -0,0 +1,130 @@
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from timers import TimerService
+
+
+class Ticket:
+    """لاعب ينتظر خصماً: أين ينتظر، في أي وضع، ورسالة الانتظار الخاصة به"""
+
+    __slots__ = ("user_id", "name", "scope", "mode", "message_id")
+
+    def __init__(self, user_id: int, name: str, scope: Hashable, mode: str, message_id: int):
+        self.user_id = user_id
+        self.name = name
+        self.scope = scope
+        self.mode = mode
+        self.message_id = message_id
+
+
+class Lobby:
+    """
+    Matchmaking queues for player-vs-player games, one per (scope, mode).
+
+    A scope is where the match will be played (a group chat), a mode is
+    the game-mode argument (normal/timed and board size). Each queue is an
+    insertion-ordered dict of waiting user id -> ticket, and tickets are
+    also indexed by user and by lobby message, so joining, pairing with
+    the longest-waiting player (or with the player whose lobby message was
+    tapped) and leaving are all O(1). A player waits in at most one queue.
+
+    Waiting tickets expire after ``timeout`` seconds through one entry
+    each in the shared TimerService heap; no sweep ever walks the queues.
+    """
+
+    def __init__(self, timers: TimerService, timeout: float):
+        self.timers = timers
+        self.timeout = timeout
+        self._queues: Dict[Tuple[Hashable, str], "OrderedDict[int, Ticket]"] = {}
+        self._by_user: Dict[int, Ticket] = {}
+        self._by_message: Dict[Tuple[Hashable, int], Ticket] = {}
+
+        # 📈 عدادات
+        self.matched = 0
+        self.expired = 0
+        self.cancelled = 0
+
+    def __len__(self) -> int:
+        return len(self._by_user)
+
+    def ticket(self, user_id: int) -> Optional[Ticket]:
+        """تذكرة اللاعب إن كان ينتظر"""
+        return self._by_user.get(user_id)
+
+    def ticket_at(self, scope: Hashable, message_id: int) -> Optional[Ticket]:
+        """التذكرة صاحبة رسالة الانتظار هذه"""
+        return self._by_message.get((scope, message_id))
+
+    def join(self, scope: Hashable, mode: str, user_id: int, name: str, message_id: int,
+             on_expire: Callable[[Ticket], Awaitable[None]]) -> Optional[Ticket]:
+        """
+        Put a player in the (scope, mode) queue, or pair them at once.
+
+        The player must not be waiting already (see leave()). If the tapped
+        message is another player's lobby message for the same mode, that
+        player is the opponent; otherwise the longest-waiting one is.
+        ``on_expire(ticket)`` runs on the event loop if the player is still
+        waiting after ``timeout`` seconds (the ticket is already removed).
+
+        Returns:
+            the opponent's ticket (now out of the lobby), or None if the
+            player is now waiting with ``message_id`` as lobby message
+        """
+        opponent = self._by_message.get((scope, message_id))
+        if opponent is None or opponent.mode != mode:
+            queue = self._queues.get((scope, mode))
+            opponent = queue[next(iter(queue))] if queue else None
+        if opponent is not None:
+            self._remove(opponent)
+            self.matched += 1
+            return opponent
+
+        ticket = Ticket(user_id, name, scope, mode, message_id)
+        queue = self._queues.get((scope, mode))
+        if queue is None:
+            queue = self._queues[(scope, mode)] = OrderedDict()
+        queue[user_id] = ticket
+        self._by_user[user_id] = ticket
+        self._by_message[(scope, message_id)] = ticket
+        self.timers.schedule(("lobby", user_id), self.timeout, lambda: self._expire(ticket, on_expire))
+        return None
+
+    def leave(self, user_id: int) -> Optional[Ticket]:
+        """
+        Take a player out of the lobby.
+
+        Returns:
+            the ticket they were waiting with, or None
+        """
+        ticket = self._by_user.get(user_id)
+        if ticket is not None:
+            self._remove(ticket)
+            self.cancelled += 1
+        return ticket
+
+    def _remove(self, ticket: Ticket):
+        key = (ticket.scope, ticket.mode)
+        queue = self._queues[key]
+        del queue[ticket.user_id]
+        if not queue:
+            del self._queues[key]
+        del self._by_user[ticket.user_id]
+        if self._by_message.get((ticket.scope, ticket.message_id)) is ticket:
+            del self._by_message[(ticket.scope, ticket.message_id)]
+        self.timers.cancel(("lobby", ticket.user_id))
+
+    async def _expire(self, ticket: Ticket, on_expire: Callable[[Ticket], Awaitable[None]]):
+        if self._by_user.get(ticket.user_id) is not ticket:
+            return
+        self._remove(ticket)
+        self.expired += 1
+        await on_expire(ticket)
+
+    def metrics(self) -> Dict:
+        return {
+            "waiting": len(self._by_user),
+            "queues": len(self._queues),
+            "matched": self.matched,
+            "expired": self.expired,
+            "cancelled": self.cancelled,
+        }
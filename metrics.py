@@ -0,0 +1,202 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# حدود افتراضية بالثواني (من 1ms حتى 10s)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        (registry if registry is not None else REGISTRY).register(self)
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    def labels(self, *values: str):
+        """
+        Bind label values once and keep the child for the hot path
+        (call with no arguments for a metric without labels).
+
+        Returns:
+            the child metric for these label values
+        """
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _label_str(self, key: Tuple[str, ...], extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{self._label_str(key)} {_fmt(child.value)}"]
+
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """قيمة تُحسب فقط عند القراءة (scrape)"""
+        self.function = function
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def _render_child(self, key, child) -> List[str]:
+        value = child.function() if child.function is not None else child.value
+        return [f"{self.name}{self._label_str(key)} {_fmt(value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, key, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = 'le="' + _fmt(bound) + '"'
+            lines.append(f"{self.name}_bucket{self._label_str(key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(child.sum)}")
+        lines.append(f"{self.name}_count{self._label_str(key)} {child.count}")
+        return lines
+
+
+class Registry:
+    """Holds metrics and renders them in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# ----------------------------------------------------------------------
+# 📊 مقاييس البوت
+# ----------------------------------------------------------------------
+
+BUTTON_SECONDS = Histogram("xo_button_seconds", "button() handler latency by callback type", ["callback"])
+API_SECONDS = Histogram("xo_telegram_api_seconds", "Telegram Bot API call latency by method", ["method"])
+STORAGE_SECONDS = Histogram("xo_storage_seconds", "Persistence duration by operation", ["op"])
+STORAGE_BYTES = Counter("xo_storage_written_bytes_total", "Bytes written by persistence flushes")
+STORAGE_BATCH = Histogram(
+    "xo_storage_flush_batch_size", "Dirty entries per persistence flush",
+    buckets=(1, 5, 10, 50, 100, 500, 1000, 5000),
+)
+GAMES_STARTED = Counter("xo_games_started_total", "Games started by mode", ["mode"])
+GAMES_FINISHED = Counter("xo_games_finished_total", "Games finished by mode and result", ["mode", "result"])
+TIMEOUTS = Counter("xo_timeouts_total", "Timed-mode games lost on time")
+STICKER_FAILURES = Counter("xo_sticker_failures_total", "Sticker sends that failed")
+SIDE_EFFECTS = Counter("xo_side_effects_total", "Background side effects by kind and outcome", ["kind", "outcome"])
+UPDATE_QUEUE_SECONDS = Histogram("xo_update_queue_seconds", "Wait for a worker slot by update priority class", ["class"])
+UPDATES_SHED = Counter("xo_updates_shed_total", "Low-priority callbacks fast-answered under backlog", ["class"])
+LOOP_LAG_SECONDS = Histogram("xo_event_loop_lag_seconds", "Event-loop scheduling delay (measured while profiling is on)")
+PROFILED_UPDATES = Counter("xo_profiled_updates_total", "Updates sampled by the profiler by callback type", ["callback"])
+LIVE_GAMES = Gauge("xo_live_games", "Game sessions currently held in memory")
+KNOWN_USERS = Gauge("xo_known_users", "Users whose stats are loaded in memory")
@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[int, int]  # (chat_id, message_id)
+
+
+class _Desired:
+    __slots__ = ("text", "reply_markup", "parse_mode")
+
+    def __init__(self, text: str, reply_markup: Any, parse_mode: Optional[str]):
+        self.text = text
+        self.reply_markup = reply_markup
+        self.parse_mode = parse_mode
+
+
+def _same(a_text: str, a_markup: Any, b_text: str, b_markup: Any) -> bool:
+    # الـ markup غالباً نفس الكائن المشترك من كاش العرض، فالمقارنة بالهوية أولاً
+    return a_text == b_text and (a_markup is b_markup or a_markup == b_markup)
+
+
+class OutboundScheduler:
+    """
+    Coalescing, rate-limited sender for message edits.
+
+    Handlers post the state a message should show and return at once.
+    Each (chat, message) keeps only its latest desired state; a pool of
+    workers sends it when both the per-chat interval and the global token
+    bucket allow, skips it if it matches what was last sent, and honours
+    Telegram's retry_after on 429 responses.
+    """
+
+    def __init__(self, per_chat_interval: float = 0.3, global_rate: float = 30.0,
+                 workers: int = 8, remember: int = 50000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.per_chat_interval = per_chat_interval
+        self.global_rate = global_rate
+        self.workers = workers
+        self.remember = remember
+        self.clock = clock
+        self.bot = None
+
+        self._desired: Dict[Key, _Desired] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: Set[Key] = set()
+        self._inflight: Set[Key] = set()
+        self._last_sent: "OrderedDict[Key, Tuple[str, Any]]" = OrderedDict()
+        self._chat_ready_at: Dict[int, float] = {}
+        self._global_ready_at = 0.0
+        self._tokens = global_rate
+        self._tokens_at = clock()
+        self._tasks: List[asyncio.Task] = []
+
+        # 📈 عدادات
+        self.sent = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    # ------------------------------------------------------------------
+    # واجهة الـ handlers
+    # ------------------------------------------------------------------
+
+    def post(self, chat_id: int, message_id: int, text: str,
+             reply_markup: Any = None, parse_mode: Optional[str] = None):
+        """تسجيل الحالة المطلوبة للرسالة (بدون انتظار الإرسال)"""
+        key = (chat_id, message_id)
+        if key in self._desired:
+            self.coalesced += 1
+        else:
+            last = self._last_sent.get(key)
+            if last is not None and key not in self._inflight and _same(text, reply_markup, *last):
+                self.skipped += 1
+                return
+        self._desired[key] = _Desired(text, reply_markup, parse_mode)
+        self._enqueue(key)
+
+    def _enqueue(self, key: Key):
+        if key in self._queued or key in self._inflight:
+            return
+        self._queued.add(key)
+        self._queue.put_nowait(key)
+
+    def _requeue(self, key: Key):
+        self._queued.discard(key)
+        if key in self._desired:
+            self._enqueue(key)
+
+    def _delay(self, key: Key, seconds: float):
+        # يبقى المفتاح في _queued حتى لا يُضاف مرتين أثناء الانتظار
+        self._queued.add(key)
+        asyncio.get_running_loop().call_later(seconds, self._requeue, key)
+
+    def _take_token(self) -> bool:
+        now = self.clock()
+        self._tokens = min(self.global_rate, self._tokens + (now - self._tokens_at) * self.global_rate)
+        self._tokens_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    # ------------------------------------------------------------------
+    # العمال
+    # ------------------------------------------------------------------
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            self._queued.discard(key)
+            if key not in self._desired:
+                continue
+
+            now = self.clock()
+            wait = max(self._chat_ready_at.get(key[0], 0.0), self._global_ready_at) - now
+            if wait > 0:
+                self._delay(key, wait)
+                continue
+            if not self._take_token():
+                self._delay(key, 1.0 / self.global_rate)
+                continue
+
+            desired = self._desired.pop(key)
+            self._inflight.add(key)
+            try:
+                await self._send(key, desired)
+            finally:
+                self._inflight.discard(key)
+                if key in self._desired:
+                    self._enqueue(key)
+
+    async def _send(self, key: Key, desired: _Desired):
+        last = self._last_sent.get(key)
+        if last is not None and _same(desired.text, desired.reply_markup, *last):
+            self.skipped += 1
+            return
+
+        chat_id, message_id = key
+        try:
+            await self.bot.edit_message_text(
+                desired.text,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=desired.reply_markup,
+                parse_mode=desired.parse_mode,
+            )
+            self.sent += 1
+            self._remember(key, desired)
+        except RetryAfter as e:
+            self.retry_after += 1
+            seconds = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            resume = self.clock() + seconds
+            self._chat_ready_at[chat_id] = resume
+            self._global_ready_at = max(self._global_ready_at, resume)
+            # إعادة المحاولة ما لم تصل حالة أحدث
+            self._desired.setdefault(key, desired)
+            logger.warning(f"⏳ Flood limit hit, retrying chat {chat_id} in {seconds:.1f}s")
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._remember(key, desired)
+            else:
+                self.failed += 1
+                logger.debug(f"Edit rejected for {key}: {e}")
+        except TelegramError as e:
+            self.failed += 1
+            logger.debug(f"Edit failed for {key}: {e}")
+
+        now = self.clock()
+        self._chat_ready_at[chat_id] = now + self.per_chat_interval
+        if len(self._chat_ready_at) > 4 * self.remember:
+            self._chat_ready_at = {c: t for c, t in self._chat_ready_at.items() if t > now}
+
+    def _remember(self, key: Key, desired: _Desired):
+        self._last_sent[key] = (desired.text, desired.reply_markup)
+        self._last_sent.move_to_end(key)
+        if len(self._last_sent) > self.remember:
+            self._last_sent.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    # التشغيل والإيقاف
+    # ------------------------------------------------------------------
+
+    def start(self, bot):
+        """Start the sender workers on the running event loop."""
+        if self.running:
+            return
+        self.bot = bot
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 5.0):
+        """Send what is still pending (up to ``timeout`` seconds), then stop."""
+        deadline = self.clock() + timeout
+        while (self._desired or self._inflight) and self.clock() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def metrics(self) -> Dict:
+        return {
+            "queue_depth": len(self._desired),
+            "inflight": len(self._inflight),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "retry_after": self.retry_after,
+            "failed": self.failed,
+        }
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from metrics import STORAGE_BATCH, STORAGE_BYTES, STORAGE_SECONDS
+from storage import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+# يُحدَّث من خيط الحفظ فقط
+_FLUSH_SECONDS = STORAGE_SECONDS.labels("flush")
+_FLUSH_BYTES = STORAGE_BYTES.labels()
+_FLUSH_BATCH = STORAGE_BATCH.labels()
+
+
+class WriteBehindStore:
+    """
+    Write-behind persistence in front of a StorageBackend.
+
+    Handlers only mark users as dirty (one finished game or a theme,
+    under a lock); a background thread hands the dirty users to the
+    backend in one batch, either every ``interval`` seconds or as soon as
+    ``max_dirty`` users are pending. Finished games are added to the
+    stored counts by the backend, never written as whole records, so
+    several processes can share one database.
+    """
+
+    def __init__(self, backend: StorageBackend, interval: float = 5.0, max_dirty: int = 100):
+        self.backend = backend
+        self.interval = interval
+        self.max_dirty = max_dirty
+
+        self._pending_themes: Dict[str, str] = {}
+        self._pending_results: Dict[str, List[Dict]] = {}
+        # الدفعة التي يكتبها خيط الحفظ الآن (لم تصل للـ backend بعد)
+        self._inflight_themes: Dict[str, str] = {}
+        self._inflight_users: Set[str] = set()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 📈 مقاييس الحفظ
+        self.flush_count = 0
+        self.last_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.bytes_written = 0
+
+    # ------------------------------------------------------------------
+    # واجهة الـ handlers (رخيصة، بدون I/O)
+    # ------------------------------------------------------------------
+
+    def mark_result(self, user_id: str, game: Dict):
+        """Queue one finished game; the backend adds it to the stored counts."""
+        with self._lock:
+            self._pending_results.setdefault(user_id, []).append(dict(game))
+            dirty = len(self._pending_themes) + len(self._pending_results)
+        if dirty >= self.max_dirty:
+            self._wake.set()
+
+    def mark_theme(self, user_id: int, theme: str):
+        """Queue one user's theme for the next flush."""
+        with self._lock:
+            self._pending_themes[str(user_id)] = theme
+            dirty = len(self._pending_themes) + len(self._pending_results)
+        if dirty >= self.max_dirty:
+            self._wake.set()
+
+    def pending_theme(self, user_id: int) -> Optional[str]:
+        """The not-yet-flushed theme for a user (queued or being written), if any."""
+        key = str(user_id)
+        with self._lock:
+            theme = self._pending_themes.get(key)
+            return theme if theme is not None else self._inflight_themes.get(key)
+
+    def is_dirty(self, user_id: str) -> bool:
+        """
+        True while anything for this user is queued or being written, i.e.
+        reading the user back from the backend could miss an update.
+        """
+        with self._lock:
+            return (
+                user_id in self._pending_results
+                or user_id in self._pending_themes
+                or user_id in self._inflight_users
+            )
+
+    @property
+    def dirty_count(self) -> int:
+        with self._lock:
+            return len(self._pending_themes) + len(self._pending_results)
+
+    # ------------------------------------------------------------------
+    # الحفظ
+    # ------------------------------------------------------------------
+
+    def flush(self) -> int:
+        """
+        Hand all pending records to the backend in one batch.
+
+        Returns:
+            int: number of dirty entries written (0 if nothing was pending)
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending_themes, self._pending_themes = self._pending_themes, {}
+                pending_results, self._pending_results = self._pending_results, {}
+                self._inflight_themes = pending_themes
+                self._inflight_users = set(pending_themes) | set(pending_results)
+            batch = len(pending_themes) + len(pending_results)
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                written = self.backend.write_batch({}, pending_themes, pending_results)
+            except Exception as e:
+                logger.error(f"Error saving data: {e}")
+                # إعادة الدفعة للانتظار بدون الكتابة فوق تحديثات أحدث
+                with self._lock:
+                    self._inflight_themes, self._inflight_users = {}, set()
+                    for k, v in pending_themes.items():
+                        self._pending_themes.setdefault(k, v)
+                    for k, v in pending_results.items():
+                        self._pending_results[k] = v + self._pending_results.get(k, [])
+                return 0
+            with self._lock:
+                self._inflight_themes, self._inflight_users = {}, set()
+
+            elapsed = time.perf_counter() - started
+            self.flush_count += 1
+            self.last_batch_size = batch
+            self.last_flush_seconds = elapsed
+            self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+            self.bytes_written += written
+            _FLUSH_SECONDS.observe(elapsed)
+            _FLUSH_BYTES.inc(written)
+            _FLUSH_BATCH.observe(batch)
+            logger.debug(f"💾 Flushed {batch} dirty entries in {elapsed * 1000:.1f}ms")
+            return batch
+
+    # ------------------------------------------------------------------
+    # الخيط الخلفي
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self) -> threading.Thread:
+        """
+        Start the background flusher in a daemon thread.
+
+        Returns:
+            threading.Thread: the flusher thread
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="xo-writer", daemon=True)
+            self._thread.start()
+        return self._thread
+
+    def stop(self):
+        """Stop the flusher and write whatever is still pending."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def metrics(self) -> Dict:
+        """Flush latency and batch size, for logs and health checks."""
+        return {
+            "flush_count": self.flush_count,
+            "dirty": self.dirty_count,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_seconds * 1000, 3),
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+            "bytes_written": self.bytes_written,
+        }
@@ -0,0 +1,325 @@
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, DefaultDict, Dict, List, Optional, Tuple
+
+from metrics import LOOP_LAG_SECONDS, PROFILED_UPDATES
+from serving import LatencyTracker
+
+_LOOP_LAG = LOOP_LAG_SECONDS.labels()
+
+# الملفات التي لا تهمنا في فروقات الذاكرة (أدوات القياس نفسها)
+_IGNORED_FILES = (tracemalloc.__file__, __file__)
+
+
+class _Profiled:
+    """
+    Await a coroutine, measuring only the steps where that coroutine itself
+    runs, so handlers of other updates interleaving with it never count.
+
+    With a ``profile`` the cProfile.Profile is switched on for each step
+    and off again before control goes back to the event loop. Without one
+    (tracemalloc running) each step adds its traced-memory change to
+    ``net_bytes`` and its peak above the step's start to ``peak_bytes``.
+    """
+
+    __slots__ = ("coroutine", "profile", "net_bytes", "peak_bytes")
+
+    def __init__(self, coroutine: Awaitable, profile: Optional[cProfile.Profile]):
+        self.coroutine = coroutine
+        self.profile = profile
+        self.net_bytes = 0
+        self.peak_bytes = 0
+
+    def __await__(self):
+        coroutine, profile = self.coroutine, self.profile
+        send, error = None, None
+        while True:
+            if profile is not None:
+                profile.enable()
+            else:
+                tracemalloc.reset_peak()
+                start = tracemalloc.get_traced_memory()[0]
+            try:
+                if error is None:
+                    yielded = coroutine.send(send)
+                else:
+                    yielded = coroutine.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                if profile is not None:
+                    profile.disable()
+                else:
+                    current, peak = tracemalloc.get_traced_memory()
+                    self.net_bytes += current - start
+                    self.peak_bytes = max(self.peak_bytes, peak - start)
+            try:
+                send, error = (yield yielded), None
+            except BaseException as e:
+                send, error = None, e
+
+
+class UpdateProfiler:
+    """
+    Opt-in profiling of live updates.
+
+    While on, run() profiles a random ``sample_rate`` share of the
+    coroutines it is given with cProfile and aggregates the results per
+    tag (``tag(result)``, the callback type for button taps).
+
+    With ``trace_allocations`` tracemalloc is started too and every other
+    sample measures memory instead of time, so cProfile's own bookkeeping
+    is not counted: the bytes its own steps allocated (net and peak). At
+    most one such sample every ``snapshot_interval`` seconds is also
+    bracketed by snapshots whose diff is summed per source line; a diff
+    costs about a second of CPU per 20k live allocations, so it runs in a
+    thread, and it includes what other updates allocated meanwhile.
+
+    A background task measures event-loop lag while profiling is on.
+
+    dump() writes ``<tag>.pstats`` files, one ``updates.collapsed`` file
+    (collapsed stacks rooted at the tag, for flamegraph tools),
+    ``allocations.txt`` and ``summary.json`` to ``directory``.
+
+    While off, callers only check ``active``; nothing else runs.
+    """
+
+    def __init__(self, directory: str, sample_rate: float = 0.05, trace_allocations: bool = False,
+                 snapshot_interval: float = 10.0, lag_interval: float = 0.05,
+                 tag: Callable[[Any], str] = str):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.trace_allocations = trace_allocations
+        self.snapshot_interval = snapshot_interval
+        self.lag_interval = lag_interval
+        self.tag = tag
+        self.active = False
+        self._rng = random.Random()
+        self._lag_task: Optional[asyncio.Task] = None
+        self._started_tracemalloc = False
+        self._snapshotting = False
+        self._next_snapshot = 0.0
+        self._memory_turn = False
+        self.reset()
+
+    def reset(self):
+        """Forget everything aggregated so far."""
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._samples: DefaultDict[str, int] = defaultdict(int)
+        self._seconds: DefaultDict[str, float] = defaultdict(float)
+        self._allocations: DefaultDict[str, DefaultDict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self._snapshots: DefaultDict[str, int] = defaultdict(int)
+        self._memory_samples: DefaultDict[str, int] = defaultdict(int)
+        self._net_bytes: DefaultDict[str, int] = defaultdict(int)
+        self._peak_bytes: DefaultDict[str, int] = defaultdict(int)
+        self.loop_lag = LatencyTracker()
+        self.max_lag = 0.0
+
+    # ------------------------------------------------------------------
+    # التشغيل والإيقاف
+    # ------------------------------------------------------------------
+
+    def start(self, sample_rate: Optional[float] = None, trace_allocations: Optional[bool] = None):
+        """Turn profiling on (from the event loop); arguments override the defaults."""
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if trace_allocations is not None:
+            self.trace_allocations = trace_allocations
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+            self._started_tracemalloc = True
+        if self._lag_task is None:
+            self._lag_task = asyncio.get_running_loop().create_task(self._watch_lag())
+        self.active = True
+
+    def stop(self):
+        """Turn profiling off; what was aggregated stays until dump()/reset()."""
+        self.active = False
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    async def _watch_lag(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.perf_counter() - started - self.lag_interval)
+            self.loop_lag.observe(lag)
+            _LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    # ------------------------------------------------------------------
+    # أخذ العينات
+    # ------------------------------------------------------------------
+
+    async def run(self, coroutine: Awaitable) -> Any:
+        """Await ``coroutine``, profiling it if it falls in the sample."""
+        if not self.active or self._rng.random() >= self.sample_rate:
+            return await coroutine
+        memory = False
+        if self.trace_allocations and tracemalloc.is_tracing():
+            memory = self._memory_turn = not self._memory_turn
+        profiled = _Profiled(coroutine, None if memory else cProfile.Profile())
+        before = None
+        started = time.perf_counter()
+        if memory and not self._snapshotting and started >= self._next_snapshot:
+            self._snapshotting = True
+            self._next_snapshot = started + self.snapshot_interval
+            before = tracemalloc.take_snapshot()
+        tag = "error"
+        try:
+            result = await profiled
+            tag = self.tag(result)
+            return result
+        finally:
+            self._record(tag, profiled, time.perf_counter() - started, before)
+
+    def _record(self, tag: str, profiled: _Profiled, seconds: float, before: Optional[tracemalloc.Snapshot]):
+        self._samples[tag] += 1
+        self._seconds[tag] += seconds
+        PROFILED_UPDATES.labels(tag).inc()
+        if profiled.profile is not None:
+            stats = self._stats.get(tag)
+            if stats is None:
+                self._stats[tag] = pstats.Stats(profiled.profile)
+            else:
+                stats.add(profiled.profile)
+        else:
+            self._memory_samples[tag] += 1
+            self._net_bytes[tag] += profiled.net_bytes
+            self._peak_bytes[tag] = max(self._peak_bytes[tag], profiled.peak_bytes)
+        if before is not None:
+            if tracemalloc.is_tracing():
+                asyncio.get_running_loop().create_task(self._diff(tag, before, tracemalloc.take_snapshot()))
+            else:
+                self._snapshotting = False
+
+    async def _diff(self, tag: str, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot):
+        # المقارنة تمر على كل ما في الذاكرة بكود Python: في خيط حتى لا تُوقف الـ event loop
+        try:
+            diffs = await asyncio.to_thread(after.compare_to, before, "lineno")
+        finally:
+            self._snapshotting = False
+        self._snapshots[tag] += 1
+        lines = self._allocations[tag]
+        for diff in diffs[:40]:
+            frame = diff.traceback[0]
+            if diff.size_diff > 0 and frame.filename not in _IGNORED_FILES:
+                lines[str(frame)] += diff.size_diff
+
+    # ------------------------------------------------------------------
+    # التقارير
+    # ------------------------------------------------------------------
+
+    def dump(self) -> List[str]:
+        """
+        Write the aggregated reports to ``directory``.
+
+        Returns:
+            the paths written
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        paths = []
+        collapsed: Dict[str, float] = {}
+        for tag, stats in self._stats.items():
+            path = os.path.join(self.directory, f"{tag}.pstats")
+            stats.dump_stats(path)
+            paths.append(path)
+            collapse_stats(stats, tag, collapsed)
+
+        path = os.path.join(self.directory, "updates.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, seconds in sorted(collapsed.items()):
+                micros = round(seconds * 1e6)
+                if micros > 0:
+                    f.write(f"{stack} {micros}\n")
+        paths.append(path)
+
+        if self._allocations:
+            path = os.path.join(self.directory, "allocations.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                for tag, lines in sorted(self._allocations.items()):
+                    f.write(f"# {tag}: bytes allocated and still held across {self._snapshots[tag]} snapshot diffs\n")
+                    for line, size in sorted(lines.items(), key=lambda item: -item[1])[:30]:
+                        f.write(f"{size:>12} {line}\n")
+            paths.append(path)
+
+        path = os.path.join(self.directory, "summary.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.metrics(), f, indent=2)
+        paths.append(path)
+        return paths
+
+    def _sample_summary(self, tag: str, count: int) -> Dict:
+        summary = {"count": count, "avg_ms": round(self._seconds[tag] / count * 1000, 3)}
+        memory_samples = self._memory_samples.get(tag)
+        if memory_samples:
+            summary["memory_samples"] = memory_samples
+            summary["avg_net_bytes"] = self._net_bytes[tag] // memory_samples
+            summary["max_peak_bytes"] = self._peak_bytes[tag]
+        return summary
+
+    def metrics(self) -> Dict:
+        return {
+            "active": self.active,
+            "sample_rate": self.sample_rate,
+            "samples": {tag: self._sample_summary(tag, count) for tag, count in sorted(self._samples.items())},
+            "loop_lag": self.loop_lag.summary(),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
+
+
+def _frame(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(filename)}:{line})".replace(";", ",")
+
+
+def collapse_stats(stats: pstats.Stats, root: str, out: Dict[str, float], min_seconds: float = 1e-6):
+    """
+    Turn cProfile's caller/callee graph into collapsed stacks ("a;b;c seconds")
+    under ``root``, adding to ``out``.
+
+    cProfile only keeps caller -> callee edges, so a function's time is
+    split over its stacks in proportion to the time each caller spent in it;
+    recursion is cut at the first repeat and shares below ``min_seconds``
+    are dropped.
+    """
+    entries = stats.stats
+    children: DefaultDict[Tuple, Dict[Tuple, float]] = defaultdict(dict)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            children[caller][func] = edge[3]
+
+    def walk(func, path: List[str], on_path: set, share: float):
+        own = entries[func][2]
+        # coroutine.send() عند جذر كل خطوة ليس جزءاً من الكود المقاس
+        frames = path if len(path) == 1 and func[0] == "~" else path + [_frame(func)]
+        stack = ";".join(frames)
+        if own * share > 0:
+            out[stack] = out.get(stack, 0.0) + own * share
+        for child, edge_total in children.get(func, {}).items():
+            child_total = entries[child][3]
+            if child in on_path or child_total <= 0:
+                continue
+            child_share = edge_total * share / child_total
+            if child_total * child_share < min_seconds:
+                continue
+            on_path.add(child)
+            walk(child, frames, on_path, child_share)
+            on_path.discard(child)
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, [root], {func}, 1.0)
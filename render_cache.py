@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class LRUCache:
+    """Bounded LRU mapping; the least recently used key is dropped first."""
+
+    def __init__(self, maxsize: int = 8192):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """الحصول على القيمة من الكاش أو بناؤها مرة واحدة"""
+        data = self._data
+        try:
+            value = data[key]
+        except KeyError:
+            self.misses += 1
+            value = build()
+            data[key] = value
+            if len(data) > self.maxsize:
+                data.popitem(last=False)
+                self.evictions += 1
+            return value
+        self.hits += 1
+        data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        data = self._data
+        data[key] = value
+        data.move_to_end(key)
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def metrics(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class RenderCache(LRUCache):
+    """
+    Bounded LRU cache for rendered game views.
+
+    Keys are small hashable tuples such as (theme, shape, x_bits, o_bits); values
+    are whatever ``build`` returns and must be immutable, because the same
+    object is handed to every caller that asks for that key.
+    """
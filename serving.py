@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from metrics import CONTENT_TYPE, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+            405: "Method Not Allowed", 408: "Request Timeout", 413: "Payload Too Large",
+            431: "Request Header Fields Too Large", 500: "Internal Server Error", 501: "Not Implemented"}
+
+
+class Request:
+    __slots__ = ("method", "path", "headers", "body", "received")
+
+    def __init__(self, method: str, path: str, headers: Dict[str, str], body: bytes, received: float):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.body = body
+        self.received = received  # perf_counter() عند وصول الطلب
+
+
+class Response:
+    __slots__ = ("status", "body", "content_type")
+
+    def __init__(self, status: int = 200, body: bytes = b"", content_type: str = "text/plain; charset=utf-8"):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+
+
+Handler = Callable[[Request], Awaitable[Response]]
+
+
+class _Reject(Exception):
+    """A request answered with ``status`` before reaching a handler; the connection is then closed."""
+
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+class HTTPServer:
+    """
+    Minimal HTTP/1.1 server on the running asyncio loop.
+
+    Just enough for Telegram webhooks and health/metrics probes: exact-path
+    routes, Content-Length bodies and keep-alive connections. No extra
+    thread and no web framework import.
+
+    Since the webhook port is public, malformed requests get a 4xx/5xx and
+    a closed connection instead of reaching a handler: a bad or negative
+    Content-Length (400), any Transfer-Encoding (501, chunked bodies are
+    not supported), headers over ``max_header`` bytes (431) and bodies over
+    ``max_body`` (413). Headers and body must arrive within
+    ``header_timeout`` / ``body_timeout`` seconds (408), and a keep-alive
+    connection with no new request for ``idle_timeout`` is closed, so slow
+    clients cannot hold connections open.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 8080, max_body: int = 1 << 20,
+                 max_header: int = 16 << 10, header_timeout: float = 10.0, body_timeout: float = 10.0,
+                 idle_timeout: float = 60.0):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.max_header = max_header
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.idle_timeout = idle_timeout
+        self._routes: Dict[Tuple[str, str], Handler] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, method: str, path: str, handler: Handler):
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        # limit: سطر أطول من max_header يرفع ValueError في readline بدل تخزينه كله
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=self.max_header)
+        sockets = self._server.sockets or ()
+        if sockets:
+            # عند استخدام port=0 يختار النظام منفذاً
+            self.port = sockets[0].getsockname()[1]
+        logger.info(f"🌐 HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_headers(self, reader: asyncio.StreamReader, size: int) -> Dict[str, str]:
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            size += len(line)
+            if size > self.max_header:
+                raise _Reject(431)
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    def _content_length(self, headers: Dict[str, str]) -> int:
+        if "transfer-encoding" in headers:
+            raise _Reject(501)
+        value = headers.get("content-length")
+        if value is None:
+            return 0
+        # int() يقبل "-5" و"+5" و"1_0": المسموح أرقام فقط
+        if not (value.isascii() and value.isdigit()):
+            raise _Reject(400)
+        length = int(value)
+        if length > self.max_body:
+            raise _Reject(413)
+        return length
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    # اتصال keep-alive بلا طلب جديد يُغلق بعد idle_timeout
+                    request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:
+                    # سطر أطول من limit (max_header) في readline
+                    await self._write(writer, Response(431), keep_alive=False)
+                    break
+                if not request_line:
+                    break
+                received = time.perf_counter()
+                try:
+                    try:
+                        method, target, version = request_line.decode("latin-1").split()
+                    except ValueError:
+                        raise _Reject(400)
+                    headers = await asyncio.wait_for(self._read_headers(reader, len(request_line)),
+                                                     self.header_timeout)
+                    length = self._content_length(headers)
+                    body = await asyncio.wait_for(reader.readexactly(length), self.body_timeout) if length else b""
+                except _Reject as e:
+                    await self._write(writer, Response(e.status), keep_alive=False)
+                    break
+                except asyncio.TimeoutError:
+                    await self._write(writer, Response(408), keep_alive=False)
+                    break
+                except ValueError:
+                    # سطر header أطول من limit
+                    await self._write(writer, Response(431), keep_alive=False)
+                    break
+
+                path = target.split("?", 1)[0]
+                handler = self._routes.get((method.upper(), path))
+                if handler is None:
+                    known_path = any(p == path for _, p in self._routes)
+                    response = Response(405 if known_path else 404)
+                else:
+                    try:
+                        response = await handler(Request(method.upper(), path, headers, body, received))
+                    except Exception as e:
+                        logger.error(f"HTTP handler for {path} failed: {e}")
+                        response = Response(500)
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version != "HTTP/1.0"
+                await self._write(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            pass
+        except asyncio.CancelledError:
+            # الـ loop يُغلق والطلب (long polling مثلاً) ما زال معلقاً
+            pass
+        finally:
+            writer.close()
+
+    async def _write(self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {response.status} {_REASONS.get(response.status, '')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + response.body)
+        # عميل لا يقرأ الرد لا يحجز الاتصال أكثر من body_timeout
+        await asyncio.wait_for(writer.drain(), self.body_timeout)
+
+
+class LatencyTracker:
+    """Rolling window of per-update latencies (seconds) for quick percentiles."""
+
+    def __init__(self, window: int = 2048):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> Dict:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count}
+
+        def pct(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+        return {"count": self.count, "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99)}
+
+
+async def health(request: Request) -> Response:
+    # دي الرسالة اللي بيشوفها UptimeRobot لما بيزور الرابط
+    return Response(200, b"Hello!is alive!")
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(200, REGISTRY.render().encode("utf-8"), CONTENT_TYPE)
+
+
+def webhook_handler(application, secret: Optional[str], arrivals: Dict[int, float]) -> Handler:
+    """
+    Build the POST handler that feeds Telegram updates into the application.
+
+    The update is only parsed and queued here; the application's own
+    update loop runs the handlers on this same event loop.
+    """
+    from telegram import Update
+
+    async def handle(request: Request) -> Response:
+        if secret and request.headers.get("x-telegram-bot-api-secret-token") != secret:
+            return Response(403)
+        try:
+            update = Update.de_json(json.loads(request.body), application.bot)
+        except (ValueError, TypeError) as e:
+            logger.debug(f"Rejected webhook payload: {e}")
+            return Response(400)
+        if update is None:
+            return Response(400)
+        arrivals[update.update_id] = request.received
+        await application.update_queue.put(update)
+        return Response(200)
+
+    return handle
+
+
+def webhook_forwarder(secret: Optional[str], forward: Callable[[Dict], Awaitable[None]]) -> Handler:
+    """
+    Build the POST handler for the sharded front process: the raw update
+    is passed on as a dict, without building a telegram.Update here.
+    """
+
+    async def handle(request: Request) -> Response:
+        if secret and request.headers.get("x-telegram-bot-api-secret-token") != secret:
+            return Response(403)
+        try:
+            payload = json.loads(request.body)
+        except ValueError as e:
+            logger.debug(f"Rejected webhook payload: {e}")
+            return Response(400)
+        if not isinstance(payload, dict) or "update_id" not in payload:
+            return Response(400)
+        await forward(payload)
+        return Response(200)
+
+    return handle
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """
+    Bounded game-session map with idle TTL and LRU eviction.
+
+    Entries are kept in least-recently-used order, so both the TTL sweep
+    and the size cap only ever look at the oldest end of the map. An
+    expired or evicted session simply stops being returned by get().
+    """
+
+    def __init__(self, ttl: float = 1800.0, max_entries: int = 10000,
+                 clock: Callable[[], float] = time.monotonic,
+                 sizeof: Callable[[Any], int] = sys.getsizeof):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.sizeof = sizeof
+        # مفتاح -> (القيمة، آخر استخدام، الحجم التقريبي)
+        self._entries: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._approx_bytes = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # 📈 عدادات
+        self.expired = 0
+        self.evicted = 0
+
+    # ------------------------------------------------------------------
+    # واجهة شبيهة بالـ dict
+    # ------------------------------------------------------------------
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        now = self.clock()
+        if now - entry[1] > self.ttl:
+            self._remove(key)
+            self.expired += 1
+            return default
+        entry[1] = now
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def __setitem__(self, key: Hashable, value: Any):
+        if key in self._entries:
+            self._remove(key)
+        size = self.sizeof(value)
+        self._entries[key] = [value, self.clock(), size]
+        self._approx_bytes += size
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evicted += 1
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __delitem__(self, key: Hashable):
+        if key not in self._entries:
+            raise KeyError(key)
+        self._remove(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return entry[0]
+
+    def items(self):
+        return [(key, entry[0]) for key, entry in self._entries.items()]
+
+    def _remove(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._approx_bytes -= entry[2]
+
+    # ------------------------------------------------------------------
+    # التنظيف الدوري
+    # ------------------------------------------------------------------
+
+    def sweep(self) -> int:
+        """
+        Drop sessions idle for longer than the TTL.
+
+        Returns:
+            int: number of sessions removed
+        """
+        deadline = self.clock() - self.ttl
+        removed = 0
+        entries = self._entries
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[1] > deadline:
+                break
+            self._remove(key)
+            removed += 1
+        self.expired += removed
+        return removed
+
+    async def _sweep_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug(f"🧹 Swept {removed} idle sessions, {len(self)} live")
+
+    def start_sweeper(self, interval: float = 60.0) -> asyncio.Task:
+        """Start the periodic sweep on the running event loop."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_forever(interval))
+        return self._sweeper
+
+    def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    def metrics(self) -> Dict:
+        return {
+            "live": len(self._entries),
+            "max_entries": self.max_entries,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "approx_bytes": self._approx_bytes,
+        }
+
+
+_MISSING = object()
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+from bisect import bisect
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# حد طول السطر الواحد (تحديث واحد بصيغة JSON) على قناة العامل
+MAX_LINE = 4 * 1024 * 1024
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Consistent hash of chat ids onto ``shards`` workers.
+
+    Each shard owns ``replicas`` points on the ring, so changing the number
+    of workers only moves about 1/N of the chats to a different process.
+    """
+
+    def __init__(self, shards: int, replicas: int = 64):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        points = sorted((_hash(f"shard-{shard}-{r}"), shard) for shard in range(shards) for r in range(replicas))
+        self.shards = shards
+        self._keys = [p for p, _ in points]
+        self._owners = [s for _, s in points]
+
+    def shard_for(self, key: object) -> int:
+        i = bisect(self._keys, _hash(str(key)))
+        return self._owners[i % len(self._owners)]
+
+
+def payload_chat_key(payload: Dict) -> Optional[object]:
+    """
+    مفتاح المحادثة من تحديث خام (dict) بدون بناء كائن Update،
+    بنفس منطق concurrency.chat_key: المحادثة، أو الرسالة المضمّنة، أو المستخدم
+    """
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = payload.get(field)
+        if message:
+            return message["chat"]["id"]
+    callback = payload.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        if message:
+            return message["chat"]["id"]
+        if callback.get("inline_message_id"):
+            return ("inline", callback["inline_message_id"])
+        return ("user", callback["from"]["id"])
+    for value in payload.values():
+        if isinstance(value, dict):
+            user = value.get("from")
+            if user:
+                return ("user", user["id"])
+    return None
+
+
+class ShardSupervisor:
+    """
+    Front-process side: start N worker processes and feed each one the
+    updates of its chats as JSON lines on its stdin.
+
+    Every update of a chat goes to the same worker, so games, timers and
+    caches stay process-local. Closing a worker's stdin asks it to finish
+    what it has queued and exit; stop() does that for all shards and waits.
+    """
+
+    def __init__(self, shards: int, command: Optional[List[str]] = None,
+                 env: Optional[Dict[str, str]] = None):
+        self.ring = HashRing(shards)
+        self.command = command or [sys.executable, os.path.abspath(sys.argv[0])]
+        self.env = env
+        self._procs: List[asyncio.subprocess.Process] = []
+        self.routed = [0] * shards
+
+    @property
+    def shards(self) -> int:
+        return self.ring.shards
+
+    async def start(self):
+        base_env = dict(os.environ if self.env is None else self.env)
+        metrics_port = base_env.pop("XO_METRICS_PORT", None)
+        for shard in range(self.shards):
+            env = dict(base_env, XO_ROLE="worker", XO_SHARD=str(shard))
+            if metrics_port:
+                # كل عامل ينشر مقاييسه على منفذ خاص به بعد منفذ الواجهة
+                env["XO_METRICS_PORT"] = str(int(metrics_port) + 1 + shard)
+            proc = await asyncio.create_subprocess_exec(*self.command, stdin=asyncio.subprocess.PIPE, env=env)
+            self._procs.append(proc)
+        logger.info(f"🧩 Started {self.shards} shard workers")
+
+    async def dispatch(self, payload: Dict):
+        """توجيه تحديث خام لعامل محادثته"""
+        key = payload_chat_key(payload)
+        shard = self.ring.shard_for(key) if key is not None else payload.get("update_id", 0) % self.shards
+        proc = self._procs[shard]
+        if proc.returncode is not None:
+            logger.error(f"Shard {shard} is not running (exit code {proc.returncode}), dropping update")
+            return
+        proc.stdin.write(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        self.routed[shard] += 1
+        await proc.stdin.drain()
+
+    async def stop(self, timeout: float = 30.0):
+        """Close every worker's input, wait for them to drain and exit."""
+        for proc in self._procs:
+            if proc.stdin is not None and not proc.stdin.is_closing():
+                proc.stdin.close()
+        for shard, proc in enumerate(self._procs):
+            try:
+                await asyncio.wait_for(proc.wait(), timeout)
+            except asyncio.TimeoutError:
+                # العمال يتجاهلون SIGTERM (ينتظرون إغلاق الأنبوب)، لذا kill
+                logger.warning(f"Shard {shard} did not drain in {timeout:.0f}s, killing it")
+                proc.kill()
+                await proc.wait()
+        logger.info(f"🧩 Shards stopped, updates routed per shard: {self.routed}")
+        self._procs = []
+
+
+async def poll_updates(bot, supervisor: ShardSupervisor, stop: asyncio.Event, timeout: int = 10):
+    """
+    Front-process long polling: fetch updates once and route the raw
+    payloads to the shards until ``stop`` is set.
+    """
+    from telegram import Update
+    from telegram.error import TelegramError
+
+    offset = None
+    stopping = asyncio.ensure_future(stop.wait())
+    try:
+        while not stop.is_set():
+            fetch = asyncio.ensure_future(
+                bot.get_updates(offset=offset, timeout=timeout, allowed_updates=Update.ALL_TYPES)
+            )
+            await asyncio.wait({fetch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            if not fetch.done():
+                fetch.cancel()
+                break
+            try:
+                updates = fetch.result()
+            except TelegramError as e:
+                logger.warning(f"getUpdates failed: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            for update in updates:
+                await supervisor.dispatch(update.to_dict())
+                offset = update.update_id + 1
+        if offset is not None:
+            # تأكيد آخر دفعة حتى لا تُعاد بعد إعادة التشغيل
+            await bot.get_updates(offset=offset, timeout=0)
+    finally:
+        stopping.cancel()
+
+
+async def read_updates(stream=None):
+    """
+    Worker side: yield the raw updates the front process writes to stdin,
+    until it closes the pipe.
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=MAX_LINE)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stream or sys.stdin)
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            logger.error(f"Dropping malformed update line: {e}")
@@ -0,0 +1,163 @@
+import itertools
+import struct
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from storage import DATE_FORMAT, HISTORY_LIMIT, RESULT_CODES, RESULTS, read_history_entry
+
+# مباراة واحدة في السجل: وقت النهاية (ثوانٍ epoch) + رمز النتيجة (بايت واحد)
+_ENTRY = struct.Struct("<IB")
+
+
+def format_date(epoch: int) -> str:
+    return time.strftime(DATE_FORMAT, time.localtime(epoch))
+
+
+class StatsTable:
+    """
+    Per-user stats as columns instead of one dict per user.
+
+    Each user id maps to a slot; wins, losses, draws and total games are
+    ``array('I')`` columns indexed by slot, and the last ``history_limit``
+    games live in one ``bytearray`` as a fixed-size ring of packed
+    (epoch seconds, result code) entries per slot. Dates are formatted
+    only when history is rendered.
+
+    With ``max_users`` the table is a bounded cache: adding a user past
+    the limit frees the least recently used slot whose user is not
+    ``pinned`` (e.g. still has unsaved games); if every candidate is
+    pinned the table grows instead of dropping data.
+    """
+
+    # عدد المرشحين للإخلاء (من الأقدم) قبل أن يكبر الجدول بدلاً من ذلك
+    EVICT_SCAN = 16
+
+    def __init__(self, history_limit: int = HISTORY_LIMIT, max_users: Optional[int] = None,
+                 pinned: Optional[Callable[[int], bool]] = None):
+        self.history_limit = history_limit
+        self.max_users = max_users
+        self.pinned = pinned
+        self.evictions = 0
+        self._slot_bytes = history_limit * _ENTRY.size
+        self._slots: "OrderedDict[int, int]" = OrderedDict()
+        self._free: List[int] = []
+        self.wins = array("I")
+        self.losses = array("I")
+        self.draws = array("I")
+        self.total = array("I")
+        self._hist_len = bytearray()
+        self._hist_head = bytearray()
+        self._hist = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._slots
+
+    def slot(self, user_id: int) -> Optional[int]:
+        slot = self._slots.get(user_id)
+        if slot is not None and self.max_users:
+            self._slots.move_to_end(user_id)
+        return slot
+
+    def _evict(self):
+        """تحرير خانة أقدم مستخدم غير مثبّت"""
+        for user_id in list(itertools.islice(self._slots, self.EVICT_SCAN)):
+            if self.pinned is None or not self.pinned(user_id):
+                self.drop(user_id)
+                self.evictions += 1
+                return
+
+    def add(self, user_id: int, record: Optional[Dict] = None) -> int:
+        """
+        Give a user a slot, filled from a stored record if one is passed
+        (``{"wins", "losses", "draws", "total_games", "history"}``).
+
+        Returns:
+            int: the user's slot
+        """
+        slot = self._slots.get(user_id)
+        if slot is None:
+            if self.max_users and len(self._slots) >= self.max_users:
+                self._evict()
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self.total)
+                for column in (self.wins, self.losses, self.draws, self.total):
+                    column.append(0)
+                self._hist_len.append(0)
+                self._hist_head.append(0)
+                self._hist.extend(bytes(self._slot_bytes))
+            self._slots[user_id] = slot
+
+        if record:
+            self.wins[slot] = record.get("wins", 0)
+            self.losses[slot] = record.get("losses", 0)
+            self.draws[slot] = record.get("draws", 0)
+            self.total[slot] = record.get("total_games", 0)
+            self._hist_len[slot] = self._hist_head[slot] = 0
+            # السجل المحفوظ الأحدث أولاً؛ الحلقة تُملأ من الأقدم
+            for entry in reversed(record.get("history", [])[:self.history_limit]):
+                parsed = read_history_entry(entry)
+                if parsed is not None:
+                    self._push(slot, *parsed)
+        return slot
+
+    def drop(self, user_id: int):
+        """تحرير خانة مستخدم (تُعاد لأول مستخدم جديد)"""
+        slot = self._slots.pop(user_id, None)
+        if slot is None:
+            return
+        self.wins[slot] = self.losses[slot] = self.draws[slot] = self.total[slot] = 0
+        self._hist_len[slot] = self._hist_head[slot] = 0
+        self._free.append(slot)
+
+    def _push(self, slot: int, epoch: int, code: int):
+        head = self._hist_head[slot]
+        _ENTRY.pack_into(self._hist, slot * self._slot_bytes + head * _ENTRY.size, epoch, code)
+        self._hist_head[slot] = (head + 1) % self.history_limit
+        if self._hist_len[slot] < self.history_limit:
+            self._hist_len[slot] += 1
+
+    def record(self, slot: int, result: str, epoch: int):
+        """تسجيل مباراة منتهية"""
+        code = RESULT_CODES[result]
+        self.total[slot] += 1
+        if code == 0:
+            self.wins[slot] += 1
+        elif code == 1:
+            self.losses[slot] += 1
+        else:
+            self.draws[slot] += 1
+        self._push(slot, epoch, code)
+
+    def counts(self, slot: int) -> Tuple[int, int, int, int]:
+        """(الانتصارات، الخسارات، التعادل، المباريات)"""
+        return self.wins[slot], self.losses[slot], self.draws[slot], self.total[slot]
+
+    def history(self, slot: int) -> List[Tuple[int, str]]:
+        """آخر المباريات (epoch، النتيجة)، الأحدث أولاً"""
+        base = slot * self._slot_bytes
+        head = self._hist_head[slot]
+        entries = []
+        for i in range(self._hist_len[slot]):
+            index = (head - 1 - i) % self.history_limit
+            epoch, code = _ENTRY.unpack_from(self._hist, base + index * _ENTRY.size)
+            entries.append((epoch, RESULTS[code]))
+        return entries
+
+    def users(self) -> Iterator[Tuple[int, int]]:
+        """(user_id، الخانة) لكل مستخدم محمّل"""
+        return iter(list(self._slots.items()))
+
+    def nbytes(self) -> int:
+        """الحجم التقريبي في الذاكرة (الأعمدة + خريطة الخانات)"""
+        columns = sum(c.itemsize * len(c) for c in (self.wins, self.losses, self.draws, self.total))
+        history = len(self._hist) + len(self._hist_len) + len(self._hist_head)
+        keys = sum(sys.getsizeof(k) for k in self._slots)
+        return columns + history + sys.getsizeof(self._slots) + keys
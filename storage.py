@@ -0,0 +1,754 @@
+import argparse
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# عدد المباريات المحفوظة في تاريخ كل مستخدم (الأحدث أولاً)
+HISTORY_LIMIT = 10
+DATE_FORMAT = "%Y-%m-%d %H:%M"
+
+_RESULT_FIELDS = {"win": "wins", "loss": "losses", "draw": "draws"}
+
+# سجل المباريات المحفوظ: كل مدخل [وقت النهاية (ثوانٍ epoch)، رمز النتيجة]؛ التاريخ يُنسَّق عند العرض فقط
+RESULTS = ("win", "loss", "draw")
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+
+
+def empty_stats() -> Dict:
+    """سجل إحصائيات فارغ لمستخدم جديد"""
+    return {
+        "wins": 0,
+        "losses": 0,
+        "draws": 0,
+        "total_games": 0,
+        "history": []
+    }
+
+
+def _copy_stats(record: Dict) -> Dict:
+    copied = dict(record)
+    copied["history"] = list(record.get("history", []))
+    return copied
+
+
+def _history_entry(game: Dict) -> List[int]:
+    return [int(game["ts"]), RESULT_CODES[game["result"]]]
+
+
+def parse_date(text: str) -> int:
+    """تاريخ السجل القديم ("2024-01-31 18:05" بالتوقيت المحلي) إلى ثوانٍ epoch"""
+    try:
+        return int(time.mktime(time.strptime(text, DATE_FORMAT)))
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+
+def read_history_entry(entry) -> Optional[Tuple[int, int]]:
+    """
+    مدخل سجل محفوظ إلى (epoch، رمز النتيجة)، أو None إن كان تالفاً
+    (يقبل أيضاً الصيغة القديمة {"date": ..., "result": ...})
+    """
+    if isinstance(entry, dict):
+        code = RESULT_CODES.get(entry.get("result"))
+        return None if code is None else (parse_date(entry.get("date")), code)
+    try:
+        epoch, code = entry
+        epoch = int(epoch)
+    except (TypeError, ValueError):
+        return None
+    return (epoch, code) if code in (0, 1, 2) and 0 <= epoch < 1 << 32 else None
+
+
+def write_atomic(path: str, payload: bytes):
+    """كتابة ملف كاملاً ثم استبداله بـ rename (القارئ يرى القديم أو الجديد فقط)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".xo_data.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def apply_results(record: Dict, games: List[Dict]) -> Dict:
+    """
+    إضافة نتائج مباريات منتهية إلى سجل مستخدم
+    (كل مباراة {"ts": ثوانٍ epoch، "result": ...}، الأقدم أولاً)
+    """
+    for game in games:
+        record["total_games"] += 1
+        field = _RESULT_FIELDS.get(game["result"])
+        if field:
+            record[field] += 1
+    new = [_history_entry(game) for game in games[-HISTORY_LIMIT:]]
+    record["history"] = (new[::-1] + record.get("history", []))[:HISTORY_LIMIT]
+    return record
+
+
+class StorageBackend:
+    """
+    Keyed per-user storage for stats and themes.
+
+    Reads (get_*) are called from the event loop, one user at a time.
+    write_batch() is called from the persistence thread with every dirty
+    user since the previous flush.
+
+    ``stats`` replaces whole records; ``results`` adds finished games as
+    increments, which stays correct when several processes share the store.
+    """
+
+    name = "base"
+
+    def get_stats(self, user_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_theme(self, user_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def write_batch(self, stats: Dict[str, Dict], themes: Dict[str, str],
+                    results: Optional[Dict[str, List[Dict]]] = None) -> int:
+        """
+        Persist one batch of dirty users.
+
+        Returns:
+            int: bytes written (SQLite: an estimate of the row data)
+        """
+        raise NotImplementedError
+
+    def iter_stats(self) -> Iterator[Tuple[str, Dict]]:
+        raise NotImplementedError
+
+    def iter_themes(self) -> Iterator[Tuple[str, str]]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# ----------------------------------------------------------------------
+# 📄 JSON: الملف الأصلي xo_data.json كوثيقة واحدة
+# ----------------------------------------------------------------------
+
+class JsonBackend(StorageBackend):
+    """The original monolithic xo_data.json document, rewritten atomically."""
+
+    name = "json"
+
+    def __init__(self, path: str = "xo_data.json"):
+        self.path = path
+        data = self._load()
+        self._doc = {
+            "stats": dict(data.get("stats", {}) or {}),
+            "themes": {str(k): v for k, v in (data.get("themes", {}) or {}).items()},
+        }
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"stats": {}, "themes": {}}
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error loading {self.path}: {e}")
+            return {"stats": {}, "themes": {}}
+        except Exception as e:
+            logger.error(f"Unexpected error loading {self.path}: {e}")
+            return {"stats": {}, "themes": {}}
+
+    def get_stats(self, user_id: str) -> Optional[Dict]:
+        record = self._doc["stats"].get(user_id)
+        return _copy_stats(record) if record is not None else None
+
+    def get_theme(self, user_id: str) -> Optional[str]:
+        return self._doc["themes"].get(user_id)
+
+    def write_batch(self, stats: Dict[str, Dict], themes: Dict[str, str],
+                    results: Optional[Dict[str, List[Dict]]] = None) -> int:
+        self._doc["stats"].update(stats)
+        self._doc["themes"].update(themes)
+        for uid, games in (results or {}).items():
+            record = self._doc["stats"].get(uid) or empty_stats()
+            self._doc["stats"][uid] = apply_results(record, games)
+        # بدون مسافات بادئة: نفس الصيغة بحجم أصغر بكثير
+        payload = json.dumps(self._doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._write_atomic(payload)
+        return len(payload)
+
+    def _write_atomic(self, payload: bytes):
+        write_atomic(self.path, payload)
+
+    def iter_stats(self) -> Iterator[Tuple[str, Dict]]:
+        for user_id, record in list(self._doc["stats"].items()):
+            yield user_id, _copy_stats(record)
+
+    def iter_themes(self) -> Iterator[Tuple[str, str]]:
+        yield from list(self._doc["themes"].items())
+
+
+# ----------------------------------------------------------------------
+# 🗄️ SQLite: صف لكل مستخدم، مفهرس بالـ user_id
+# ----------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id     INTEGER PRIMARY KEY,
+    wins        INTEGER NOT NULL DEFAULT 0,
+    losses      INTEGER NOT NULL DEFAULT 0,
+    draws       INTEGER NOT NULL DEFAULT 0,
+    total_games INTEGER NOT NULL DEFAULT 0,
+    history     TEXT    NOT NULL DEFAULT '[]',
+    theme       TEXT
+)
+"""
+
+_SELECT_STATS = "SELECT wins, losses, draws, total_games, history FROM users WHERE user_id = ? AND total_games > 0"
+_SELECT_THEME = "SELECT theme FROM users WHERE user_id = ?"
+_UPSERT_STATS = (
+    "INSERT INTO users (user_id, wins, losses, draws, total_games, history) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET wins = excluded.wins, losses = excluded.losses, "
+    "draws = excluded.draws, total_games = excluded.total_games, history = excluded.history"
+)
+_ADD_RESULTS = (
+    "INSERT INTO users (user_id, wins, losses, draws, total_games) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET wins = wins + excluded.wins, losses = losses + excluded.losses, "
+    "draws = draws + excluded.draws, total_games = total_games + excluded.total_games"
+)
+_SELECT_HISTORY = "SELECT history FROM users WHERE user_id = ?"
+_UPDATE_HISTORY = "UPDATE users SET history = ? WHERE user_id = ?"
+_UPSERT_THEME = (
+    "INSERT INTO users (user_id, theme) VALUES (?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET theme = excluded.theme"
+)
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    One row per user keyed by the INTEGER PRIMARY KEY (rowid B-tree).
+
+    WAL mode lets the event loop read while the persistence thread writes;
+    each thread gets its own connection, and every batch is one transaction.
+    Results are applied as in-place increments under BEGIN IMMEDIATE, so
+    several bot processes can share one database without lost updates.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "xo_data.db"):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, cached_statements=32)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_stats(self, user_id: str) -> Optional[Dict]:
+        row = self._conn().execute(_SELECT_STATS, (int(user_id),)).fetchone()
+        if row is None:
+            return None
+        wins, losses, draws, total, history = row
+        return {
+            "wins": wins,
+            "losses": losses,
+            "draws": draws,
+            "total_games": total,
+            "history": json.loads(history),
+        }
+
+    def get_theme(self, user_id: str) -> Optional[str]:
+        row = self._conn().execute(_SELECT_THEME, (int(user_id),)).fetchone()
+        return row[0] if row else None
+
+    def write_batch(self, stats: Dict[str, Dict], themes: Dict[str, str],
+                    results: Optional[Dict[str, List[Dict]]] = None) -> int:
+        stat_rows = [
+            (int(uid), r["wins"], r["losses"], r["draws"], r["total_games"],
+             json.dumps(r.get("history", []), ensure_ascii=False, separators=(",", ":")))
+            for uid, r in stats.items()
+        ]
+        theme_rows = [(int(uid), theme) for uid, theme in themes.items()]
+        # تقدير حجم البيانات المكتوبة: 8 بايت لكل رقم + نصوص الصفوف (بدون صفحات SQLite والـ WAL)
+        written = sum(8 * 5 + len(row[5].encode("utf-8")) for row in stat_rows)
+        written += sum(8 + len(theme.encode("utf-8")) for _, theme in theme_rows)
+        conn = self._conn()
+        # IMMEDIATE: قفل الكتابة من البداية، فقراءة التاريخ ودمجه لا تتسابق مع عملية أخرى
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if stat_rows:
+                conn.executemany(_UPSERT_STATS, stat_rows)
+            if theme_rows:
+                conn.executemany(_UPSERT_THEME, theme_rows)
+            if results:
+                written += self._add_results(conn, results)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return written
+
+    @staticmethod
+    def _add_results(conn: sqlite3.Connection, results: Dict[str, List[Dict]]) -> int:
+        """إضافة المباريات إلى العدادات والتاريخ؛ تُرجع تقدير البايتات المكتوبة"""
+        counts = []
+        for uid, games in results.items():
+            record = apply_results(empty_stats(), games)
+            counts.append((int(uid), record["wins"], record["losses"], record["draws"], record["total_games"]))
+        conn.executemany(_ADD_RESULTS, counts)
+
+        history_rows = []
+        for uid, games in results.items():
+            row = conn.execute(_SELECT_HISTORY, (int(uid),)).fetchone()
+            new = [_history_entry(game) for game in games[-HISTORY_LIMIT:]]
+            history = (new[::-1] + json.loads(row[0]))[:HISTORY_LIMIT]
+            history_rows.append((json.dumps(history, ensure_ascii=False, separators=(",", ":")), int(uid)))
+        conn.executemany(_UPDATE_HISTORY, history_rows)
+        return 8 * 5 * len(counts) + sum(8 + len(history.encode("utf-8")) for history, _ in history_rows)
+
+    def iter_stats(self) -> Iterator[Tuple[str, Dict]]:
+        cursor = self._conn().execute(
+            "SELECT user_id, wins, losses, draws, total_games, history FROM users WHERE total_games > 0"
+        )
+        for uid, wins, losses, draws, total, history in cursor:
+            yield str(uid), {
+                "wins": wins,
+                "losses": losses,
+                "draws": draws,
+                "total_games": total,
+                "history": json.loads(history),
+            }
+
+    def iter_themes(self) -> Iterator[Tuple[str, str]]:
+        cursor = self._conn().execute("SELECT user_id, theme FROM users WHERE theme IS NOT NULL")
+        for uid, theme in cursor:
+            yield str(uid), theme
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+# ----------------------------------------------------------------------
+# 📇 NDJSON: سطر JSON لكل مستخدم + فهرس إزاحات ثنائي (لا شيء يُحمَّل عند الفتح)
+# ----------------------------------------------------------------------
+
+# رأس الفهرس: magic، الإصدار، جيل ملف البيانات، البايتات المفهرسة، البايتات الحية، عدد المستخدمين
+_INDEX_HEADER = struct.Struct("<4sBQQQI")
+# مستخدم واحد في الفهرس (مرتب حسب user_id): user_id، إزاحة السطر، طوله
+_INDEX_ENTRY = struct.Struct("<qQI")
+_INDEX_MAGIC = b"XOIX"
+_INDEX_VERSION = 1
+_NDJSON_FORMAT = "xo-ndjson"
+
+
+class NdjsonBackend(StorageBackend):
+    """
+    Append-only line-delimited JSON (one full user record per line) with a
+    sorted binary offset index that is memory-mapped, not loaded.
+
+    Opening reads the index header and replays only the lines appended
+    after the index was last written, so startup does not grow with the
+    user base; a user's line is fetched with one positioned read on first
+    access. Each batch appends one new line per touched user (the last
+    line wins); the index is rewritten once ``reindex_every`` users sit
+    outside it, and the file is compacted when dead lines outweigh live ones.
+
+    The first line of the data file carries a random generation number
+    that the index repeats, so an index that does not belong to the data
+    file (e.g. a crash between compaction and reindexing) triggers one
+    full rescan instead of bad offsets.
+    """
+
+    name = "ndjson"
+
+    def __init__(self, path: str = "xo_data.ndjson", reindex_every: int = 4096,
+                 compact_min_bytes: int = 1 << 20):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.reindex_every = reindex_every
+        self.compact_min_bytes = compact_min_bytes
+        self._lock = threading.Lock()
+        # المستخدمون الذين كُتبت أسطرهم بعد آخر فهرس: user_id -> (إزاحة، طول)
+        self._recent: Dict[int, Tuple[int, int]] = {}
+        self._index_map: Optional[mmap.mmap] = None
+        self._index_count = 0
+        self._live_bytes = 0
+        self._iterating = 0
+
+        self._out = open(path, "ab")
+        self._fd = os.open(path, os.O_RDONLY)
+        self._size = os.fstat(self._fd).st_size
+        if self._size == 0:
+            self._generation = self._write_header()
+        else:
+            self._generation = self._read_generation()
+
+        covered = self._open_index()
+        if covered is None:
+            logger.info(f"📇 No usable index for {self.path}, scanning the data file once")
+            self._close_index()
+            covered = 0
+            self._live_bytes = 0
+        self._replay(covered)
+        if covered == 0 and self._recent:
+            self._write_index()
+
+    # ------------------------------------------------------------------
+    # الملفات
+    # ------------------------------------------------------------------
+
+    def _write_header(self) -> int:
+        generation = int.from_bytes(os.urandom(8), "little") >> 1
+        line = json.dumps({"format": _NDJSON_FORMAT, "generation": generation}).encode("utf-8") + b"\n"
+        self._out.write(line)
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        self._size = len(line)
+        return generation
+
+    def _read_generation(self) -> int:
+        first = os.pread(self._fd, 256, 0).split(b"\n", 1)[0]
+        try:
+            header = json.loads(first)
+        except ValueError:
+            return 0
+        if isinstance(header, dict) and header.get("format") == _NDJSON_FORMAT:
+            return int(header.get("generation", 0))
+        return 0
+
+    def _open_index(self) -> Optional[int]:
+        """
+        Map the index file if it matches the data file.
+
+        Returns:
+            the number of data bytes it covers, or None if it is missing or stale
+        """
+        try:
+            with open(self.index_path, "rb") as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(index) < _INDEX_HEADER.size:
+            index.close()
+            return None
+        magic, version, generation, covered, live, count = _INDEX_HEADER.unpack_from(index, 0)
+        if (magic != _INDEX_MAGIC or version != _INDEX_VERSION or generation != self._generation
+                or covered > self._size or len(index) != _INDEX_HEADER.size + count * _INDEX_ENTRY.size):
+            index.close()
+            return None
+        self._index_map, self._index_count, self._live_bytes = index, count, live
+        return covered
+
+    def _close_index(self):
+        if self._index_map is not None:
+            self._index_map.close()
+        self._index_map, self._index_count = None, 0
+
+    def _replay(self, start: int):
+        """إضافة الأسطر المكتوبة بعد الفهرس (وقص سطر ناقص من كتابة انقطعت)"""
+        offset = start
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    logger.warning(f"📇 Dropping a partial line at byte {offset} of {self.path}")
+                    os.ftruncate(self._out.fileno(), offset)
+                    self._size = offset
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.error(f"📇 Skipping unreadable line at byte {offset} of {self.path}")
+                    record = None
+                if isinstance(record, dict) and "id" in record:
+                    self._place(int(record["id"]), offset, len(line))
+                offset += len(line)
+
+    def _place(self, user_id: int, offset: int, length: int):
+        old = self._locate(user_id)
+        if old is not None:
+            self._live_bytes -= old[1]
+        self._live_bytes += length
+        self._recent[user_id] = (offset, length)
+
+    # ------------------------------------------------------------------
+    # البحث
+    # ------------------------------------------------------------------
+
+    def _locate(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """(إزاحة، طول) آخر سطر للمستخدم: الأسطر الحديثة أولاً ثم بحث ثنائي في الفهرس"""
+        found = self._recent.get(user_id)
+        if found is not None:
+            return found
+        index = self._index_map
+        lo, hi = 0, self._index_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            uid, offset, length = _INDEX_ENTRY.unpack_from(index, _INDEX_HEADER.size + mid * _INDEX_ENTRY.size)
+            if uid < user_id:
+                lo = mid + 1
+            elif uid > user_id:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def _read(self, user_id: int) -> Optional[Dict]:
+        with self._lock:
+            found = self._locate(user_id)
+            if found is None:
+                return None
+            offset, length = found
+            line = os.pread(self._fd, length, offset)
+        return json.loads(line)
+
+    def _entries(self, recent: Dict[int, Tuple[int, int]]) -> Iterator[Tuple[int, int, int]]:
+        """(user_id، إزاحة، طول) لكل مستخدم حي مرتبة حسب user_id: الفهرس مدموجاً مع الأسطر الحديثة"""
+        pending = sorted(recent.items())
+        j = 0
+        for i in range(self._index_count):
+            uid, offset, length = _INDEX_ENTRY.unpack_from(self._index_map, _INDEX_HEADER.size + i * _INDEX_ENTRY.size)
+            while j < len(pending) and pending[j][0] < uid:
+                yield pending[j][0], pending[j][1][0], pending[j][1][1]
+                j += 1
+            if j < len(pending) and pending[j][0] == uid:
+                yield uid, pending[j][1][0], pending[j][1][1]
+                j += 1
+            else:
+                yield uid, offset, length
+        for uid, (offset, length) in pending[j:]:
+            yield uid, offset, length
+
+    # ------------------------------------------------------------------
+    # واجهة الـ backend
+    # ------------------------------------------------------------------
+
+    def get_stats(self, user_id: str) -> Optional[Dict]:
+        record = self._read(int(user_id))
+        return record.get("stats") if record else None
+
+    def get_theme(self, user_id: str) -> Optional[str]:
+        record = self._read(int(user_id))
+        return record.get("theme") if record else None
+
+    def write_batch(self, stats: Dict[str, Dict], themes: Dict[str, str],
+                    results: Optional[Dict[str, List[Dict]]] = None) -> int:
+        results = results or {}
+        lines = []
+        for uid in set(stats) | set(themes) | set(results):
+            user_id = int(uid)
+            record = self._read(user_id) or {"id": user_id}
+            if uid in stats:
+                record["stats"] = stats[uid]
+            if uid in themes:
+                record["theme"] = themes[uid]
+            if uid in results:
+                record["stats"] = apply_results(record.get("stats") or empty_stats(), results[uid])
+            lines.append((user_id, json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"))
+        if not lines:
+            return 0
+
+        payload = b"".join(line for _, line in lines)
+        self._out.write(payload)
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        with self._lock:
+            offset = self._size
+            for user_id, line in lines:
+                self._place(user_id, offset, len(line))
+                offset += len(line)
+            self._size = offset
+
+        if len(self._recent) >= self.reindex_every and not self._iterating:
+            if self._size > self.compact_min_bytes and self._size - self._live_bytes > self._live_bytes:
+                self.compact()
+            else:
+                self._write_index()
+        return len(payload)
+
+    def _write_index(self):
+        """إعادة كتابة الفهرس ليشمل كل الأسطر (من خيط الكتابة فقط)"""
+        with self._lock:
+            recent = dict(self._recent)
+            covered = self._size
+        entries = bytearray()
+        count = 0
+        for entry in self._entries(recent):
+            entries += _INDEX_ENTRY.pack(*entry)
+            count += 1
+        header = _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, self._generation, covered, self._live_bytes, count)
+        write_atomic(self.index_path, header + bytes(entries))
+        with self._lock:
+            self._close_index()
+            self._open_index()
+            self._recent = {uid: loc for uid, loc in self._recent.items() if loc[0] >= covered}
+
+    def compact(self):
+        """
+        Rewrite the data file with only the live line of each user, in
+        user_id order, then reindex it (from the writer thread only).
+        """
+        with self._lock:
+            recent = dict(self._recent)
+        generation = int.from_bytes(os.urandom(8), "little") >> 1
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".xo_data.", suffix=".tmp", dir=directory)
+        entries = bytearray()
+        count = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                offset = header_size = f.write(
+                    json.dumps({"format": _NDJSON_FORMAT, "generation": generation}).encode("utf-8") + b"\n"
+                )
+                for uid, old_offset, length in self._entries(recent):
+                    f.write(os.pread(self._fd, length, old_offset))
+                    entries += _INDEX_ENTRY.pack(uid, offset, length)
+                    offset += length
+                    count += 1
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        live = offset - header_size
+        before = self._size
+        # الفهرس الجديد قبل التبديل: القرّاء يبقون على الملف القديم المفتوح حتى تلك اللحظة
+        header = _INDEX_HEADER.pack(_INDEX_MAGIC, _INDEX_VERSION, generation, offset, live, count)
+        write_atomic(self.index_path, header + bytes(entries))
+
+        with self._lock:
+            self._out.close()
+            os.close(self._fd)
+            self._out = open(self.path, "ab")
+            self._fd = os.open(self.path, os.O_RDONLY)
+            self._generation = generation
+            self._size = offset
+            self._recent = {}
+            self._close_index()
+            self._open_index()
+        logger.info(f"📇 Compacted {self.path}: {before} -> {offset} bytes, {count} users")
+
+    def _iter_records(self) -> Iterator[Tuple[int, Dict]]:
+        # الفهرس والملف لا يُستبدلان أثناء المرور (الكتابة تؤجل إعادة الفهرسة)
+        with self._lock:
+            self._iterating += 1
+            recent = dict(self._recent)
+        try:
+            for uid, offset, length in self._entries(recent):
+                yield uid, json.loads(os.pread(self._fd, length, offset))
+        finally:
+            with self._lock:
+                self._iterating -= 1
+
+    def iter_stats(self) -> Iterator[Tuple[str, Dict]]:
+        for uid, record in self._iter_records():
+            if record.get("stats"):
+                yield str(uid), record["stats"]
+
+    def iter_themes(self) -> Iterator[Tuple[str, str]]:
+        for uid, record in self._iter_records():
+            if record.get("theme"):
+                yield str(uid), record["theme"]
+
+    def close(self):
+        if self._out.closed:
+            return
+        if self._recent and not self._iterating:
+            self._write_index()
+        self._out.close()
+        os.close(self._fd)
+        self._close_index()
+
+
+BACKENDS = {
+    "json": JsonBackend,
+    "sqlite": SQLiteBackend,
+    "ndjson": NdjsonBackend,
+}
+
+
+def open_backend(kind: str, path: str) -> StorageBackend:
+    """فتح الـ backend المطلوب (json أو sqlite أو ndjson)"""
+    try:
+        backend_cls = BACKENDS[kind]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend: {kind!r} (expected one of {', '.join(BACKENDS)})")
+    return backend_cls(path)
+
+
+def migrate(src: StorageBackend, dst: StorageBackend, batch_size: int = 1000) -> int:
+    """
+    Copy every user from one backend into another in batched transactions.
+
+    Returns:
+        int: number of stats records copied
+    """
+    copied = 0
+    batch: Dict[str, Dict] = {}
+    for user_id, record in src.iter_stats():
+        batch[user_id] = record
+        if len(batch) >= batch_size:
+            dst.write_batch(batch, {})
+            copied += len(batch)
+            batch = {}
+    if batch:
+        dst.write_batch(batch, {})
+        copied += len(batch)
+
+    themes: Dict[str, str] = {}
+    for user_id, theme in src.iter_themes():
+        themes[user_id] = theme
+        if len(themes) >= batch_size:
+            dst.write_batch({}, themes)
+            themes = {}
+    if themes:
+        dst.write_batch({}, themes)
+    return copied
+
+
+# تشغيل الترحيل مرة واحدة:  python storage.py migrate --json xo_data.json --db xo_data.db
+# (أو --to ndjson --db xo_data.ndjson للملف المفهرس سطراً لكل مستخدم)
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="XO bot storage tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="copy xo_data.json into a SQLite database or an indexed NDJSON file")
+    mig.add_argument("--json", default="xo_data.json")
+    mig.add_argument("--to", choices=("sqlite", "ndjson"), default="sqlite")
+    mig.add_argument("--db", default=None, help="target path (default xo_data.db or xo_data.ndjson)")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        target_path = args.db or ("xo_data.db" if args.to == "sqlite" else "xo_data.ndjson")
+        source = JsonBackend(args.json)
+        target = open_backend(args.to, target_path)
+        count = migrate(source, target)
+        target.close()
+        logger.info(f"✅ Migrated {count} users from {args.json} to {target_path}")
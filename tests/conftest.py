@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def bot(tmp_path_factory):
+    """bot.py imported in a temporary directory, so its data files never touch the repo."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    try:
+        import bot as module
+
+        module.open_storage()
+        yield module
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,205 @@
+import asyncio
+import random
+
+from telegram import Update
+
+import callbacks as cb
+from concurrency import ChatSerializedUpdateProcessor
+
+# X: 0, 1, 2 (الصف الأول) / O: 3, 4
+SCRIPT = ["mode_normal", "0,0", "1,0", "0,1", "1,1", "0,2"]
+
+
+class FakeBot:
+    """Just the Bot API methods button() calls, each with random latency."""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.alerts = 0
+
+    async def _latency(self):
+        await asyncio.sleep(self.rng.random() * 0.003)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._latency()
+        if show_alert:
+            self.alerts += 1
+        return True
+
+    async def edit_message_text(self, *args, **kwargs):
+        await self._latency()
+        return True
+
+    async def send_sticker(self, *args, **kwargs):
+        await self._latency()
+        return True
+
+
+class Context:
+    def __init__(self, fake_bot):
+        self.bot = fake_bot
+
+
+def make_update(update_id: int, chat_id: int, data: str, fake_bot=None) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Test"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}},
+        },
+    }, fake_bot)
+
+
+def test_interleaved_chats_each_finish_their_game_once(bot):
+    chats = range(700_001, 700_101)
+    rng = random.Random(7)
+    fake_bot = FakeBot(rng)
+    context = Context(fake_bot)
+    processor = ChatSerializedUpdateProcessor(16)
+
+    # كل محادثة ترسل نقراتها بالترتيب، والمحادثات متداخلة عشوائياً
+    streams = {chat_id: list(SCRIPT) for chat_id in chats}
+    arrivals = []
+    while streams:
+        chat_id = rng.choice(list(streams))
+        arrivals.append(make_update(len(arrivals) + 1, chat_id, streams[chat_id].pop(0), fake_bot))
+        if not streams[chat_id]:
+            del streams[chat_id]
+
+    async def main():
+        await asyncio.gather(*(
+            asyncio.create_task(processor.process_update(u, bot.button(u, context))) for u in arrivals
+        ))
+
+    asyncio.run(main())
+    assert fake_bot.alerts == 0
+    for chat_id in chats:
+        assert bot.stats.counts(bot.get_user_stats(chat_id)) == (1, 0, 0, 1)
+    # الأقفال تُحذف حين لا يبقى تحديث للمحادثة
+    assert processor.active_chats == 0
+
+
+def test_same_chat_runs_in_arrival_order():
+    order = []
+
+    async def handler(n):
+        await asyncio.sleep(random.random() * 0.002)
+        order.append(n)
+
+    async def main():
+        processor = ChatSerializedUpdateProcessor(8)
+        tasks = [
+            asyncio.create_task(processor.process_update(make_update(n, 42, cb.encode(cb.STATS)), handler(n)))
+            for n in range(30)
+        ]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == list(range(30))
+
+
+def test_moves_are_served_before_menus_that_queued_first():
+    order = []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        async def handler(name):
+            order.append(name)
+
+        processor = ChatSerializedUpdateProcessor(1)
+        first = asyncio.create_task(processor.process_update(make_update(1, 1, cb.encode(cb.STATS)), blocker()))
+        await asyncio.sleep(0)
+        menu = asyncio.create_task(processor.process_update(make_update(2, 2, cb.encode(cb.HISTORY)), handler("menu")))
+        move = asyncio.create_task(processor.process_update(make_update(3, 3, cb.encode_move(4, "a")), handler("move")))
+        await asyncio.sleep(0.01)
+        assert processor.metrics()["waiting"] == {"move": 1, "control": 0, "menu": 1}
+        release.set()
+        await asyncio.gather(first, menu, move)
+
+    asyncio.run(main())
+    assert order == ["move", "menu"]
+
+
+def test_aging_lets_an_old_menu_tap_ahead_of_a_new_move():
+    order = []
+    now = [0.0]
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        async def handler(name):
+            order.append(name)
+
+        processor = ChatSerializedUpdateProcessor(1, aging=1.0, clock=lambda: now[0])
+        first = asyncio.create_task(processor.process_update(make_update(1, 1, cb.encode(cb.STATS)), blocker()))
+        await asyncio.sleep(0)
+        menu = asyncio.create_task(processor.process_update(make_update(2, 2, cb.encode(cb.HISTORY)), handler("menu")))
+        await asyncio.sleep(0)
+        # قائمة انتظرت أكثر من 2 × aging تسبق حركة جديدة
+        now[0] = 2.5
+        move = asyncio.create_task(processor.process_update(make_update(3, 3, cb.encode_move(4, "a")), handler("move")))
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.gather(first, menu, move)
+
+    asyncio.run(main())
+    assert order == ["menu", "move"]
+
+
+def run_shedding(waiting_menus: int, shed_depth: int):
+    """One worker held busy while menu taps queue; then the clock jumps past shed_after."""
+    now = [0.0]
+    ran, shed = [], []
+
+    async def main():
+        release = asyncio.Event()
+
+        async def blocker():
+            await release.wait()
+
+        async def handler(name):
+            ran.append(name)
+
+        async def on_shed(update):
+            shed.append(update.update_id)
+
+        processor = ChatSerializedUpdateProcessor(1, shed_after=2.0, shed_depth=shed_depth,
+                                                  on_shed=on_shed, clock=lambda: now[0])
+        tasks = [asyncio.create_task(processor.process_update(make_update(1, 1, cb.encode(cb.STATS)), blocker()))]
+        await asyncio.sleep(0)
+        for n in range(waiting_menus):
+            update = make_update(10 + n, 10 + n, cb.encode(cb.HISTORY))
+            tasks.append(asyncio.create_task(processor.process_update(update, handler(n))))
+        move = make_update(99, 99, cb.encode_move(4, "a"))
+        tasks.append(asyncio.create_task(processor.process_update(move, handler("move"))))
+        await asyncio.sleep(0.01)
+        now[0] = 5.0
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return ran, shed
+
+
+def test_delayed_menu_taps_run_when_the_queue_is_short():
+    # انتظار طويل مع طابور قصير (استدعاءات API بطيئة مثلاً): لا إسقاط
+    ran, shed = run_shedding(waiting_menus=3, shed_depth=4)
+    assert shed == []
+    assert ran == ["move", 0, 1, 2]
+
+
+def test_delayed_menu_taps_are_shed_when_the_queue_is_deep():
+    ran, shed = run_shedding(waiting_menus=8, shed_depth=4)
+    # الحركة لا تُسقط أبداً؛ القوائم تُسقط ما دام خلفها أكثر من shed_depth ينتظر
+    assert ran == ["move", 3, 4, 5, 6, 7]
+    assert shed == [10, 11, 12]
@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from effects import EffectDispatcher
+
+
+def run_effect(first_error, retries: int = 3):
+    """Submit one effect that raises ``first_error()`` on its first call only."""
+    calls = []
+    failed = []
+
+    async def effect():
+        calls.append(1)
+        if len(calls) == 1:
+            raise first_error()
+
+    async def main():
+        dispatcher = EffectDispatcher(backoff=0.001, retries=retries, on_failed=failed.append)
+        dispatcher.start()
+        dispatcher.submit("sticker", effect)
+        await asyncio.sleep(0.1)
+        await dispatcher.stop()
+        return {outcome: n for outcome, n in dispatcher.counts.items() if n}
+
+    counts = asyncio.run(main())
+    return len(calls), counts, failed
+
+
+def wrapped(error_cls, cause):
+    """The error PTB raises for an httpx failure (``raise TimedOut from err``)."""
+    def make():
+        error = error_cls("x")
+        error.__cause__ = cause
+        return error
+    return make
+
+
+@pytest.mark.parametrize("cause", [httpx.ReadTimeout("x"), httpx.WriteTimeout("x"), httpx.ReadError("x"),
+                                   httpx.RemoteProtocolError("x")], ids=lambda e: type(e).__name__)
+def test_sends_that_may_have_been_delivered_are_not_retried(cause):
+    error_cls = NetworkError if isinstance(cause, (httpx.ReadError, httpx.RemoteProtocolError)) else TimedOut
+    calls, counts, failed = run_effect(wrapped(error_cls, cause))
+    assert calls == 1
+    assert counts == {"unconfirmed": 1}
+    assert failed == []
+
+
+@pytest.mark.parametrize("cause", [httpx.ConnectError("x"), httpx.ConnectTimeout("x"), httpx.PoolTimeout("x")],
+                         ids=lambda e: type(e).__name__)
+def test_sends_that_never_left_are_retried(cause):
+    error_cls = NetworkError if isinstance(cause, httpx.ConnectError) else TimedOut
+    calls, counts, failed = run_effect(wrapped(error_cls, cause))
+    assert calls == 2
+    assert counts == {"retried": 1, "sent": 1}
+
+
+def test_error_responses_are_retried():
+    calls, counts, _ = run_effect(lambda: NetworkError("Bad Gateway"))
+    assert calls == 2
+    assert counts == {"retried": 1, "sent": 1}
+    calls, counts, _ = run_effect(lambda: RetryAfter(0))
+    assert calls == 2
+
+
+def test_rejected_sends_fail_at_once_and_are_reported():
+    calls, counts, failed = run_effect(lambda: BadRequest("Wrong file identifier"))
+    assert calls == 1
+    assert counts == {"failed": 1}
+    assert failed == ["sticker"]
+
+
+def test_retries_are_bounded():
+    failed = []
+
+    async def main():
+        dispatcher = EffectDispatcher(backoff=0.001, retries=2, on_failed=failed.append)
+        dispatcher.start()
+
+        async def always():
+            raise NetworkError("Bad Gateway")
+
+        dispatcher.submit("sticker", always)
+        await asyncio.sleep(0.1)
+        await dispatcher.stop()
+        return dispatcher.counts
+
+    counts = asyncio.run(main())
+    assert counts["retried"] == 2
+    assert counts["failed"] == 1
+    assert failed == ["sticker"]
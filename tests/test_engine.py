@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from engine import CLASSIC, XOEngine, board_shape
+
+
+def scan_winner(game):
+    for mask in game.shape.line_masks:
+        if game.x_bits & mask == mask:
+            return "X"
+        if game.o_bits & mask == mask:
+            return "O"
+    return None
+
+
+def play(shape, cells):
+    game = XOEngine(shape)
+    for cell in cells:
+        assert game.make_move(*divmod(cell, shape.size))
+        if game.winner is not None or game.is_draw():
+            break
+        game.switch_player()
+    return game
+
+
+@pytest.mark.parametrize("shape", [CLASSIC, board_shape(4, 4), board_shape(5, 4)], ids=repr)
+def test_winner_matches_a_full_scan(shape):
+    rng = random.Random(3)
+    for _ in range(2000):
+        cells = list(range(shape.cells))
+        rng.shuffle(cells)
+        game = XOEngine(shape)
+        for cell in cells:
+            game.make_move(*divmod(cell, shape.size))
+            assert game.check_winner() == scan_winner(game)
+            if game.winner is not None:
+                break
+            game.switch_player()
+
+
+def test_classic_draw_needs_a_full_board():
+    # X O X / X O O / O X _ : no line is still winnable, but one cell is empty
+    game = play(CLASSIC, [0, 1, 2, 4, 3, 5, 7, 6])
+    assert game.winner is None
+    assert game.move_count == 8
+    assert not game.is_draw()
+    game.make_move(2, 2)
+    assert game.is_draw()
+
+
+def test_larger_boards_end_in_a_draw_once_every_line_is_blocked():
+    shape = board_shape(4, 4)
+    rng = random.Random(11)
+    early = 0
+    for _ in range(500):
+        cells = list(range(shape.cells))
+        rng.shuffle(cells)
+        game = play(shape, cells)
+        blocked = all(game.x_bits & mask and game.o_bits & mask for mask in shape.line_masks)
+        assert game.is_draw() == (game.winner is None and blocked)
+        if game.is_draw() and game.move_count < shape.cells:
+            early += 1
+    # التعادل يُعلن قبل امتلاء اللوحة في معظم الألعاب بلا فائز
+    assert early > 0
+
+
+def test_illegal_moves_are_rejected():
+    game = XOEngine(CLASSIC)
+    assert game.make_move(1, 1)
+    assert not game.make_move(1, 1)
+    assert not game.make_move(3, 0)
+    assert not game.make_move(0, -1)
+    assert bytes(game.moves) == bytes([4])
+
+
+@pytest.mark.parametrize("shape", [CLASSIC, board_shape(4, 4)], ids=repr)
+def test_set_position_recomputes_the_winner(shape):
+    rng = random.Random(5)
+    for _ in range(500):
+        cells = list(range(shape.cells))
+        rng.shuffle(cells)
+        game = play(shape, cells)
+        copy = XOEngine(shape)
+        copy.set_position(game.x_bits, game.o_bits, game.current_player)
+        assert copy.winner == game.winner
+        assert copy.is_draw() == game.is_draw()
+        assert copy.move_count == game.move_count
@@ -0,0 +1,147 @@
+import os
+import struct
+import time
+
+import pytest
+
+from engine import CLASSIC, board_shape
+from journal import GameJournal
+
+
+@pytest.fixture
+def make_game(bot):
+    def make(user_id, timed_mode, vs_bot, shape):
+        return bot.XOGame(user_id, timed_mode=timed_mode, vs_bot=vs_bot, shape=shape)
+    return make
+
+
+def play(journal, key, game, *cells):
+    """Moves as on_move makes them: move, journal, switch player."""
+    for cell in cells:
+        player = game.current_player
+        assert game.make_move(*divmod(cell, game.shape.size))
+        journal.moved(key, game, cell, player)
+        game.switch_player()
+
+
+def new_game(journal, live, key, game):
+    live[key] = game
+    journal.created(key, game)
+    return game
+
+
+def crash(journal):
+    """Leave the journal as a killed process would: fd dropped, half a record at the end."""
+    path = journal._segment_path(journal._segment)
+    os.close(journal._fd)
+    journal._fd = None
+    with open(path, "ab") as f:
+        f.write(b"\x30\x00\x00\x00\xde\xad")
+    return path
+
+
+def same_game(restored, game):
+    assert (restored.x_bits, restored.o_bits) == (game.x_bits, game.o_bits)
+    assert restored.current_player == game.current_player
+    assert restored.shape is game.shape
+    assert restored.nonce == game.nonce
+    assert restored.user_id == game.user_id
+    assert restored.vs_bot == game.vs_bot
+    assert restored.winner == game.winner
+    assert restored.opponent_id == game.opponent_id
+
+
+def test_crash_and_restore_round_trip(tmp_path, make_game):
+    path = str(tmp_path / "games.journal")
+    live = {}
+    journal = GameJournal(path)
+    journal.start(lambda: list(live.items()))
+
+    normal = new_game(journal, live, 1, make_game(801, False, None, CLASSIC))
+    play(journal, 1, normal, 4, 0, 8)
+    timed = new_game(journal, live, 2, make_game(802, True, None, CLASSIC))
+    play(journal, 2, timed, 2)
+    larger = new_game(journal, live, 3, make_game(803, False, None, board_shape(4, 4)))
+    play(journal, 3, larger, 5, 10, 15)
+    bot_game = new_game(journal, live, 4, make_game(804, False, "perfect", CLASSIC))
+    play(journal, 4, bot_game, 4, 0)
+    finished = new_game(journal, live, 5, make_game(805, False, None, CLASSIC))
+    play(journal, 5, finished, 0)
+    journal.ended(5)
+    match = make_game(806, False, None, CLASSIC)
+    match.opponent_id = 807
+    match.message_id = 55
+    new_game(journal, live, (-100, 55), match)
+    play(journal, (-100, 55), match, 1, 2)
+
+    segment = crash(journal)
+    good = os.path.getsize(segment) - 6
+
+    restored = GameJournal(path).restore(make_game, ttl=600)
+    assert set(restored) == {1, 2, 3, 4, (-100, 55)}
+    for key in restored:
+        same_game(restored[key], live[key])
+    assert bytes(restored[3].moves) == bytes(larger.moves)
+    assert restored[2].time_left["X"] == pytest.approx(timed.time_left["X"], abs=1e-3)
+    assert restored[(-100, 55)].message_id == 55
+    # the torn record is cut off so the next run appends after good data
+    assert os.path.getsize(segment) == good
+
+
+def test_restore_from_snapshot_plus_tail(tmp_path, make_game):
+    path = str(tmp_path / "games.journal")
+    live = {}
+    journal = GameJournal(path, snapshot_every=4)
+    journal.start(lambda: list(live.items()))
+
+    games = [new_game(journal, live, 10 + i, make_game(810 + i, False, None, CLASSIC)) for i in range(3)]
+    for i, game in enumerate(games):
+        play(journal, 10 + i, game, i, 3 + i)
+    assert journal.snapshots >= 2
+    play(journal, 10, games[0], 8)
+    crash(journal)
+
+    second = GameJournal(path)
+    restored = second.restore(make_game, ttl=600)
+    assert set(restored) == {10, 11, 12}
+    for key, game in restored.items():
+        same_game(game, live[key])
+    # older segments were deleted after the snapshot that covers them
+    assert len(second._segments()) <= 2
+
+
+def test_snapshot_keeps_start_and_last_move_times(tmp_path, make_game):
+    path = str(tmp_path / "games.journal")
+    live = {}
+    journal = GameJournal(path)
+    journal.start(lambda: list(live.items()))
+    now = time.time()
+
+    idle = new_game(journal, live, 20, make_game(820, False, None, CLASSIC))
+    play(journal, 20, idle, 4)
+    idle.started_at, idle.last_active = now - 1000, now - 900
+    active = new_game(journal, live, 21, make_game(821, False, None, CLASSIC))
+    play(journal, 21, active, 4)
+    active.started_at, active.last_active = now - 300, now - 30
+    journal.close()
+
+    restored = GameJournal(path).restore(make_game, ttl=600)
+    # idle for 900s > ttl: not resumed, even though the snapshot itself is new
+    assert set(restored) == {21}
+    assert restored[21].started_at == int(active.started_at)
+    assert restored[21].last_active == int(active.last_active)
+
+
+def test_snapshot_with_another_version_is_ignored(tmp_path, make_game):
+    path = str(tmp_path / "games.journal")
+    live = {}
+    journal = GameJournal(path)
+    journal.start(lambda: list(live.items()))
+    game = new_game(journal, live, 30, make_game(830, False, None, CLASSIC))
+    play(journal, 30, game, 4)
+    journal.close()
+
+    with open(journal.snapshot_path, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<B", 2))
+    assert GameJournal(path).restore(make_game, ttl=600) == {}
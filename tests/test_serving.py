@@ -0,0 +1,145 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+from serving import HTTPServer, Response, webhook_forwarder
+
+
+async def echo(request):
+    return Response(200, request.body)
+
+
+async def crash(request):
+    raise RuntimeError("boom")
+
+
+async def exchange(port: int, raw: bytes, pause: float = 0.0, rest: bytes = b"") -> bytes:
+    """Send raw bytes (optionally more after a pause) and read until the server closes."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    if pause:
+        await asyncio.sleep(pause)
+        writer.write(rest)
+        await writer.drain()
+    try:
+        return await asyncio.wait_for(reader.read(), 3)
+    finally:
+        writer.close()
+
+
+def statuses(data: bytes):
+    return [int(code) for code in re.findall(rb"HTTP/1\.1 (\d{3}) ", data)]
+
+
+def serve(raw: bytes, pause: float = 0.0, rest: bytes = b"", **options) -> bytes:
+    async def main():
+        options.setdefault("header_timeout", 0.3)
+        options.setdefault("body_timeout", 0.3)
+        options.setdefault("idle_timeout", 0.3)
+        server = HTTPServer("127.0.0.1", 0, **options)
+        server.route("POST", "/echo", echo)
+        server.route("GET", "/crash", crash)
+        await server.start()
+        try:
+            return await exchange(server.port, raw, pause, rest)
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def post(body: bytes, headers: str = "") -> bytes:
+    return f"POST /echo HTTP/1.1\r\nContent-Length: {len(body)}\r\n{headers}\r\n".encode() + body
+
+
+def test_keep_alive_serves_several_requests_then_closes_when_idle():
+    data = serve(post(b"one") + post(b"two"))
+    assert statuses(data) == [200, 200]
+    assert data.endswith(b"two")
+
+
+def test_routes():
+    raw = b"GET /echo HTTP/1.1\r\n\r\nGET /nope HTTP/1.1\r\n\r\nGET /crash HTTP/1.1\r\nConnection: close\r\n\r\n"
+    assert statuses(serve(raw)) == [405, 404, 500]
+
+
+@pytest.mark.parametrize("value", ["abc", "-5", "+5", "1_0", "", "5 5"])
+def test_bad_content_length_is_400(value):
+    data = serve(f"POST /echo HTTP/1.1\r\nContent-Length: {value}\r\n\r\nhello".encode())
+    assert statuses(data) == [400]
+
+
+def test_bad_request_line_is_400():
+    assert statuses(serve(b"garbage\r\n\r\n")) == [400]
+
+
+def test_transfer_encoding_is_501_and_the_body_is_not_read_as_a_request():
+    raw = b"POST /echo HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n"
+    assert statuses(serve(raw)) == [501]
+
+
+def test_body_over_max_body_is_413():
+    assert statuses(serve(post(b"x" * 100), max_body=10)) == [413]
+
+
+def test_headers_over_max_header_are_431():
+    many = "".join(f"X-{i}: {'a' * 20}\r\n" for i in range(100))
+    assert statuses(serve(post(b"hi", many), max_header=1024)) == [431]
+    long_line = f"X-Long: {'a' * 4000}\r\n"
+    assert statuses(serve(post(b"hi", long_line), max_header=1024)) == [431]
+
+
+def test_slow_headers_get_408():
+    data = serve(b"POST /echo HTTP/1.1\r\nHost: x\r\n", pause=0.6, rest=b"\r\n")
+    assert statuses(data) == [408]
+
+
+def test_slow_body_gets_408():
+    data = serve(b"POST /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc", pause=0.6, rest=b"defghij")
+    assert statuses(data) == [408]
+
+
+def test_truncated_body_closes_without_response():
+    async def main():
+        server = HTTPServer("127.0.0.1", 0)
+        server.route("POST", "/echo", echo)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(b"POST /echo HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc")
+            writer.write_eof()
+            data = await asyncio.wait_for(reader.read(), 3)
+            writer.close()
+            return data
+        finally:
+            await server.stop()
+
+    assert asyncio.run(main()) == b""
+
+
+def test_webhook_forwarder_checks_secret_and_payload():
+    forwarded = []
+
+    async def forward(payload):
+        forwarded.append(payload)
+
+    async def main():
+        server = HTTPServer("127.0.0.1", 0)
+        server.route("POST", "/hook", webhook_forwarder("s3cret", forward))
+        await server.start()
+        try:
+            results = []
+            for secret, body in (("wrong", b'{"update_id": 1}'), ("s3cret", b"not json"),
+                                 ("s3cret", b"[1, 2]"), ("s3cret", b'{"update_id": 7}')):
+                raw = (f"POST /hook HTTP/1.1\r\nX-Telegram-Bot-Api-Secret-Token: {secret}\r\n"
+                       f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode() + body
+                results += statuses(await exchange(server.port, raw))
+            return results
+        finally:
+            await server.stop()
+
+    assert asyncio.run(main()) == [403, 400, 400, 200]
+    assert forwarded == [json.loads(b'{"update_id": 7}')]
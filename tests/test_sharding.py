@@ -0,0 +1,38 @@
+import asyncio
+
+from persistence import WriteBehindStore
+from storage import SQLiteBackend
+
+
+def test_worker_views_see_games_recorded_by_other_shards(bot, tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.db")
+    backend = SQLiteBackend(path)
+    monkeypatch.setattr(bot, "backend", backend)
+    monkeypatch.setattr(bot, "store", WriteBehindStore(backend))
+    monkeypatch.setattr(bot, "SHARED_STORE", True)
+    other_shard = SQLiteBackend(path)
+    user = 900_001
+
+    bot.update_stats(user, "win")
+    bot.store.flush()
+    assert bot.stats.counts(bot.get_user_stats(user)) == (1, 0, 0, 1)
+
+    other_shard.write_batch({}, {}, {str(user): [{"ts": 1_760_000_000, "result": "loss"}]})
+    # the cached slot is stale; the stats and history views re-read the shared store
+    assert bot.stats.counts(bot.fresh_user_stats(user)) == (1, 1, 0, 2)
+    assert bot.leaderboard.total_games(user) == 2
+
+    # a game not yet flushed here is kept, not replaced by the older stored row
+    bot.update_stats(user, "draw")
+    other_shard.write_batch({}, {}, {str(user): [{"ts": 1_760_000_100, "result": "win"}]})
+    assert bot.stats.counts(bot.fresh_user_stats(user)) == (1, 1, 1, 3)
+    bot.store.flush()
+    assert bot.stats.counts(bot.fresh_user_stats(user)) == (2, 1, 1, 4)
+    assert len(bot.stats.history(bot.get_user_stats(user))) == 4
+
+    # a rebuilt leaderboard takes the stored counts when they are ahead of the cache
+    other_shard.write_batch({}, {}, {str(user): [{"ts": 1_760_000_200, "result": "win"}]})
+    asyncio.run(bot.rebuild_leaderboard())
+    assert bot.leaderboard.total_games(user) == 5
+    other_shard.close()
+    backend.close()
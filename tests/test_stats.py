@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from stats_table import StatsTable, format_date
+from storage import open_backend, read_history_entry
+
+GAMES = [{"ts": 1_760_000_000 + i * 61, "result": ("win", "loss", "draw")[i % 3]} for i in range(14)]
+
+
+@pytest.mark.parametrize("kind", ["json", "sqlite", "ndjson"])
+def test_history_is_stored_as_epoch_and_code(tmp_path, kind):
+    backend = open_backend(kind, str(tmp_path / f"data.{kind}"))
+    backend.write_batch({}, {}, {"7": GAMES[:5]})
+    backend.write_batch({}, {}, {"7": GAMES[5:]})
+    record = backend.get_stats("7")
+    backend.close()
+
+    assert record["total_games"] == 14
+    # الأحدث أولاً، آخر 10 فقط، والثواني محفوظة
+    assert record["history"] == [[g["ts"], ("win", "loss", "draw").index(g["result"])] for g in GAMES[::-1][:10]]
+    table = StatsTable()
+    slot = table.add(7, record)
+    assert table.history(slot) == [(g["ts"], g["result"]) for g in GAMES[::-1][:10]]
+
+
+def test_json_file_has_no_formatted_dates(tmp_path):
+    path = tmp_path / "data.json"
+    backend = open_backend("json", str(path))
+    backend.write_batch({}, {}, {"7": GAMES[:2]})
+    backend.close()
+    stored = json.loads(path.read_text())["stats"]["7"]["history"]
+    assert stored == [[GAMES[1]["ts"], 1], [GAMES[0]["ts"], 0]]
+
+
+def test_old_date_string_entries_still_load():
+    old = {"date": format_date(1_760_000_000), "result": "loss"}
+    epoch, code = read_history_entry(old)
+    assert code == 1
+    # الصيغة القديمة بلا ثوانٍ
+    assert format_date(epoch) == old["date"]
+
+    table = StatsTable()
+    record = {"wins": 1, "losses": 1, "draws": 0, "total_games": 2,
+              "history": [[1_760_000_100, 0], old]}
+    slot = table.add(1, record)
+    assert [result for _, result in table.history(slot)] == ["win", "loss"]
+
+
+@pytest.mark.parametrize("entry", [None, [], [1], ["x", 0], [5, 9], [-1, 0], {"result": "meh"}, "2024"])
+def test_broken_entries_are_skipped(entry):
+    assert read_history_entry(entry) is None
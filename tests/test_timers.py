@@ -0,0 +1,159 @@
+import asyncio
+
+from timers import EditBudget, TimerService
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def run_timers(clock, steps):
+    """Run ``steps`` (clock advance, keys expected to fire) through run_due()."""
+    fired = []
+    timers = TimerService(clock=clock)
+
+    def callback(key):
+        async def fire():
+            fired.append(key)
+        return fire
+
+    async def main():
+        for key, delay in (("a", 5), ("b", 1), ("c", 3)):
+            timers.schedule(key, delay, callback(key))
+        results = []
+        for advance, action in steps:
+            clock.now += advance
+            if action is not None:
+                action(timers, callback)
+            timers.run_due()
+            await asyncio.sleep(0)
+            results.append(list(fired))
+            fired.clear()
+        return timers, results
+
+    return asyncio.run(main())
+
+
+def test_fires_only_due_timers_in_deadline_order():
+    timers, results = run_timers(FakeClock(), [(0.5, None), (2.5, None), (2, None)])
+    assert results == [[], ["b", "c"], ["a"]]
+    assert timers.fired == 3
+    assert len(timers) == 0
+    assert timers.next_deadline() is None
+
+
+def test_reschedule_supersedes_and_cancel_drops():
+    def reschedule(timers, callback):
+        timers.schedule("b", 10, callback("b"))
+        timers.cancel("c")
+
+    clock = FakeClock()
+    timers, results = run_timers(clock, [(0, reschedule), (5, None), (5, None)])
+    # b was moved from +1 to +10, c cancelled: neither fires at its old deadline
+    assert results == [[], ["a"], ["b"]]
+    assert timers.fired == 2
+
+
+def test_next_deadline_skips_superseded_entries():
+    clock = FakeClock()
+    timers = TimerService(clock=clock)
+
+    async def noop():
+        pass
+
+    timers.schedule("k", 1, noop)
+    timers.schedule("k", 7, noop)
+    assert timers.next_deadline() == clock.now + 7
+    assert len(timers) == 1
+
+
+def test_heap_is_compacted_after_many_reschedules():
+    timers = TimerService(clock=FakeClock())
+
+    async def noop():
+        pass
+
+    for delay in range(1000):
+        timers.schedule("same", delay, noop)
+    assert len(timers._heap) <= 2 * len(timers) + 65
+
+
+def test_failing_callback_does_not_stop_other_timers():
+    clock = FakeClock()
+    fired = []
+
+    async def boom():
+        raise RuntimeError("boom")
+
+    async def ok():
+        fired.append("ok")
+
+    async def main():
+        timers = TimerService(clock=clock)
+        timers.schedule("boom", 1, boom)
+        timers.schedule("ok", 1, ok)
+        clock.now += 1
+        assert timers.run_due() == 2
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert fired == ["ok"]
+
+
+def test_started_task_wakes_for_an_earlier_timer():
+    fired = []
+
+    async def main():
+        timers = TimerService()
+        timers.start()
+
+        async def fire():
+            fired.append("soon")
+
+        async def never():
+            fired.append("late")
+
+        timers.schedule("late", 60, never)
+        await asyncio.sleep(0)
+        timers.schedule("soon", 0.01, fire)
+        await asyncio.sleep(0.1)
+        timers.stop()
+
+    asyncio.run(main())
+    assert fired == ["soon"]
+
+
+def test_edit_budget_refills_at_rate():
+    clock = FakeClock()
+    budget = EditBudget(rate=2, burst=2, clock=clock)
+    assert [budget.try_acquire() for _ in range(3)] == [True, True, False]
+    clock.now += 0.5
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    clock.now += 10
+    # the bucket never holds more than burst
+    assert [budget.try_acquire() for _ in range(3)] == [True, True, False]
+    assert budget.denied == 3
+
+
+def test_timed_game_runs_on_its_clock(bot):
+    clock = FakeClock()
+    game = bot.XOGame(1, timed_mode=True, clock=clock)
+    seconds = bot.TIMED_MODE_SECONDS
+
+    clock.now += 10
+    assert game.make_move(0, 0)
+    assert game.time_left["X"] == seconds - 10
+    game.switch_player()
+    # O's time only starts running at X's move
+    assert game.deadline() == clock.now + seconds
+
+    clock.now += seconds - 1
+    assert game.check_timeout() is None
+    clock.now += 1
+    assert game.check_timeout() == "O"
+    assert not game.make_move(1, 1)
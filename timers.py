@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+TimerCallback = Callable[[], Awaitable[None]]
+
+
+class TimerService:
+    """
+    Every game deadline in one heap, driven by a single task on the event loop.
+
+    Each key (e.g. ("expire", chat_id)) has at most one live timer;
+    rescheduling a key just supersedes the old heap entry, which is
+    discarded lazily when it reaches the top. ``clock`` must be monotonic
+    and can be replaced in tests, which then call run_due() directly.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._live: Dict[Hashable, Tuple[int, TimerCallback]] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self.fired = 0
+
+    def schedule(self, key: Hashable, delay: float, callback: TimerCallback):
+        """تشغيل callback بعد delay ثانية (يستبدل أي مؤقت سابق بنفس المفتاح)"""
+        seq = next(self._seq)
+        self._live[key] = (seq, callback)
+        heapq.heappush(self._heap, (self.clock() + delay, seq, key))
+        if len(self._heap) > 2 * len(self._live) + 64:
+            self._compact()
+        if self._wakeup is not None and self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def cancel(self, key: Hashable):
+        self._live.pop(key, None)
+
+    def _compact(self):
+        self._heap = [e for e in self._heap if self._live.get(e[2], (None,))[0] == e[1]]
+        heapq.heapify(self._heap)
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap:
+            deadline, seq, key = self._heap[0]
+            if self._live.get(key, (None,))[0] == seq:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def run_due(self) -> int:
+        """
+        Fire every timer whose deadline has passed.
+
+        Returns:
+            int: number of callbacks started
+        """
+        now = self.clock()
+        started = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, seq, key = heapq.heappop(self._heap)
+            live = self._live.get(key)
+            if live is None or live[0] != seq:
+                continue
+            del self._live[key]
+            task = asyncio.get_running_loop().create_task(self._fire(key, live[1]))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            started += 1
+        self.fired += started
+        return started
+
+    async def _fire(self, key: Hashable, callback: TimerCallback):
+        try:
+            await callback()
+        except Exception as e:
+            logger.error(f"Timer {key!r} failed: {e}")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.run_due()
+
+    def start(self) -> asyncio.Task:
+        """Start the timer task on the running event loop."""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+
+class EditBudget:
+    """Token bucket shared by all background message edits."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self.denied = 0
+
+    def try_acquire(self) -> bool:
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        self.denied += 1
+        return False